@@ -0,0 +1,118 @@
+import argparse
+import csv
+import ipaddress
+import json
+import os
+
+# Offline IPv4 geolocation: a longest-prefix index built from CSV prefix tables, with a persistent cache for
+# the addresses that had to be looked up online. A prefix table has a `network` column in CIDR notation and
+# `latitude`/`longitude` (or `lat`/`lon`) columns, so GeoLite2-City-Blocks-IPv4.csv can be imported as is.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PREFIXES = os.path.join(HERE, 'geo_prefixes.csv')
+CACHE = os.path.join(HERE, 'geolocation_cache.json')
+
+# ip-api.com answers at most 100 addresses per batch request
+ONLINE_BATCH_SIZE = 100
+
+class PrefixIndex:
+    """Maps IPv4 prefixes to (lat, lon), one dict per prefix length, searched longest prefix first."""
+
+    def __init__(self):
+        self.tables = {}
+        self.lengths = []
+
+    def add(self, network, location):
+        network = ipaddress.IPv4Network(network, strict=False)
+        self.tables.setdefault(network.prefixlen, {})[int(network.network_address)] = location
+
+    def load_csv(self, path):
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                lat = row.get('latitude', row.get('lat'))
+                lon = row.get('longitude', row.get('lon'))
+                if row.get('network') and lat and lon:
+                    self.add(row['network'], (float(lat), float(lon)))
+        self.lengths = sorted(self.tables, reverse=True)
+
+    def lookup(self, ip):
+        address = int(ipaddress.IPv4Address(ip))
+        for length in self.lengths:
+            location = self.tables[length].get(address & (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF)
+            if location:
+                return location
+        return None
+
+def lookup_online(ips):
+    """Looks ips up on ip-api.com, ONLINE_BATCH_SIZE per request. Addresses it cannot locate map to None."""
+    # Only needed online
+    import requests
+
+    locations = {}
+    for i in range(0, len(ips), ONLINE_BATCH_SIZE):
+        batch = ips[i:i + ONLINE_BATCH_SIZE]
+        try:
+            response = requests.post("http://ip-api.com/batch?fields=status,message,query,lat,lon", json=batch, timeout=30)
+            for data in response.json():
+                if data['status'] == 'success':
+                    locations[data['query']] = (data['lat'], data['lon'])
+                else:
+                    print(f"Error: {data['query']}: {data.get('message')}")
+                    locations[data['query']] = None
+        except Exception as e:
+            print(f"Error: {e}")
+    return locations
+
+class Geolocator:
+    """
+    Locates IPv4 addresses from the prefix tables, then from the result cache. With online=True, the addresses
+    found in neither are looked up in batches on ip-api.com and the results (misses included) are added to the
+    cache, so each address goes to the network at most once.
+    """
+
+    def __init__(self, prefix_files=(PREFIXES,), cache_path=CACHE, online=False):
+        self.index = PrefixIndex()
+        for path in prefix_files:
+            self.index.load_csv(path)
+        self.cache_path = cache_path
+        self.online = online
+        self.cache = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'r') as f:
+                self.cache = {ip: tuple(location) if location else None for ip, location in json.load(f).items()}
+
+    def locate(self, ips):
+        """Returns {ip: (lat, lon) or None} for all ips."""
+        locations = {}
+        missing = []
+        for ip in dict.fromkeys(ips):
+            location = self.index.lookup(ip)
+            if location is None and ip in self.cache:
+                location = self.cache[ip]
+            elif location is None:
+                missing.append(ip)
+            locations[ip] = location
+
+        if missing and self.online:
+            found = lookup_online(missing)
+            locations.update(found)
+            self.cache.update(found)
+            self.save()
+        return locations
+
+    def save(self):
+        if not self.cache_path:
+            return
+        with open(self.cache_path + ".tmp", 'w') as f:
+            json.dump(self.cache, f, indent=1, sort_keys=True)
+        os.replace(self.cache_path + ".tmp", self.cache_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Geolocate IPv4 addresses from local prefix tables and the result cache.")
+    parser.add_argument("ips", nargs='+')
+    parser.add_argument("--prefixes", action='append', help=f"Prefix table CSV, can be repeated (default: {os.path.basename(PREFIXES)}).")
+    parser.add_argument("--online", action='store_true', help="Look addresses missing from the tables and the cache up on ip-api.com, and cache the results.")
+    args = parser.parse_args()
+    geolocator = Geolocator(args.prefixes or (PREFIXES,), online=args.online)
+    for ip, location in geolocator.locate(args.ips).items():
+        print(ip, *(location or ("unknown",)))
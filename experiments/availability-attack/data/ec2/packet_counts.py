@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', 'utils', 'pcap-reader'))
+
+import numpy as np
+from pcapreader import ip_str, iter_columns
+
+# One pass over a server capture, keeping only counters: packets per source IP, per AWS region and per source
+# and time bucket. The result is cached as JSON next to the capture (<capture>.counts.json), so table_gen.py
+# and density_map.py render from the cache and the capture is read once, in bounded memory, however long it is.
+
+BUCKET_SECONDS = 3600
+CACHE_VERSION = 1
+
+ip_region_map = {
+    '18.61.0.0':'ap-south-2',
+    '13.203.0.0':'ap-south-1',
+    '15.161.0.0':'eu-south-1',
+    '51.92.0.0':'eu-south-2',
+    '51.112.0.0':'me-central-1',
+    '51.17.0.0':'il-central-1',
+    '15.156.0.0':'ca-central-1',
+    '78.12.0.0':'mx-central-1',
+    '3.71.0.0':'eu-central-1',
+    '51.96.0.0':'eu-central-2',
+    '35.94.0.0':'us-west-2',
+    '13.245.0.0':'af-south-1',
+    '13.60.0.0':'eu-north-1',
+    '13.38.0.0':'eu-west-3',
+    '35.179.0.0':'eu-west-2',
+    '52.50.0.0':'eu-west-1',
+    '15.168.0.0':'ap-northeast-3',
+    '13.209.0.0':'ap-northeast-2',
+    '15.185.0.0':'me-south-1',
+    '15.229.0.0':'sa-east-1',
+    '43.198.0.0':'ap-east-1',
+    '40.176.0.0':'ca-west-1',
+    '3.27.0.0':'ap-southeast-2',
+    '43.218.0.0':'ap-southeast-3',
+    '16.50.0.0':'ap-southeast-4',
+    '43.216.0.0':'ap-southeast-5',
+    '3.142.0.0':'us-east-2',
+    '43.208.0.0':'ap-southeast-7',
+    '18.141.0.0':'ap-southeast-1',
+    '13.57.0.0':'us-west-1',
+    '52.68.0.0':'ap-northeast-1',
+    '3.95.0.0':'us-east-1',
+}
+
+def cache_path(pcap_file):
+    return os.path.splitext(pcap_file)[0] + ".counts.json"
+
+def count_packets(pcap_file, bucket_seconds=BUCKET_SECONDS):
+    """Counts the IPv4 packets of pcap_file per source, region and (source, time bucket), streaming the capture."""
+    sources = {}
+    buckets = Counter()
+    for columns in iter_columns(pcap_file):
+        ipv4 = columns['version'] == 4
+        src = columns['src'][ipv4]
+        # Sources are kept in order of first appearance, as counting packet by packet would give
+        addresses, first_seen, counts = np.unique(src, return_index=True, return_counts=True)
+        for i in np.argsort(first_seen, kind='stable'):
+            address = int(addresses[i])
+            sources[address] = sources.get(address, 0) + int(counts[i])
+        start = (np.floor(columns['ts'][ipv4] / bucket_seconds) * bucket_seconds).astype(np.int64)
+        pairs, counts = np.unique(np.stack([src.astype(np.int64), start]), axis=1, return_counts=True)
+        for (address, bucket), count in zip(pairs.T.tolist(), counts.tolist()):
+            buckets[(address, bucket)] += count
+
+    source_counts = {ip_str(address): count for address, count in sources.items()}
+    regions = Counter()
+    for ip, count in source_counts.items():
+        regions[ip_region_map.get(ip, "Unknown")] += count
+    per_bucket = {}
+    for (address, bucket), count in sorted(buckets.items(), key=lambda item: item[0][1]):
+        per_bucket.setdefault(ip_str(address), {})[str(bucket)] = count
+    return {
+        'bucket_seconds': bucket_seconds,
+        'sources': source_counts,
+        'regions': dict(regions),
+        'buckets': per_bucket,
+    }
+
+def load_counts(pcap_file, bucket_seconds=BUCKET_SECONDS):
+    """The counts of pcap_file, from the cache if it matches the capture (size and mtime) and bucket size."""
+    stat = os.stat(pcap_file)
+    key = {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'bucket_seconds': bucket_seconds}
+    path = cache_path(pcap_file)
+    try:
+        with open(path, 'r') as f:
+            cached = json.load(f)
+        if cached.get('capture') == key:
+            return cached
+    except (OSError, ValueError):
+        pass
+
+    counts = count_packets(pcap_file, bucket_seconds)
+    counts['capture'] = key
+    with open(path + ".tmp", 'w') as f:
+        json.dump(counts, f, indent=1)
+    os.replace(path + ".tmp", path)
+    return counts
+
+def count_packets_per_source_ip(pcap_file):
+    return Counter(load_counts(pcap_file)['sources'])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count the packets of a server capture per source, region and time bucket, and cache the counts next to it.")
+    parser.add_argument("pcap_file")
+    parser.add_argument("--bucket", type=int, default=BUCKET_SECONDS, help=f"Time bucket in seconds (default: {BUCKET_SECONDS}).")
+    args = parser.parse_args()
+    counts = load_counts(args.pcap_file, args.bucket)
+    print(f"{sum(counts['sources'].values())} packets from {len(counts['sources'])} sources -> {cache_path(args.pcap_file)}")
@@ -1,40 +1,4 @@
-from scapy.all import rdpcap
-from collections import Counter
-
-ip_region_map = {
-    '18.61.0.0':'ap-south-2',
-    '13.203.0.0':'ap-south-1',
-    '15.161.0.0':'eu-south-1',
-    '51.92.0.0':'eu-south-2',
-    '51.112.0.0':'me-central-1',
-    '51.17.0.0':'il-central-1',
-    '15.156.0.0':'ca-central-1',
-    '78.12.0.0':'mx-central-1',
-    '3.71.0.0':'eu-central-1',
-    '51.96.0.0':'eu-central-2',
-    '35.94.0.0':'us-west-2',
-    '13.245.0.0':'af-south-1',
-    '13.60.0.0':'eu-north-1',
-    '13.38.0.0':'eu-west-3',
-    '35.179.0.0':'eu-west-2',
-    '52.50.0.0':'eu-west-1',
-    '15.168.0.0':'ap-northeast-3',
-    '13.209.0.0':'ap-northeast-2',
-    '15.185.0.0':'me-south-1',
-    '15.229.0.0':'sa-east-1',
-    '43.198.0.0':'ap-east-1',
-    '40.176.0.0':'ca-west-1',
-    '3.27.0.0':'ap-southeast-2',
-    '43.218.0.0':'ap-southeast-3',
-    '16.50.0.0':'ap-southeast-4',
-    '43.216.0.0':'ap-southeast-5',
-    '3.142.0.0':'us-east-2',
-    '43.208.0.0':'ap-southeast-7',
-    '18.141.0.0':'ap-southeast-1',
-    '13.57.0.0':'us-west-1',
-    '52.68.0.0':'ap-northeast-1',
-    '3.95.0.0':'us-east-1',
-}
+from packet_counts import count_packets_per_source_ip, ip_region_map
 
 region_common_map = {
     'ap-south-2': 'Asia Pacific (Hyderabad)',
@@ -71,16 +35,6 @@ region_common_map = {
     'us-east-1': 'US East (N. Virginia)',
 }
 
-def count_packets_per_source_ip(pcap_file):
-    packets = rdpcap(pcap_file)
-    src_ip_counter = Counter()
-    for pkt in packets:
-        if 'IP' in pkt:
-            src_ip = pkt['IP'].src
-            src_ip_counter[src_ip] += 1
-
-    return src_ip_counter
-
 def gen_table(ip_counter):
 # Generate LaTeX table
     header = "\\begin{table}[h!]\n\\small\n\\centering\n\\begin{tabular}{lr}"
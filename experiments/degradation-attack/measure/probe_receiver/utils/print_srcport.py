@@ -1,7 +1,10 @@
-from scapy.all import *
+import os
 import sys
 
-for pkt in PcapReader(sys.argv[1]):
-    if pkt.haslayer(IP) and pkt.haslayer(UDP):
-        if pkt[IP].dst == "142.93.0.0":
-            print(pkt[UDP].sport)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', '..', 'utils', 'pcap-reader'))
+
+from pcapreader import iter_packets
+
+for pkt in iter_packets(sys.argv[1], udp_only=True):
+    if pkt.dst == "142.93.0.0":
+        print(pkt.sport)
@@ -1,3 +1,6 @@
+import argparse
+import asyncio
+import json
 import socket
 import time
 import random
@@ -9,6 +12,11 @@ SOURCE_PORT = 0
 SPECIAL_PAYLOAD = bytes.fromhex("c700000001109422a1011be01c6cfd6d44976055fa2510a8020f889ec01bff5a1d9dc4de861de30040e1662953d714d04f7d383cc874ea1e268287c0de7e17ed99ff64900b9e14af6d32f4e4e74339ead6d8fa54c77b928e0907c46cb76c6c960b9e3b5c71bbdccb1e6b349bc25031fc46e07a36789d456e35347d71eb243fc70233e9885ac46bf92828cbc59bda247335890b9e12262cc73f92a37e5149c741264307870860e6fed1212faa82ad0e2996c0739eff8b8535719f013407566ea1ca450003fe8da6327ebd9b9a218635bc644049b189b0422944ac35511e69b85a08de735a55383aaa1ebc9efdcbb6866c8d70c8940ca7daec9f7e502ceedfd6d8d804a931b2ee3b443af579")
 EXPERIMENT_REPEATS = 20  
 FOLLOWUP_COUNT = 100  
+TRIGGER_COUNT = 9
+TRIGGER_WAIT = 5
+FOLLOWUP_TTL = 64
+# First server port of a sweep, TTL t going to SWEEP_PORT_BASE + t - 1: a high range, clear of well-known services
+SWEEP_PORT_BASE = 40000
 
 
 def send_packet(sock, payload, ttl, target_ip, dest_port):
@@ -24,18 +32,85 @@ def run_experiment(ttl):
     try:
         
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            for _ in range(1, 10):
+            for _ in range(TRIGGER_COUNT):
                 send_packet(sock, SPECIAL_PAYLOAD, ttl, TARGET_IP, DEST_PORT)
-            time.sleep(5)
+            time.sleep(TRIGGER_WAIT)
             
             for _ in range(FOLLOWUP_COUNT):
-                send_packet(sock, FOLLOWUP_PAYLOAD, 64, TARGET_IP, DEST_PORT)
+                send_packet(sock, FOLLOWUP_PAYLOAD, FOLLOWUP_TTL, TARGET_IP, DEST_PORT)
 
     except Exception as e:
         print(f"Error during experiment {experiment + 1}: {e}")
 
 
+async def sweep_ttl(ttl, target_ip, dest_port):
+    """
+    One TTL of a sweep, on its own socket: the triggers with the given TTL, then after TRIGGER_WAIT seconds the
+    follow-ups, tagged with the TTL and source port. Returns the schedule record of this TTL.
+    """
+    loop = asyncio.get_running_loop()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        sock.bind(('', SOURCE_PORT))
+        source_port = sock.getsockname()[1]
+        followup_payload = f"Experiment {ttl} {source_port}"
+
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        trigger_ts = time.time()
+        for _ in range(TRIGGER_COUNT):
+            await loop.sock_sendto(sock, SPECIAL_PAYLOAD, (target_ip, dest_port))
+        await asyncio.sleep(TRIGGER_WAIT)
+
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, FOLLOWUP_TTL)
+        followup_ts = time.time()
+        for _ in range(FOLLOWUP_COUNT):
+            await loop.sock_sendto(sock, followup_payload.encode(), (target_ip, dest_port))
+
+    return {
+        'ttl': ttl, 'src_port': source_port, 'dst_ip': target_ip, 'dst_port': dest_port,
+        'trigger_ts': trigger_ts, 'triggers': TRIGGER_COUNT,
+        'followup_ts': followup_ts, 'followups': FOLLOWUP_COUNT, 'payload': followup_payload,
+    }
+
+
+async def run_sweep(target_ip, port_base, ttls, same_port=False):
+    """
+    All TTLs at once. Residual blocking covers the 3-tuple (client, server, server port), so unless same_port
+    is set, TTL t is sent to port_base + t - 1 and blocking triggered at one TTL cannot drop another's follow-ups.
+    This assumes the censor treats those ports alike; with same_port, all TTLs go to port_base.
+    """
+    return await asyncio.gather(*(
+        sweep_ttl(ttl, target_ip, port_base if same_port else port_base + ttl - 1) for ttl in ttls
+    ))
+
+
 if __name__ == "__main__":
-    for i in range(EXPERIMENT_REPEATS):
-        print(f"Starting experiment {i + 1}/{EXPERIMENT_REPEATS}")
-        run_experiment(ttl=i+1)
+    parser = argparse.ArgumentParser(description="Send QUIC Initials with increasing TTLs, each followed by UDP payloads with TTL 64.")
+    parser.add_argument("--target", default=TARGET_IP, help=f"Server IP (default: {TARGET_IP}).")
+    parser.add_argument("--port", type=int, default=DEST_PORT, help=f"Server port, also of every TTL with --sweep --same_port (default: {DEST_PORT}).")
+    parser.add_argument("--port_base", type=int, default=SWEEP_PORT_BASE, help=f"With --sweep, the server port of TTL 1; TTL t goes to port_base + t - 1 (default: {SWEEP_PORT_BASE}).")
+    parser.add_argument("--ttls", type=int, default=EXPERIMENT_REPEATS, help=f"Highest TTL to try (default: {EXPERIMENT_REPEATS}).")
+    parser.add_argument("--sweep", action="store_true", help="Try all TTLs concurrently, each from its own source port and to its own server port, instead of one after the other.")
+    parser.add_argument("--same_port", action="store_true", help="With --sweep, send all TTLs to --port, as without --sweep. Blocking triggered at one TTL then also drops the follow-ups of the others.")
+    parser.add_argument("--schedule", default="schedule.jsonl", help="With --sweep, write one JSON record per TTL (ports, send times, follow-up payload) to this file for parse_quic_pcaps.py -s (default: schedule.jsonl).")
+    args = parser.parse_args()
+    if not 1 <= args.port <= 65535:
+        parser.error(f"--port {args.port} is not a port number")
+    if args.sweep and not args.same_port and not (1024 <= args.port_base and args.port_base + args.ttls - 1 <= 65535):
+        parser.error(f"--port_base {args.port_base} with --ttls {args.ttls} needs ports outside 1024-65535")
+
+    if args.sweep:
+        ports = f"port {args.port}" if args.same_port else f"ports {args.port_base}-{args.port_base + args.ttls - 1}"
+        print(f"Starting sweep of TTLs 1-{args.ttls} to {ports}")
+        start = time.monotonic()
+        port_base = args.port if args.same_port else args.port_base
+        schedule = asyncio.run(run_sweep(args.target, port_base, range(1, args.ttls + 1), args.same_port))
+        with open(args.schedule, 'w') as f:
+            for record in schedule:
+                f.write(json.dumps(record) + '\n')
+        print(f"Sent {len(schedule)} TTLs in {time.monotonic() - start:.1f} s; schedule written to {args.schedule}")
+    else:
+        TARGET_IP, DEST_PORT = args.target, args.port
+        for i in range(args.ttls):
+            print(f"Starting experiment {i + 1}/{args.ttls}")
+            run_experiment(ttl=i+1)
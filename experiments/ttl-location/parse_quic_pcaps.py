@@ -3,121 +3,205 @@
 parse_quic_pcaps.py
 ==============
 
-Scan a pcap for **gaps of > 3 minutes** between consecutive frames and
-dump each surrounding pair:
+Scan QUIC TTL captures for **gaps of > 3 minutes** between consecutive
+frames. Each gap ends a repetition of the TTL sweep; if the last frame
+before it is the follow-up payload "Experiment <ttl>", the Initial sent
+with the next TTL was the first to reach the censor.
+
+Only the timestamps are read for every frame (in batches, with
+pcapreader.iter_columns), and only the frames before the gaps are decoded.
 
 Usage
 -----
     python parse_quic_pcaps.py -f beijing-ttl_anon.pcap
+    python parse_quic_pcaps.py -d ./data/QUIC -j 0 -o hops.csv
+
+For a concurrent sweep (check-quic.py --sweep), the schedule it wrote says
+which follow-ups belong to which TTL; the blocking hop is the lowest TTL
+none of whose follow-ups arrived, above one whose follow-ups did (if none
+arrived at all, the capture is the wrong one and it exits with an error):
+
+    python parse_quic_pcaps.py -f sweep.pcap -s schedule.jsonl
 """
 
 import argparse
+import csv
+import json
+import mmap
+import multiprocessing
+import os
+import re
 import sys
-from scapy.all import PcapReader, raw  # type: ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "utils", "pcap-reader"))
+
+import numpy as np
+from pcapreader import iter_columns, read_columns
 
 # ---------------------------------------------------------------------------
 # Variables
 # ---------------------------------------------------------------------------
 MIN_GAP      = 180     # seconds (3 min)
 MAX_GAP      = 1000     # seconds
-HEADER_SKIP  = 42      # bytes to skip from start of frame (Ether+IP+UDP)
-TRIM_BYTES   = 5       # bytes to drop from the tail
-LINE_WIDTH   = 16      # bytes per line for hex / ASCII
+LAST_TTL     = 20      # TTL of the last experiment of a repetition
 # ---------------------------------------------------------------------------
 
-
-def ascii_only(data: bytes, width: int = LINE_WIDTH) -> str:
-    """Printable ASCII, dots for others, wrapped every <width> chars."""
-    s = "".join(chr(b) if 32 <= b <= 126 else "." for b in data)
-    return "\n".join(s[i:i + width] for i in range(0, len(s), width)) or "[empty payload]"
-
-
-def hex_bytes(data: bytes, width: int = LINE_WIDTH) -> str:
-    """Hex pairs separated by spaces, wrapped every <width> bytes."""
-    return (
-        "\n".join(
-            " ".join(f"{b:02x}" for b in data[i:i + width])
-            for i in range(0, len(data), width)
-        )
-        or "[empty payload]"
-    )
-
-
-def extract_payload(packet: bytes) -> bytes:
-    """Return payload[HEADER_SKIP : -TRIM_BYTES], guarding against short frames."""
-    if len(packet) <= HEADER_SKIP + TRIM_BYTES:
-        return b""
-    return packet[HEADER_SKIP:-TRIM_BYTES]
+EXPERIMENT = re.compile(rb"Experiment (\d+)")
+
+FIELDS = ["vantage_point", "run", "repetition", "start", "end", "gap", "last_ttl", "blocking_hop", "counted"]
+
+
+def find_gaps(pcap_file: str):
+    """
+    Return the time of the first frame and, for each gap >= MIN_GAP, (time, gap, payload offset, payload length)
+    of the frame before it, reading the capture in batches of timestamps.
+    """
+    first = None
+    prev = None
+    gaps = []
+    for columns in iter_columns(pcap_file):
+        ts, offsets, lengths = columns["ts"], columns["payload_offset"], columns["payload_len"]
+        if not len(ts):
+            continue
+        if first is None:
+            first = ts[0]
+        # The previous batch's last frame comes before this batch's first
+        if prev is not None:
+            ts = np.concatenate(([prev[0]], ts))
+            offsets = np.concatenate(([prev[1]], offsets))
+            lengths = np.concatenate(([prev[2]], lengths))
+
+        diffs = np.diff(ts)
+        for i in np.flatnonzero(diffs >= MIN_GAP):
+            gaps.append((float(ts[i]), float(diffs[i]), int(offsets[i]), int(lengths[i])))
+        prev = ts[-1], offsets[-1], lengths[-1]
+    return first, gaps
+
+
+def analyse(pcap_file: str):
+    """One row per repetition of the TTL sweep in pcap_file (the frames up to a gap), in FIELDS order."""
+    first, gaps = find_gaps(pcap_file)
+    vantage_point = os.path.basename(pcap_file).split("-")[0]
+    rows = []
+    start = first
+    between_runs = None
+    with open(pcap_file, "rb") as f:
+        for repetition, (end, gap, offset, length) in enumerate(gaps, start=1):
+            f.seek(offset)
+            match = EXPERIMENT.match(f.read(length))
+            last_ttl = int(match.group(1)) if match else None
+            blocked = last_ttl is not None and last_ttl < LAST_TTL and gap < MAX_GAP
+            # We do not use any gaps between subsequent runs (20 iterations == 1 run), nor the gaps
+            # ending less than MAX_GAP after one
+            counted = blocked and (between_runs is None or end >= between_runs + MAX_GAP)
+            if not blocked and gap < MAX_GAP and (between_runs is None or end >= between_runs + MAX_GAP):
+                between_runs = end
+            rows.append({
+                "vantage_point": vantage_point, "run": pcap_file, "repetition": repetition,
+                "start": round(start - first, 6), "end": round(end - first, 6), "gap": round(gap, 6),
+                "last_ttl": last_ttl, "blocking_hop": last_ttl + 1 if blocked else None, "counted": int(counted),
+            })
+            start = end + gap
+    return rows
 
 
 def main(pcap_file: str) -> None:
-    reader = PcapReader(pcap_file)
-
-    prev_pkt = prev_idx = prev_rel_time = first_time = None
-
-    results = []
-    for idx, pkt in enumerate(reader, start=1):
-        if first_time is None:
-            first_time = pkt.time
-        rel_time = pkt.time - first_time
-
-        # ---------------- gap detection ----------------
-        if prev_pkt is not None:
-            gap = rel_time - prev_rel_time
-            if MIN_GAP <= gap < MAX_GAP:
-                prev_payload = extract_payload(raw(prev_pkt))
-                cur_payload  = extract_payload(raw(pkt))
-
-                # We do not use any gaps between subequent runs (20 iterations == 1 run)
-                if 'Experiment 20' in ascii_only(prev_payload) or 'Experiment' not in ascii_only(prev_payload):
-                    continue
-
-                # print("=" * 72)
-                # print(">>> GAP DETECTED <<<")
-                # print(f"  Current Packet Number : {idx}")
-                # print(f"  Previous Packet Number: {prev_idx}")
-                # print(f"  Exact Time Gap       : {gap:.6f} seconds\n")
-
-                # ---- previous packet ----
-                # print(f"--- HEX payload for PREVIOUS Packet ({prev_idx}) ---")
-                # print(hex_bytes(prev_payload))
-                # print(f"\n--- ASCII payload for PREVIOUS Packet ({prev_idx}) ---")
-                # print(ascii_only(prev_payload))
-
-                results.append(ascii_only(prev_payload))
-
-                # print()
-
-                # # ---- current packet ----
-                # print(f"--- HEX payload for CURRENT Packet ({idx}) ---")
-                # print(hex_bytes(cur_payload))
-                # print(f"\n--- ASCII payload for CURRENT Packet ({idx}) ---")
-                # print(ascii_only(cur_payload))
-                # print()
-
-        # Slide window
-        prev_pkt, prev_idx, prev_rel_time = pkt, idx, rel_time
-
-    reader.close()
-    last_seen_hop = min(int("".join(c for c in x if c.isdigit())) for x in results)
-
+    hops = [row["blocking_hop"] for row in analyse(pcap_file) if row["counted"]]
+    print("Blocking Hop", min(hops))
+
+
+def analyse_sweep(pcap_file: str, schedule_file: str):
+    """Count the follow-ups of each TTL of a sweep that arrived. Returns [(schedule record, received)] by TTL."""
+    with open(schedule_file, "r") as f:
+        schedule = sorted((json.loads(line) for line in f if line.strip()), key=lambda record: record["ttl"])
+    received = {record["payload"].encode(): 0 for record in schedule}
+
+    # Only the payloads of UDP frames to a sweep port, with the length of a follow-up, are read
+    columns = read_columns(pcap_file)
+    candidates = (
+        (columns["proto"] == 17)
+        & np.isin(columns["dport"], [record["dst_port"] for record in schedule])
+        & np.isin(columns["payload_len"], [len(payload) for payload in received])
+    )
+    if candidates.any():
+        with open(pcap_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset, length in zip(columns["payload_offset"][candidates].tolist(), columns["payload_len"][candidates].tolist()):
+                payload = data[offset:offset + length]
+                if payload in received:
+                    received[payload] += 1
+    return [(record, received[record["payload"].encode()]) for record in schedule]
+
+
+def main_sweep(pcap_file: str, schedule_file: str) -> None:
+    counts = analyse_sweep(pcap_file, schedule_file)
+    for record, received in counts:
+        print(f"TTL {record['ttl']} (port {record['dst_port']}): {received}/{record['followups']} follow-ups received")
+    if not any(received for _, received in counts):
+        sys.exit(f"No follow-ups of {schedule_file} in {pcap_file}: wrong capture or host, or it was not running?")
+
+    # Only a TTL above one whose follow-ups arrived shows blocking, rather than traffic the capture missed
+    hop = None
+    captured = False
+    for record, received in counts:
+        if received:
+            captured = True
+        elif captured:
+            hop = record["ttl"]
+            break
+    print("Blocking Hop", hop)
+
+
+def main_batch(paths, jobs: int, output) -> None:
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    files = sorted(
+        os.path.join(root, name)
+        for path in paths
+        for root, _, names in (os.walk(path) if os.path.isdir(path) else [(os.path.dirname(path), None, [os.path.basename(path)])])
+        for name in names
+        if name.endswith((".pcap", ".pcapng"))
+    )
 
-    # print(last_seen_hop)
-    print("Blocking Hop", last_seen_hop+1)
+    writer = csv.DictWriter(output, fieldnames=FIELDS, lineterminator="\n")
+    writer.writeheader()
+    summary = []
+    with multiprocessing.Pool(min(jobs, len(files) or 1)) as pool:
+        for rows in pool.imap(analyse, files):
+            writer.writerows(rows)
+            hops = [row["blocking_hop"] for row in rows if row["counted"]]
+            if rows:
+                summary.append((rows[0]["vantage_point"], rows[0]["run"], min(hops) if hops else None, len(hops), len(rows)))
+    output.flush()
 
+    for vantage_point, run, hop, counted, repetitions in summary:
+        print(f"{vantage_point}\t{run}\tBlocking Hop {hop}\t({counted}/{repetitions} repetitions counted)", file=sys.stderr)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description=(
-            "Find > 3 minute gaps in a pcap and dump payload bytes "
-            f"(skip first {HEADER_SKIP}, trim last {TRIM_BYTES})."
+            "Find > 3 minute gaps in QUIC TTL captures and infer the blocking hop "
+            "from the follow-up payload before each gap."
         )
     )
-    parser.add_argument("-f", "--file", required=True, help="PCAP file to scan")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("-f", "--file", help="PCAP file to scan; prints its blocking hop")
+    target.add_argument("-d", "--dir", nargs="+", help="Directories (or files) to scan; writes one CSV row per repetition, and the blocking hop per capture to stderr")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="With --dir, the number of worker processes (0: one per core; default: 0)")
+    parser.add_argument("-o", "--output", help="With --dir, write the CSV to this file instead of stdout")
+    parser.add_argument("-s", "--schedule", help="With --file, the schedule written by check-quic.py --sweep; counts the follow-ups of each TTL instead of looking for gaps")
     args = parser.parse_args()
 
     try:
-        main(args.file)
+        if args.file and args.schedule:
+            main_sweep(args.file, args.schedule)
+        elif args.file:
+            main(args.file)
+        else:
+            if args.output:
+                with open(args.output, "w", newline="") as output:
+                    main_batch(args.dir, args.jobs, output)
+            else:
+                main_batch(args.dir, args.jobs, sys.stdout)
     except KeyboardInterrupt:
         sys.exit("\nInterrupted by user")
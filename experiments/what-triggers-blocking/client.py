@@ -1,35 +1,183 @@
+import argparse
+import collections
+import hashlib
+import json
+import resource
 import socket
 import sys
+import time
 from time import sleep
 
-def send_packets(server_ip, server_port, payload_file, packet_count, wait):
+# Pacing: sleep until this close to a send time, then spin on the clock for the rest.
+SPIN_THRESHOLD = 0.0005
+# Paced mode keeps at most this many sockets open by default (and fewer if the open-file limit is lower),
+# opening a new one after each send.
+MAX_SOCKETS = 1024
+
+def send_packets(server_ip, server_port, payload_file, packet_count, wait, records=False):
     try:
         # Load binary payload
         with open(payload_file, 'rb') as file:
             payload = file.read()
+        digest = hashlib.sha256(payload).hexdigest()
 
-        print(f"Sending {packet_count} packets to {server_ip}...")
-        for _ in range(packet_count):
+        if not records:
+            print(f"Sending {packet_count} packets to {server_ip}...")
+        for seq in range(packet_count):
             # Create a UDP socket
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            client_socket.sendto(payload, (server_ip, server_port))
-            print(f"Sent packet from {client_socket.getsockname()[0]}:{client_socket.getsockname()[1]} to {server_ip}:{server_port}.")
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client_socket:
+                client_socket.sendto(payload, (server_ip, server_port))
+                if records:
+                    print(send_record(seq, time.time(), client_socket.getsockname(), server_ip, server_port, payload, digest), flush=True)
+                else:
+                    print(f"Sent packet from {client_socket.getsockname()[0]}:{client_socket.getsockname()[1]} to {server_ip}:{server_port}.")
             sleep(wait)
 
-        print(f"Successfully sent {packet_count} packets.")
-        client_socket.close()
+        if records:
+            print(json.dumps({'summary': {'sent': packet_count}}))
+        else:
+            print(f"Successfully sent {packet_count} packets.")
     except Exception as e:
+        report_error(e, records)
+
+def send_record(seq, ts, source, server_ip, server_port, payload, digest):
+    """One JSON line per sent packet, with the same fields as receiver.py's records."""
+    return json.dumps({
+        'event': 'send', 'seq': seq, 'ts': ts, 'src': source[0], 'sport': source[1],
+        'dst': server_ip, 'dport': server_port, 'len': len(payload), 'sha256': digest,
+    })
+
+def report_error(e, records):
+    if records:
+        print(json.dumps({'error': str(e)}))
+    else:
         print(f"An error occurred: {e}")
 
+def socket_window():
+    """How many sockets paced mode keeps open by default: MAX_SOCKETS, within the soft open-file limit."""
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return MAX_SOCKETS
+    return max(1, min(MAX_SOCKETS, soft - 64))
+
+def open_socket():
+    """Opens a UDP socket bound to its own ephemeral source port. Returns (socket, (source ip, source port))."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('', 0))
+    return sock, sock.getsockname()
+
+def print_sent(sent, wall_offset, server_ip, server_port, payload, records):
+    """Prints the log of paced sends, (monotonic send time, scheduled time, source) each."""
+    if records:
+        digest = hashlib.sha256(payload).hexdigest()
+        print('\n'.join(send_record(seq, actual + wall_offset, source, server_ip, server_port, payload, digest)
+                        for seq, (actual, _, source) in enumerate(sent)))
+    else:
+        for _, _, (source_ip, source_port) in sent:
+            print(f"Sent packet from {source_ip}:{source_port} to {server_ip}:{server_port}.")
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def send_packets_paced(server_ip, server_port, payload_file, packet_count, wait, pool_size=None, quiet=False, records=False):
+    """
+    Sends packet_count packets, one every `wait` seconds (fractions allowed), from pre-opened sockets.
+
+    By default every packet leaves from a fresh socket, as in send_packets(): a window of sockets (see
+    socket_window()) is opened up front, and each one is closed after its send and replaced while waiting for
+    the next send time. With pool_size, that many sockets are opened and reused round-robin instead. Send
+    times are scheduled on the monotonic clock from the start of the run, so delays do not accumulate, and the
+    send log is printed only after the last packet, or before the error if sending fails.
+    """
+    sockets = collections.deque()
+    sent = []
+    payload = b''
+    wall_offset = 0
+    try:
+        with open(payload_file, 'rb') as file:
+            payload = file.read()
+
+        fresh = not pool_size
+        for _ in range(min(socket_window() if fresh else pool_size, packet_count)):
+            sockets.append(open_socket())
+        destination = (server_ip, server_port)
+        if not records:
+            print(f"Sending {packet_count} packets to {server_ip}...")
+
+        start = time.monotonic()
+        # Converts the monotonic send times to wall-clock timestamps for the records.
+        wall_offset = time.time() - start
+        for i in range(packet_count):
+            target = start + i * wait
+            remaining = target - time.monotonic()
+            if remaining > SPIN_THRESHOLD:
+                sleep(remaining - SPIN_THRESHOLD)
+            while time.monotonic() < target:
+                pass
+            if fresh:
+                sock, source = sockets.popleft()
+                sock.sendto(payload, destination)
+                sent.append((time.monotonic(), target, source))
+                sock.close()
+                if i + len(sockets) + 1 < packet_count:
+                    sockets.append(open_socket())
+            else:
+                sock, source = sockets[i % len(sockets)]
+                sock.sendto(payload, destination)
+                sent.append((time.monotonic(), target, source))
+
+        if not sent:
+            if records:
+                print(json.dumps({'summary': {'sent': 0}}))
+            else:
+                print("Successfully sent 0 packets.")
+            return
+
+        # Rate and jitter: how far each send landed from its scheduled time.
+        lateness = sorted((actual - target) * 1e6 for actual, target, _ in sent)
+        duration = sent[-1][0] - sent[0][0]
+        rate = (packet_count - 1) / duration if duration > 0 else float('inf')
+
+        logged, sent = sent, []
+        if records or not quiet:
+            print_sent(logged, wall_offset, server_ip, server_port, payload, records)
+        if records:
+            print(json.dumps({'summary': {
+                'sent': packet_count, 'rate': rate if duration > 0 else None, 'duration': duration,
+                'jitter_us': {'mean': sum(lateness) / len(lateness), 'p50': percentile(lateness, 0.5),
+                              'p99': percentile(lateness, 0.99), 'max': lateness[-1]},
+            }}))
+        else:
+            print(f"Successfully sent {packet_count} packets.")
+            print(f"Achieved rate: {rate:.1f} packets/s (target {1 / wait if wait > 0 else float('inf'):.1f}) over {duration:.6f} s.")
+            print(f"Send jitter (us): mean {sum(lateness) / len(lateness):.1f}, p50 {percentile(lateness, 0.5):.1f}, "
+                  f"p99 {percentile(lateness, 0.99):.1f}, max {lateness[-1]:.1f}.")
+    except Exception as e:
+        # The packets that did leave are still logged, so the receiver's records of them can be attributed
+        if sent and (records or not quiet):
+            print_sent(sent, wall_offset, server_ip, server_port, payload, records)
+        report_error(e, records)
+    finally:
+        for sock, _ in sockets:
+            sock.close()
+
 if __name__ == "__main__":
-    if len(sys.argv) != 6:
-        print("Usage: python client.py <server_ip> <server_port> <payload_file> <packet_count> <wait>")
+    parser = argparse.ArgumentParser(description="Send a payload over UDP, from a fresh source port per packet.")
+    parser.add_argument("server_ip")
+    parser.add_argument("server_port", type=int)
+    parser.add_argument("payload_file")
+    parser.add_argument("packet_count", type=int)
+    parser.add_argument("wait", type=float, help="Seconds between packets; fractions are allowed with --paced.")
+    parser.add_argument("--paced", action="store_true", help="Pre-open the sockets and pace sends on the monotonic clock, logging after the run and reporting the achieved rate and jitter.")
+    parser.add_argument("--sockets", type=int, default=None, help="With --paced, pre-open this many sockets and reuse them round-robin (default: a fresh socket per packet, at most %d open at once)." % MAX_SOCKETS)
+    parser.add_argument("-q", "--quiet", action="store_true", help="With --paced, do not print a line per packet.")
+    parser.add_argument("--json", action="store_true", help="Print one JSON record per sent packet, then a {\"summary\": ...} line (or an {\"error\": ...} line), instead of the text log.")
+    if len(sys.argv) < 6:
+        print("Usage: python client.py <server_ip> <server_port> <payload_file> <packet_count> <wait> [--paced] [--sockets N] [-q] [--json]")
         sys.exit(1)
+    args = parser.parse_args()
 
-    server_ip = sys.argv[1]
-    server_port = int(sys.argv[2])
-    payload_file = sys.argv[3]
-    packet_count = int(sys.argv[4])
-    wait = int(sys.argv[5])
-
-    send_packets(server_ip, server_port, payload_file, packet_count, wait)
+    if args.paced:
+        send_packets_paced(args.server_ip, args.server_port, args.payload_file, args.packet_count, args.wait, args.sockets, args.quiet, args.json)
+    else:
+        send_packets(args.server_ip, args.server_port, args.payload_file, args.packet_count, args.wait, args.json)
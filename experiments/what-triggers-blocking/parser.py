@@ -1,5 +1,8 @@
 import pandas as pd
 import argparse
+import io
+import os
+import time
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 from common import *
@@ -49,79 +52,151 @@ experiment_map = {
     16: 10,
 }
 
-# Set up argument parser
-parser = argparse.ArgumentParser(description="Process a CSV file of packet data.")
-parser.add_argument("csv_file", help="Path to the CSV file containing the data.")
-
-# Parse the CLI arguments
-args = parser.parse_args()
-
-try:
-    df = pd.read_csv(args.csv_file)
-except FileNotFoundError:
-    print(f"Error: File '{args.csv_file}' not found.")
-    exit(1)
-
-# Calculate success rate as percentages
-df["success_rate"] = (df["packets_received"] / df["packet_count"]) * 100
-
-# Extract experiment number from payload
-df["true_experiment"] = df["payload"].str.extract(r'exp(\d+)').astype(int)
-df["Experiment"] = df["true_experiment"].map(experiment_map)
-
-# Map IPs to names
-df["src_name"] = df["src"].map(ip_to_name)
-df["dst_name"] = df["dst"].map(ip_to_name)
-
-# Create src-dst pair
-df["Source -> Destination"] = df["src_name"] + " -> " + df["dst_name"]
-
-# Drop Rows we are not interested in
-for index, row in df.iterrows():
-    if row["src_name"] == "Tencent 9" or row["dst_name"] == "Tencent 9":
-        df.drop(index, inplace=True)
-    elif row["src_name"] == "CU Boulder" or row["dst_name"] == "CU Boulder":
-        df.drop(index, inplace=True)
-    elif row["src_name"] == "DigitalOcean NYC1" or row["dst_name"] == "DigitalOcean NYC1":
-        df.drop(index, inplace=True)
-    elif row["src_name"] == "Stanford" or row["dst_name"] == "Stanford":
-        df.drop(index, inplace=True)
-    elif row["src_name"] == "Frankfurt" or row["dst_name"] == "Frankfurt":
-        df.drop(index, inplace=True)
-    elif row["src_name"] == "Tencent Beijing" or row["dst_name"] == "Tencent Beijing":
-        df.drop(index, inplace=True)
-
-df["inside"] = False
-# Drop rows going outside in
-for index, row in df.iterrows():
-    if row["src"] in outside_ips:
-        if row["dst_name"] != "Guangzhou" and row["dst_name"] != "Beijing 2" and row["dst_name"] != "Beijing 1":
-            df.drop(index, inplace=True)
-        else:
-            df.at[index, "inside"] = True
-
-df.sort_values(by=["inside", "Source -> Destination"], inplace=True)
-
-# Capture the sorted order of 'Source -> Destination'
-sorted_order = df["Source -> Destination"].unique()
-
-
-df.sort_values(by=["Experiment"], inplace=True)
-exp_order = df["Experiment"].unique()
-
-# Pivot table with experiments as columns and src-dst as rows
-pivot_table = df.pivot_table(
-    index="Source -> Destination", columns="Experiment", values="success_rate", aggfunc="first"
-)
-# Reorder the pivot table index to match the sorted order
-pivot_table = pivot_table.reindex(sorted_order)
-
-
-plt.figure(figsize=(1*TEXTWIDTH, 0.75 * TEXTWIDTH))
-ax = sns.heatmap(pivot_table, annot=True, fmt=".0f", cmap="RdYlGn", cbar=False, cbar_kws={'label': 'Success Rate (%)'})
-ax.xaxis.set_major_formatter(mticker.FuncFormatter(lambda x, _: f'{int(x + 1)}'))
-plt.title("Success Rate (%) of QUIC-like Payloads per Source -> Destination Pair", loc="right")
-plt.xlabel("Payload Number")
-plt.ylabel("Source -> Destination")
-plt.tight_layout()
-plt.savefig("quic_parse_heatmap.pdf")
+# Vantage points left out of the heatmap, as source or destination.
+excluded_names = {
+    "Tencent 9",
+    "CU Boulder",
+    "DigitalOcean NYC1",
+    "Stanford",
+    "Frankfurt",
+    "Tencent Beijing",
+}
+
+# Pairs from outside China are only shown towards these destinations; they are sorted after the inside pairs.
+shown_inside_destinations = {
+    "Guangzhou",
+    "Beijing 2",
+    "Beijing 1",
+}
+
+PAIR = "Source -> Destination"
+
+def prepare(df):
+    """
+    Adds the heatmap columns to a chunk of results and keeps only the rows shown, using vectorized masks.
+    Returns a frame with columns PAIR, inside, Experiment and success_rate.
+    """
+    # Calculate success rate as percentages
+    df["success_rate"] = (df["packets_received"] / df["packet_count"]) * 100
+
+    # Extract experiment number from payload
+    df["true_experiment"] = df["payload"].str.extract(r'exp(\d+)', expand=False).astype(int)
+    df["Experiment"] = df["true_experiment"].map(experiment_map)
+
+    # Map IPs to names
+    df["src_name"] = df["src"].map(ip_to_name)
+    df["dst_name"] = df["dst"].map(ip_to_name)
+
+    # Create src-dst pair
+    df[PAIR] = df["src_name"] + " -> " + df["dst_name"]
+
+    # Drop rows we are not interested in, and rows going outside in except to the shown destinations
+    excluded = df["src_name"].isin(excluded_names) | df["dst_name"].isin(excluded_names)
+    outside_in = df["src"].isin(outside_ips)
+    keep = ~excluded & (~outside_in | df["dst_name"].isin(shown_inside_destinations))
+    df = df[keep]
+    return df.assign(inside=outside_in[keep])[[PAIR, "inside", "Experiment", "success_rate"]]
+
+class SuccessPivot:
+    """
+    The success-rate pivot (Source -> Destination x Experiment), maintained as chunks of results arrive.
+    Only one value per cell is kept, not the results themselves: the first result recorded for the cell.
+    """
+
+    def __init__(self):
+        self.pairs = pd.Series(dtype=bool, name="inside")
+        self.cells = pd.Series(dtype=float, name="success_rate")
+
+    def update(self, chunk):
+        df = prepare(chunk)
+        pairs = df.drop_duplicates(PAIR).set_index(PAIR)["inside"]
+        self.pairs = pd.concat([self.pairs, pairs[~pairs.index.isin(self.pairs.index)]])
+        cells = df.dropna(subset=[PAIR, "Experiment"]).drop_duplicates([PAIR, "Experiment"])
+        cells = cells.set_index([PAIR, "Experiment"])["success_rate"]
+        if len(self.cells):
+            cells = cells[~cells.index.isin(self.cells.index)]
+        self.cells = pd.concat([self.cells, cells]) if len(self.cells) else cells
+
+    def table(self):
+        # Rows: inside pairs first, each group sorted by name
+        order = self.pairs.reset_index().rename(columns={"index": PAIR})
+        order = order.sort_values(by=["inside", PAIR], kind="stable")[PAIR].unique()
+        if not len(self.cells):
+            return pd.DataFrame(index=pd.Index(order, name=PAIR))
+        pivot_table = self.cells.unstack("Experiment").sort_index(axis=1)
+        return pivot_table.reindex(order)
+
+class ResultsTail:
+    """
+    Reads an append-only results CSV incrementally: every read() parses only the complete lines appended
+    since the previous one, block by block, so files of millions of rows are never loaded at once.
+    """
+
+    def __init__(self, path, block_size=16 << 20):
+        self.path = path
+        self.block_size = block_size
+        self.offset = 0
+        self.columns = None
+
+    def read(self):
+        """Yields DataFrames of the rows appended since the last call."""
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            while True:
+                block = f.read(self.block_size)
+                end = block.rfind(b'\n') + 1
+                if end == 0:
+                    if len(block) < self.block_size:
+                        return
+                    # A line longer than a block: read more at once.
+                    self.block_size *= 2
+                    f.seek(self.offset)
+                    continue
+                block = block[:end]
+                self.offset += end
+                f.seek(self.offset)
+                if self.columns is None:
+                    header, _, block = block.partition(b'\n')
+                    self.columns = header.decode().strip().split(',')
+                if block.strip():
+                    yield pd.read_csv(io.BytesIO(block), header=None, names=self.columns)
+
+def plot(pivot_table, path="quic_parse_heatmap.pdf"):
+    plt.figure(figsize=(1*TEXTWIDTH, 0.75 * TEXTWIDTH))
+    ax = sns.heatmap(pivot_table, annot=True, fmt=".0f", cmap="RdYlGn", cbar=False, cbar_kws={'label': 'Success Rate (%)'})
+    ax.xaxis.set_major_formatter(mticker.FuncFormatter(lambda x, _: f'{int(x + 1)}'))
+    plt.title("Success Rate (%) of QUIC-like Payloads per Source -> Destination Pair", loc="right")
+    plt.xlabel("Payload Number")
+    plt.ylabel("Source -> Destination")
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+if __name__ == "__main__":
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description="Process a CSV file of packet data.")
+    parser.add_argument("csv_file", help="Path to the CSV file containing the data.")
+    parser.add_argument("--follow", type=float, default=None, metavar="SECONDS", help="Keep watching the file while a campaign appends to it, redrawing the heatmap whenever new rows land (checked every SECONDS).")
+    parser.add_argument("-o", "--output", default="quic_parse_heatmap.pdf", help="Output file (default: quic_parse_heatmap.pdf).")
+
+    # Parse the CLI arguments
+    args = parser.parse_args()
+
+    if not os.path.exists(args.csv_file):
+        print(f"Error: File '{args.csv_file}' not found.")
+        exit(1)
+
+    tail = ResultsTail(args.csv_file)
+    pivot = SuccessPivot()
+    while True:
+        rows = 0
+        for chunk in tail.read():
+            pivot.update(chunk)
+            rows += len(chunk)
+        if rows or args.follow is None:
+            plot(pivot.table(), args.output)
+            if args.follow is not None:
+                print(f"Redrew {args.output} after {rows} new rows.")
+        if args.follow is None:
+            break
+        time.sleep(args.follow)
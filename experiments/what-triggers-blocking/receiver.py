@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import resource
+import selectors
+import socket
+import sys
+import time
+
+# Long-lived replacement for server.py: one process listens on many UDP ports and serves many experiments at
+# once. The runner talks to it over stdin/stdout (an SSH exec channel):
+#
+#   expect <port> <experiment_id> <sha256>   listen on <port> and attribute its datagrams to <experiment_id>;
+#                                            a datagram matches if its SHA-256 is <sha256> (the payload's
+#                                            content hash). Answered with {"expecting": <port>}, or with
+#                                            {"error": "...", "port": <port>} if the port cannot be bound.
+#   done <port>                              stop attributing datagrams on <port>, and stop listening on it
+#                                            unless it is in the range given on the command line
+#   quit                                     exit (as does closing stdin)
+#
+# Ports in the optional <port_lo> <port_hi> range are bound at startup; those that cannot be bound are
+# reported and skipped.
+#
+# Every datagram is written to stdout as one JSON line:
+#   {"event": "recv", "ts": 1718000000.123456, "experiment": "...", "src": "1.2.3.4", "sport": 40000, "dst": "0.0.0.0",
+#    "dport": 1030, "len": 1252, "sha256": "...", "match": true}
+# "experiment" is null for ports nobody is expecting.
+
+def raise_fd_limit(needed):
+    """Raise the soft open-file limit (up to the hard one) so the whole port range can be bound."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        new_soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+
+def bind_port(selector, bind_ip, port, out):
+    """Binds a non-blocking UDP socket to port and registers it for reading. Returns None (reported) on failure."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        sock.bind((bind_ip, port))
+    except OSError as e:
+        sock.close()
+        print(json.dumps({'error': f"cannot bind port {port}: {e}", 'port': port}), file=out, flush=True)
+        return None
+    selector.register(sock, selectors.EVENT_READ, port)
+    return sock
+
+def bind_ports(selector, bind_ip, port_lo, port_hi, out):
+    """Binds every port in [port_lo, port_hi] that can be bound. Returns {port: socket}."""
+    raise_fd_limit(port_hi - port_lo + 64)
+    sockets = {}
+    for port in range(port_lo, port_hi + 1):
+        sock = bind_port(selector, bind_ip, port, out)
+        if sock is not None:
+            sockets[port] = sock
+    return sockets
+
+def handle_command(line, expected, listen, unlisten, out):
+    """
+    Applies one control line to expected (port -> (experiment_id, sha256)), calling listen(port) (False if
+    the port cannot be bound) and unlisten(port). Returns False on quit.
+    """
+    parts = line.split()
+    if not parts:
+        return True
+    if parts[0] == 'expect' and len(parts) == 4:
+        port = int(parts[1])
+        if listen(port):
+            expected[port] = (parts[2], parts[3])
+            print(json.dumps({'expecting': port}), file=out, flush=True)
+    elif parts[0] == 'done' and len(parts) == 2:
+        expected.pop(int(parts[1]), None)
+        unlisten(int(parts[1]))
+    elif parts[0] == 'quit':
+        return False
+    else:
+        print(json.dumps({'error': f"bad command: {line.strip()}"}), file=out, flush=True)
+    return True
+
+def receive(bind_ip, port_lo=None, port_hi=None, out=sys.stdout):
+    selector = selectors.DefaultSelector()
+    sockets = bind_ports(selector, bind_ip, port_lo, port_hi, out) if port_lo is not None else {}
+    static = set(sockets)
+    stdin_fd = sys.stdin.fileno()
+    os.set_blocking(stdin_fd, False)
+    selector.register(stdin_fd, selectors.EVENT_READ, None)
+    print(json.dumps({'listening': len(sockets)}), file=out, flush=True)
+
+    def listen(port):
+        if port not in sockets:
+            raise_fd_limit(len(sockets) + 64)
+            sock = bind_port(selector, bind_ip, port, out)
+            if sock is None:
+                return False
+            sockets[port] = sock
+        return True
+
+    def unlisten(port):
+        if port not in static and port in sockets:
+            sock = sockets.pop(port)
+            selector.unregister(sock)
+            sock.close()
+
+    expected = {}
+    pending = b''
+    running = True
+    while running:
+        for key, _ in selector.select():
+            if key.data is None:
+                data = os.read(stdin_fd, 65536)
+                if not data:
+                    running = False
+                    break
+                pending += data
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    if not handle_command(line.decode(), expected, listen, unlisten, out):
+                        running = False
+                continue
+            if key.fileobj.fileno() == -1:
+                # Closed by a done command earlier in this batch of events
+                continue
+
+            # Drain the socket: a burst to one port is read in one wakeup.
+            port = key.data
+            experiment, sha256 = expected.get(port, (None, None))
+            while True:
+                try:
+                    data, (src, sport) = key.fileobj.recvfrom(65535)
+                except BlockingIOError:
+                    break
+                digest = hashlib.sha256(data).hexdigest()
+                out.write(json.dumps({
+                    'event': 'recv', 'ts': time.time(), 'experiment': experiment, 'src': src, 'sport': sport,
+                    'dst': bind_ip, 'dport': port, 'len': len(data), 'sha256': digest,
+                    'match': digest == sha256,
+                }) + '\n')
+            out.flush()
+
+    for sock in sockets.values():
+        sock.close()
+    selector.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 4):
+        print("Usage: python receiver.py <bind_ip> [<port_lo> <port_hi>]")
+        sys.exit(1)
+
+    if len(sys.argv) == 4:
+        receive(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        receive(sys.argv[1])
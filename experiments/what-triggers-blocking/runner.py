@@ -1,7 +1,13 @@
 import paramiko
+import argparse
 import csv
+import hashlib
+import json
+import os
+import shlex
+import socket
 import threading
-from time import sleep
+import time
 
 def execute_command(ssh_client, command):
     """Executes a command on the SSH client."""
@@ -42,13 +48,17 @@ def process_host_csv(file_path):
                 print("Invalid row in CSV file:", row)
     return servers
 
-def connect_to_server(server):
-    """Connects to a server using SSH."""
+def connect_to_server(server, proxy=None):
+    """
+    Connects to a server using SSH. If the server has a proxy host, proxy may be an already connected
+    SSHClient for it; otherwise a new proxy connection is made.
+    """
     print(f"Connecting to {server['host']}...")
     if server['proxy_host']:
-        proxy = paramiko.SSHClient()
-        proxy.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        proxy.connect(hostname=server['proxy_host'], username=server['proxy_user'], key_filename=server['key'])
+        if proxy is None:
+            proxy = paramiko.SSHClient()
+            proxy.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            proxy.connect(hostname=server['proxy_host'], username=server['proxy_user'], key_filename=server['key'])
         transport = proxy.get_transport()
         channel = transport.open_channel("direct-tcpip", (server['host'], 22), ('', 0))
         client = paramiko.SSHClient()
@@ -60,6 +70,182 @@ def connect_to_server(server):
         client.connect(hostname=server['host'], username=server['user'], key_filename=server['key'])
     return client
 
+# Errors of the connection itself. Other OSErrors, like an SFTP PermissionError or FileNotFoundError on the
+# remote side, come over a working connection and are raised as they are.
+CONNECTION_ERRORS = (paramiko.SSHException, EOFError, ConnectionError, socket.timeout)
+
+def _is_alive(client):
+    transport = client.get_transport() if client is not None else None
+    return transport is not None and transport.is_active()
+
+class SSHPool:
+    """
+    Keeps one SSH connection per host open for the whole campaign.
+
+    A paramiko transport multiplexes channels, so exec and SFTP calls from concurrent experiments share the
+    host's connection instead of logging in again. Hosts behind the same jump host share one proxy
+    connection, and each target is reached over a direct-tcpip channel of it. A connection that fails with
+    one of CONNECTION_ERRORS is dropped and replaced. Idempotent calls (uploads, checks) are then retried
+    once on the fresh connection; a command that may have started, like a client run, is not, since running
+    it twice would send its packets twice.
+    """
+
+    KEEPALIVE = 30  # seconds between SSH keepalives, so idle connections survive NAT timeouts
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.proxies = {}
+        self.connect_locks = {}
+
+    def _connect_lock(self, key):
+        with self.lock:
+            return self.connect_locks.setdefault(key, threading.Lock())
+
+    def _proxy(self, server):
+        key = ('proxy', server['proxy_host'], server['proxy_user'], server['key'])
+        with self._connect_lock(key):
+            proxy = self.proxies.get(key)
+            if not _is_alive(proxy):
+                print(f"Connecting to proxy {server['proxy_host']}...")
+                proxy = paramiko.SSHClient()
+                proxy.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                proxy.connect(hostname=server['proxy_host'], username=server['proxy_user'], key_filename=server['key'])
+                proxy.get_transport().set_keepalive(self.KEEPALIVE)
+                self.proxies[key] = proxy
+            return proxy
+
+    def get(self, server):
+        """Returns a connected SSHClient for server, reusing the pooled one while it is alive."""
+        key = (server['host'], server['user'], server['key'])
+        with self._connect_lock(key):
+            client = self.clients.get(key)
+            if not _is_alive(client):
+                proxy = self._proxy(server) if server['proxy_host'] else None
+                client = connect_to_server(server, proxy)
+                client.get_transport().set_keepalive(self.KEEPALIVE)
+                self.clients[key] = client
+            return client
+
+    def _drop(self, server):
+        key = (server['host'], server['user'], server['key'])
+        with self._connect_lock(key):
+            client = self.clients.pop(key, None)
+            if client is not None:
+                client.close()
+
+    def _retry(self, server, action, idempotent=True):
+        try:
+            client = self.get(server)
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            # Nothing ran yet, so connecting can always be retried
+            print(f"Connecting to {server['host']} failed ({e}), retrying...")
+            self._drop(server)
+            client = self.get(server)
+        try:
+            return action(client)
+        except CONNECTION_ERRORS as e:
+            print(f"Connection to {server['host']} failed ({e}), reconnecting...")
+            self._drop(server)
+            if not idempotent:
+                raise
+            return action(self.get(server))
+
+    def execute(self, server, command, idempotent=True):
+        """
+        Runs a command on server over a new channel of its pooled connection. Returns (stdout, stderr).
+        With idempotent=False, a connection lost during the command raises instead of running it again.
+        """
+        return self._retry(server, lambda client: execute_command(client, command), idempotent)
+
+    def put(self, server, local_path, remote_path):
+        """Uploads a file to server over an SFTP channel of its pooled connection."""
+        return self._retry(server, lambda client: deploy_scripts(client, local_path, remote_path))
+
+    def close(self):
+        with self.lock:
+            for client in list(self.clients.values()) + list(self.proxies.values()):
+                client.close()
+            self.clients.clear()
+            self.proxies.clear()
+
+def file_sha256(path):
+    """SHA-256 of a local file, as hex."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class DeployCache:
+    """
+    Uploads files to hosts only when the remote copy differs.
+
+    Payloads are stored once per host under their content hash (remote_dir/<sha256>.bin), so experiments
+    refer to a payload by hash and switching payloads needs no transfer. The hashes present on a host are
+    listed with one sha256sum call the first time the host is seen; after that the cache remembers what it
+    uploaded. Uploads go to a temporary name and are renamed into place, so a half-written file is never
+    mistaken for a cached one.
+    """
+
+    def __init__(self, pool, remote_dir="/tmp/quic-payloads"):
+        self.pool = pool
+        self.remote_dir = remote_dir
+        self.lock = threading.Lock()
+        self.remote_hashes = {}
+        self.host_locks = {}
+        self.local_hashes = {}
+
+    def _host_lock(self, host):
+        with self.lock:
+            return self.host_locks.setdefault(host, threading.Lock())
+
+    def _local_hash(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        digest = self.local_hashes.get(key)
+        if digest is None:
+            digest = self.local_hashes[key] = file_sha256(path)
+        return digest
+
+    def _remote_hashes(self, server):
+        """The payload hashes already stored on server (call with the host lock held)."""
+        hashes = self.remote_hashes.get(server['host'])
+        if hashes is None:
+            remote_dir = shlex.quote(self.remote_dir)
+            stdout, _ = self.pool.execute(server, f"mkdir -p {remote_dir} && cd {remote_dir} && sha256sum -- *.bin 2>/dev/null")
+            hashes = set()
+            for line in stdout.splitlines():
+                parts = line.split()
+                # Only trust files whose content still matches their name.
+                if len(parts) == 2 and parts[1].lstrip('*') == parts[0] + ".bin":
+                    hashes.add(parts[0])
+            self.remote_hashes[server['host']] = hashes
+        return hashes
+
+    def _upload(self, server, local_path, remote_path):
+        tmp_path = f"{remote_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        self.pool.put(server, local_path, tmp_path)
+        self.pool.execute(server, f"mv -f {shlex.quote(tmp_path)} {shlex.quote(remote_path)}")
+
+    def payload(self, server, local_path):
+        """Makes sure the payload is on server and returns its content-addressed remote path."""
+        digest = self._local_hash(local_path)
+        remote_path = f"{self.remote_dir}/{digest}.bin"
+        with self._host_lock(server['host']):
+            hashes = self._remote_hashes(server)
+            if digest not in hashes:
+                print(f"Uploading {local_path} to {server['host']}:{remote_path}")
+                self._upload(server, local_path, remote_path)
+                hashes.add(digest)
+        return remote_path
+
+    def file(self, server, local_path, remote_path):
+        """Uploads local_path to remote_path unless the remote file already has the same SHA-256."""
+        digest = self._local_hash(local_path)
+        with self._host_lock(server['host']):
+            stdout, _ = self.pool.execute(server, f"sha256sum {shlex.quote(remote_path)} 2>/dev/null")
+            if stdout.split()[:1] != [digest]:
+                print(f"Uploading {local_path} to {server['host']}:{remote_path}")
+                self._upload(server, local_path, remote_path)
+
 def process_payloads_file(file_path):
     """Reads a CSV file and returns a list of payload files."""
     payloads = []
@@ -68,146 +254,479 @@ def process_payloads_file(file_path):
             payloads.append(row.strip())
     return payloads
 
-def run_server(dst_client, dst_port, packet_count, timeout, results):
-    try:
-        # Start server script
-        server_command = f"python3 /tmp/server.py 0.0.0.0 {dst_port} /tmp/payload.bin {packet_count} {timeout}"
-        print(f"Starting server script: {server_command}")
-        stdout, stderr = execute_command(dst_client, server_command)
+class Receiver:
+    """
+    A receiver.py process on one host, shared by all experiments that send to the host. It listens on each
+    experiment's destination port only while the experiment runs, so it never holds ports of other hosts'
+    cells or of services on the host. Control lines go to its stdin; a reader thread files the per-packet
+    records it prints under their experiment ID.
+    """
 
-        results['server_stdout'] = stdout
-        results['server_stderr'] = stderr
+    STARTUP_TIMEOUT = 30  # seconds
 
-        # Close server connection
-        dst_client.close()
-        print("Server script finished.")
+    def __init__(self, pool, server, on_record=None):
+        self.server = server
+        self.on_record = on_record
+        self.lock = threading.Condition()
+        self.records = {}
+        self.acks = {}
+        # Datagrams for no running experiment (late or stray packets) are only counted
+        self.unattributed = 0
+        self.alive = True
+        self.error = None
+        command = "python3 /tmp/receiver.py 0.0.0.0"
+        print(f"Starting receiver on {server['host']}: {command}")
+        self.stdin, self.stdout, self.stderr = pool.get(server).exec_command(command)
+        self.listening = False
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+        with self.lock:
+            self.lock.wait_for(lambda: self.listening or not self.alive, timeout=self.STARTUP_TIMEOUT)
+            started, alive = self.listening, self.alive
+        if not started:
+            if alive:
+                # Still running but silent: stderr would only end when it exits, so it is not read. Closing
+                # stdin makes a receiver that is merely slow exit once it gets going.
+                self.stdin.close()
+                raise RuntimeError(f"Receiver on {server['host']} did not start within {self.STARTUP_TIMEOUT} s")
+            # It exited, so its stderr is complete
+            raise RuntimeError(f"Receiver on {server['host']} did not start: {self.error or self.stderr.read().decode()}")
 
-    except Exception as e:
-        results['server_error'] = str(e)
+    def _read(self):
+        try:
+            for line in self.stdout:
+                record = json.loads(line)
+                with self.lock:
+                    if 'listening' in record:
+                        self.listening = True
+                    elif 'expecting' in record:
+                        self.acks[record['expecting']] = True
+                    elif 'error' in record:
+                        if 'port' in record:
+                            self.acks[record['port']] = record['error']
+                        print(f"Receiver on {self.server['host']}: {record['error']}")
+                    else:
+                        records = self.records.get(record['experiment'])
+                        if records is not None:
+                            records.append(record)
+                        else:
+                            self.unattributed += 1
+                        if self.on_record is not None:
+                            self.on_record(record)
+                    self.lock.notify_all()
+        except Exception as e:
+            self.error = str(e)
+        with self.lock:
+            self.alive = False
+            self.lock.notify_all()
+
+    def _send(self, line):
+        with self.lock:
+            if not self.alive:
+                raise RuntimeError(f"Receiver on {self.server['host']} exited: {self.error or 'channel closed'}")
+            self.stdin.write(line + "\n")
+            self.stdin.flush()
+
+    def expect(self, port, experiment_id, sha256, timeout=30):
+        """Has the receiver listen on port for experiment_id. Raises RuntimeError if it cannot."""
+        with self.lock:
+            self.records[experiment_id] = []
+            self.acks.pop(port, None)
+        self._send(f"expect {port} {experiment_id} {sha256}")
+        with self.lock:
+            self.lock.wait_for(lambda: port in self.acks or not self.alive, timeout=timeout)
+            ack = self.acks.pop(port, None)
+            if ack is not True:
+                self.records.pop(experiment_id, None)
+                raise RuntimeError(f"Receiver on {self.server['host']} cannot listen on port {port}: {ack or 'no answer'}")
+
+    def wait(self, experiment_id, packet_count, timeout):
+        """Waits until packet_count matching packets arrived or timeout seconds passed. Returns the records."""
+        def enough():
+            return not self.alive or sum(r['match'] for r in self.records[experiment_id]) >= packet_count
+        with self.lock:
+            self.lock.wait_for(enough, timeout=timeout)
+            return list(self.records[experiment_id])
 
-def run_client(src_client, dst_host, dst_port, packet_count, wait, results):
+    def done(self, port, experiment_id):
+        self._send(f"done {port}")
+        with self.lock:
+            self.records.pop(experiment_id, None)
+
+    def close(self):
+        if self.unattributed:
+            print(f"Receiver on {self.server['host']}: {self.unattributed} datagrams for no running experiment.")
+        try:
+            self._send("quit")
+        except (RuntimeError, OSError):
+            pass
+
+class Receivers:
+    """
+    Starts one Receiver per destination host on first use, and again if the previous one died. A receiver
+    is started under its host's lock only, so a slow host does not hold up the cells of the others.
+    """
+
+    def __init__(self, pool, on_record=None):
+        self.pool = pool
+        self.on_record = on_record
+        self.lock = threading.Lock()
+        self.receivers = {}
+        self.host_locks = {}
+
+    def _host_lock(self, host):
+        with self.lock:
+            return self.host_locks.setdefault(host, threading.Lock())
+
+    def get(self, server):
+        with self._host_lock(server['host']):
+            receiver = self.receivers.get(server['host'])
+            if receiver is None or not receiver.alive:
+                receiver = Receiver(self.pool, server, self.on_record)
+                with self.lock:
+                    self.receivers[server['host']] = receiver
+            return receiver
+
+    def close(self):
+        with self.lock:
+            for receiver in self.receivers.values():
+                receiver.close()
+
+def run_client(pool, src_server, remote_payload, dst_host, dst_port, packet_count, wait, results, paced=False):
     try:
-        # Start client script
-        client_command = f"python3 /tmp/client.py {dst_host} {dst_port} /tmp/payload.bin {packet_count} {wait}"
+        # Start client script; with --json it prints one record per sent packet and a summary or error line.
+        client_command = f"python3 /tmp/client.py {dst_host} {dst_port} {remote_payload} {packet_count} {wait:g} --json"
+        if paced:
+            client_command += " --paced"
         print(f"Starting client script: {client_command}")
-        stdout, stderr = execute_command(src_client, client_command)
+        # Never re-run: a client that started before the connection dropped has already sent packets.
+        stdout, stderr = pool.execute(src_server, client_command, idempotent=False)
 
-        results['client_stdout'] = stdout
+        results['sent'] = []
+        for line in stdout.splitlines():
+            if not line.startswith('{'):
+                continue
+            record = json.loads(line)
+            if record.get('event') == 'send':
+                results['sent'].append(record)
+            elif 'summary' in record:
+                results['summary'] = record['summary']
+            elif 'error' in record:
+                results['client_error'] = record['error']
+        if 'summary' not in results and 'client_error' not in results:
+            results['client_error'] = f"client exited without a summary: {stderr.strip() or 'no output'}"
         results['client_stderr'] = stderr
-
-        # Close client connection
-        src_client.close()
         print("Client script finished.")
 
     except Exception as e:
         results['client_error'] = str(e)
 
-def run_experiment(src_server, dst_server, payload_file, packet_count, wait, dst_port, server_timeout):
-    """Runs the client-server experiment via SSH for a specified number of iterations."""
+def run_experiment(pool, deploy, receivers, src_server, dst_server, payload_file, packet_count, wait, dst_port, server_timeout, paced=False, packet_log=None):
+    """
+    Runs one experiment cell and returns its results row. The client's send records are appended to
+    packet_log here; the receiver's records are streamed to it as they arrive.
+    """
+    row = {
+        'src': src_server['host'], 'dst': dst_server['host'], 'payload': payload_file, 'packet_count': packet_count,
+        'wait': f"{wait:g}", 'dst_port': dst_port, 'server_timeout': server_timeout, 'packets_received': 0, 'error': True,
+    }
     try:
-        dst_client = connect_to_server(dst_server)
-        # Deploy server script
-        deploy_scripts(dst_client, payload_file, "/tmp/payload.bin")
-
-        src_client = connect_to_server(src_server)
-        # Deploy client script and payload
-        deploy_scripts(src_client, payload_file, "/tmp/payload.bin")
+        # Both ends refer to the payload by its content hash; it is only uploaded if a host lacks it.
+        remote_payload = deploy.payload(dst_server, payload_file)
+        deploy.payload(src_server, payload_file)
+        sha256 = os.path.basename(remote_payload)[:-len(".bin")]
 
+        # The receiver on the destination is already listening, so the client can start right away.
+        experiment_id = experiment_key(src_server['host'], dst_server['host'], dst_port)
+        receiver = receivers.get(dst_server)
+        receiver.expect(dst_port, experiment_id, sha256)
         results = {}
+        try:
+            run_client(pool, src_server, remote_payload, dst_server['host'], dst_port, packet_count, wait, results, paced)
+            records = receiver.wait(experiment_id, packet_count, server_timeout)
+        finally:
+            receiver.done(dst_port, experiment_id)
 
-        # Run server and client in parallel
-        server_thread = threading.Thread(target=run_server, args=(dst_client, dst_port, packet_count, server_timeout, results))
-        client_thread = threading.Thread(target=run_client, args=(src_client, dst_server['host'], dst_port, packet_count, wait, results))
-
-        server_thread.start()
-        sleep(1)  # Wait for server to start
-        client_thread.start()
-
-        server_thread.join()
-        client_thread.join()
-
-        # Log output from both client and server
-        print(f"\n--- Results ---")
-        print("Client Output:")
-        print(results.get('client_stdout', 'No Output'))
-        print("Client Errors:")
-        print(results.get('client_stderr', 'No Errors'))
-        print("Server Output:")
-        print(results.get('server_stdout', 'No Output'))
-        print("Server Errors:")
-        print(results.get('server_stderr', 'No Errors'))
+        if packet_log is not None:
+            # The client binds to 0.0.0.0; record the sending host instead.
+            packet_log.write({**record, 'experiment': experiment_id, 'src': src_server['host']} for record in results.get('sent', []))
 
+        received = sum(record['match'] for record in records)
+        print(f"{experiment_id}: sent {len(results.get('sent', []))}, received {received} valid and "
+              f"{len(records) - received} invalid packets.")
+        if 'summary' in results and 'rate' in results['summary']:
+            print(f"{experiment_id}: client summary {json.dumps(results['summary'])}")
+        if results.get('client_stderr'):
+            print(f"{experiment_id}: client errors: {results['client_stderr'].strip()}")
         if 'client_error' in results:
             print("Client Error:", results['client_error'])
-        if 'server_error' in results:
-            print("Server Error:", results['server_error'])
-        
-        
-        received = results.get('server_stdout', '').count("received valid packet")
-        error = False
-        if 'client_error' in results or 'server_error' in results:
-            error = True
-        if "An error occurred:" in results.get('client_stdout', '') or "an error occurred:" in results.get('server_stdout', ''):
-            error = True
-        return f"{src_server['host']},{dst_server['host']},{payload},{packet_count},{wait},{dst_port},{server_timeout},{received},{error}"
 
+        row['packets_received'] = received
+        row['error'] = 'client_error' in results or not receiver.alive
     except Exception as e:
         print(f"An error occurred: {e}")
-        return f"{src_server['host']},{dst_server['host']},{payload},{packet_count},{wait},{dst_port},{server_timeout},0,True"
+    return row
 
-if __name__ == "__main__":
-    import sys
+RESULTS_FIELDS = ['src', 'dst', 'payload', 'packet_count', 'wait', 'dst_port', 'server_timeout', 'packets_received', 'error']
+
+# Per-packet log: one row per packet sent by a client ("send") or seen by a receiver ("recv"), with a fixed set
+# of columns so it can be appended to across runs and loaded as a table (e.g. pandas.read_csv). Send and
+# receive rows of one packet share experiment and sport, as every packet leaves from its own source port;
+# match is empty for send rows, experiment is empty for datagrams to ports nobody expected.
+PACKET_FIELDS = ['experiment', 'event', 'seq', 'ts', 'src', 'sport', 'dst', 'dport', 'len', 'sha256', 'match']
+
+class PacketLog:
+    """Append-only CSV of packet records with the PACKET_FIELDS columns, safe to write from several threads."""
+
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=PACKET_FIELDS, extrasaction='ignore', lineterminator='\n')
+        self.lock = threading.Lock()
+        if new:
+            self.writer.writeheader()
+            self.file.flush()
+
+    def write(self, records):
+        with self.lock:
+            self.writer.writerows(records)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def experiment_key(src_host, dst_host, dst_port):
+    return f"{src_host}-{dst_host}-{dst_port}"
+
+def experiment_cells(inside_servers, outside_servers, payloads, base_port):
+    """
+    Lists every (src, dst, payload, dst_port) cell of the campaign, in the order the original sequential
+    loop ran them. Each cell gets its own destination port, so port numbers match earlier results files.
+    """
+    cells = []
+    for inside_server in inside_servers:
+        for outside_server in outside_servers:
+            for payload in payloads:
+                cells.append((inside_server, outside_server, payload, base_port + len(cells)))
+                cells.append((outside_server, inside_server, payload, base_port + len(cells)))
+    return cells
+
+def cell_key(src_host, dst_host, payload, dst_port):
+    return (src_host, dst_host, payload, int(dst_port))
+
+def completed_cells(results_path):
+    """Reads the cells already recorded in a results file, so an interrupted campaign can resume."""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, 'r') as f:
+        for row in csv.DictReader(f):
+            if row.get('error') == 'False':
+                done.add(cell_key(row['src'], row['dst'], row['payload'], row['dst_port']))
+    return done
+
+def drop_rerun_rows(results_path, rerun):
+    """
+    Rewrites a results file without the rows of the cells in rerun (cell_key()s), so the errored rows of
+    cells that are run again do not stay in front of their new rows.
+    """
+    with open(results_path, 'r', newline='') as f:
+        rows = [row for row in csv.DictReader(f)
+                if cell_key(row['src'], row['dst'], row['payload'], row['dst_port']) not in rerun]
+    with open(results_path + ".tmp", 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULTS_FIELDS, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(results_path + ".tmp", results_path)
+
+def recent_flows(results_path, residual):
+    """
+    The (src, dst, dst_port) flows of a previous run's results file that may still be blocked, mapped to
+    the time.time() at which they are clear. Rows carry no timestamps, so every flow in the file counts as
+    used when the file was last written.
+    """
+    if not residual or not os.path.exists(results_path):
+        return {}
+    clear_at = os.path.getmtime(results_path) + residual
+    if clear_at <= time.time():
+        return {}
+    with open(results_path, 'r') as f:
+        return {(row['src'], row['dst'], int(row['dst_port'])): clear_at for row in csv.DictReader(f)}
+
+class Scheduler:
+    """
+    Runs experiment cells on worker threads.
 
-    if len(sys.argv) != 8:
-        print("Usage: python runner.py <inside_file> <outside_file> <payloads_file> <packet_count> <wait> <server_timeout> <results_file>")
-        sys.exit(1)
+    At most `jobs` cells run at once, and at most `per_host` of them involve any one host (as sender or
+    receiver). Residual censorship blocks the (src, dst, dst_port) 3-tuple, and every cell has its own
+    dst_port (see experiment_cells()), so within a run a cell is never delayed by blocking that another one
+    triggered. A previous run on the same ports may have, though: `not_before` maps the flows it used to the
+    time.time() at which they are clear (see recent_flows()), and their cells are not started earlier.
+    Cells are started in campaign order whenever these limits allow, and each finished row is appended and
+    flushed to the results file at once.
+    """
 
-    inside_file = sys.argv[1]
-    outside_file = sys.argv[2]
-    payloads_file = sys.argv[3]
-    packet_count = int(sys.argv[4])
-    wait = int(sys.argv[5])
-    server_timeout = int(sys.argv[6])
-    results_file = sys.argv[7]
+    def __init__(self, jobs, per_host, not_before=None):
+        self.jobs = jobs
+        self.per_host = per_host
+        self.not_before = not_before or {}
+        self.lock = threading.Condition()
+        self.running = 0
+        self.host_load = {}
+        self.failure = None
+
+    def _may_start(self, src_host, dst_host):
+        return self.host_load.get(src_host, 0) < self.per_host and self.host_load.get(dst_host, 0) < self.per_host
+
+    def _run_cell(self, cell, run, on_result):
+        src_server, dst_server, payload, dst_port = cell
+        try:
+            result = run(cell)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            result = {'src': src_server['host'], 'dst': dst_server['host'], 'payload': payload, 'dst_port': dst_port,
+                      'packets_received': 0, 'error': True}
+        with self.lock:
+            try:
+                on_result(result)
+            except Exception as e:
+                print(f"Recording a result failed: {e}")
+                self.failure = self.failure or e
+            finally:
+                for host in (src_server['host'], dst_server['host']):
+                    self.host_load[host] -= 1
+                self.running -= 1
+                self.lock.notify_all()
+
+    def run(self, cells, run, on_result):
+        """
+        Runs run(cell) for every cell and passes each result row to on_result (under the scheduler lock). If
+        on_result raises, no further cells are started, and the exception is raised once the running ones end.
+        """
+        pending = list(cells)
+        threads = []
+        with self.lock:
+            while pending and self.failure is None:
+                now = time.time()
+                started = None
+                next_wakeup = None
+                if self.running < self.jobs:
+                    for i, (src_server, dst_server, _, dst_port) in enumerate(pending):
+                        if not self._may_start(src_server['host'], dst_server['host']):
+                            continue
+                        clear_at = self.not_before.get((src_server['host'], dst_server['host'], dst_port), 0)
+                        if clear_at <= now:
+                            started = i
+                            break
+                        next_wakeup = clear_at - now if next_wakeup is None else min(next_wakeup, clear_at - now)
+                if started is None:
+                    self.lock.wait(timeout=next_wakeup)
+                    continue
+
+                cell = pending.pop(started)
+                src_server, dst_server, _, _ = cell
+                for host in (src_server['host'], dst_server['host']):
+                    self.host_load[host] = self.host_load.get(host, 0) + 1
+                self.running += 1
+                thread = threading.Thread(target=self._run_cell, args=(cell, run, on_result))
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if self.failure is not None:
+            raise self.failure
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the what-triggers-blocking experiment matrix over SSH.")
+    parser.add_argument("inside_file", help="CSV of hosts inside China: host,user,key[,proxy_host,proxy_user]")
+    parser.add_argument("outside_file", help="CSV of hosts outside China, same format.")
+    parser.add_argument("payloads_file", help="File listing one payload file per line.")
+    parser.add_argument("packet_count", type=int)
+    parser.add_argument("wait", type=float, help="Seconds between packets; fractions need --paced to be kept accurately.")
+    parser.add_argument("server_timeout", type=int)
+    parser.add_argument("results_file")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Experiments to run at the same time (default: 1, the original sequential behaviour).")
+    parser.add_argument("--per_host", type=int, default=1, help="Experiments any one host may take part in at the same time (default: 1).")
+    parser.add_argument("--residual", type=float, default=180, help="Seconds after the last write of an existing results_file before its (src, dst, dst_port) flows are used again, to stay clear of residual censorship (default: 180).")
+    parser.add_argument("--base_port", type=int, default=1030, help="Destination port of the first experiment; each one uses the next port (default: 1030).")
+    parser.add_argument("--packets", default=None, help="Append every packet sent and received to this CSV (default: results_file with a .packets.csv extension).")
+    parser.add_argument("--paced", action="store_true", help="Run the clients in paced mode: pre-opened sockets and sends scheduled on the monotonic clock, for sub-second waits.")
+    parser.add_argument("--resume", action="store_true", help="Keep the rows already in results_file and skip the experiments that completed without error.")
+    args = parser.parse_args()
+    if args.jobs < 1 or args.per_host < 1:
+        parser.error("--jobs and --per_host must be at least 1")
 
     # Process source and destination CSV files
-    inside_servers = process_host_csv(inside_file)
-    outside_servers = process_host_csv(outside_file)
+    inside_servers = process_host_csv(args.inside_file)
+    outside_servers = process_host_csv(args.outside_file)
     # Process payload files
-    payloads = process_payloads_file(payloads_file)
+    payloads = process_payloads_file(args.payloads_file)
+
+    cells = experiment_cells(inside_servers, outside_servers, payloads, args.base_port)
+    done = completed_cells(args.results_file) if args.resume else set()
+    todo = [cell for cell in cells if cell_key(cell[0]['host'], cell[1]['host'], cell[2], cell[3]) not in done]
+    if args.resume:
+        print(f"Resuming: {len(cells) - len(todo)} of {len(cells)} experiments already completed.")
+
+    # Read before the results file is rewritten below, which changes its mtime
+    not_before = recent_flows(args.results_file, args.residual)
+    if not_before:
+        print(f"Flows of the previous run are clear of residual blocking in {max(not_before.values()) - time.time():.0f} s.")
+
+    if args.resume and os.path.exists(args.results_file):
+        # Cells run again get a new row; drop their errored ones, which would otherwise be the first per cell
+        drop_rerun_rows(args.results_file, {cell_key(cell[0]['host'], cell[1]['host'], cell[2], cell[3]) for cell in todo})
+        results_file = open(args.results_file, 'a', newline='')
+        results_writer = csv.DictWriter(results_file, fieldnames=RESULTS_FIELDS, lineterminator='\n')
+    else:
+        results_file = open(args.results_file, 'w', newline='')
+        results_writer = csv.DictWriter(results_file, fieldnames=RESULTS_FIELDS, lineterminator='\n')
+        results_writer.writeheader()
+        results_file.flush()
 
-    results_file = open(results_file, 'w')
-    results_file.write("src,dst,payload,packet_count,wait,dst_port,server_timeout,packets_received,error\n")
+    pool = SSHPool()
+    deploy = DeployCache(pool)
 
+    # Scripts are only uploaded when they changed; payloads are uploaded up front, once per host, so
+    # experiments never wait for a transfer.
     print("Testing inside servers...")
     for server in inside_servers:
-        server = connect_to_server(server)
-        deploy_scripts(server, "server.py", "/tmp/server.py")
-        deploy_scripts(server, "client.py", "/tmp/client.py")
-        server.close()
+        deploy.file(server, "receiver.py", "/tmp/receiver.py")
+        deploy.file(server, "client.py", "/tmp/client.py")
+        for payload in set(payloads):
+            deploy.payload(server, payload)
 
     print("Testing outside servers...")
     for server in outside_servers:
-        server = connect_to_server(server)
-        deploy_scripts(server, "server.py", "/tmp/server.py")
-        deploy_scripts(server, "client.py", "/tmp/client.py")
-        server.close()
-
-    dst_port = 1030
-    num_experiments = len(inside_servers) * len(outside_servers) * len(payloads) * 2
-    exp_num = 1
+        deploy.file(server, "receiver.py", "/tmp/receiver.py")
+        deploy.file(server, "client.py", "/tmp/client.py")
+        for payload in set(payloads):
+            deploy.payload(server, payload)
+
+    packet_log = PacketLog(args.packets or os.path.splitext(args.results_file)[0] + ".packets.csv")
+    receivers = Receivers(pool, lambda record: packet_log.write([record]))
+
+    num_experiments = len(todo)
+    finished = 0
     print(f"Running {num_experiments} experiments...")
-    for inside_server in inside_servers:
-        for outside_server in outside_servers:
-            for payload in payloads:
-                print(f"Running experiment {payload}: {inside_server['host']} -> {outside_server['host']}, {exp_num}/{num_experiments}")
-                res = run_experiment(inside_server, outside_server, payload, packet_count, wait, dst_port, server_timeout)
-                results_file.write(res + "\n")
-                exp_num += 1
-                dst_port += 1
-                print(f"Running experiment {payload}: {outside_server['host']} -> {inside_server['host']}, {exp_num}/{num_experiments}")
-                res = run_experiment(outside_server, inside_server, payload, packet_count, wait, dst_port, server_timeout)
-                results_file.write(res + "\n")
-                exp_num += 1
-                dst_port += 1
-    results_file.close()
\ No newline at end of file
+
+    def run(cell):
+        src_server, dst_server, payload, dst_port = cell
+        print(f"Running experiment {payload}: {src_server['host']} -> {dst_server['host']} (port {dst_port})")
+        return run_experiment(pool, deploy, receivers, src_server, dst_server, payload, args.packet_count, args.wait, dst_port, args.server_timeout, args.paced, packet_log)
+
+    def on_result(res):
+        global finished
+        finished += 1
+        results_writer.writerow(res)
+        results_file.flush()
+        print(f"Finished {finished}/{num_experiments} experiments.")
+
+    try:
+        Scheduler(args.jobs, args.per_host, not_before).run(todo, run, on_result)
+    finally:
+        receivers.close()
+        pool.close()
+        results_file.close()
+        packet_log.close()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The tools are scripts in their own directories, imported the way they import each other.
+for path in ("experiments/what-triggers-blocking", "utils/pcap-reader", "utils/quic-packet-builder"):
+    sys.path.insert(0, os.path.join(ROOT, path))
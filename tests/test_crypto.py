@@ -0,0 +1,34 @@
+import pytest
+
+import crypto
+from crypto import QUICCrypto
+
+DCID = bytes.fromhex("8394c8f03e515708")
+HEADER = bytes.fromhex("c300000001088394c8f03e5157080000449e00000002")
+
+@pytest.fixture(params=[True, False], ids=['encrypt_into', 'gcm_context'])
+def encrypt_into(request, monkeypatch):
+    if request.param and not crypto._HAVE_ENCRYPT_INTO:
+        pytest.skip("cryptography has no AESGCM.encrypt_into")
+    monkeypatch.setattr(crypto, '_HAVE_ENCRYPT_INTO', request.param)
+    return request.param
+
+@pytest.mark.parametrize('is_client', [True, False])
+@pytest.mark.parametrize('payload_len', [0, 1, 20, 1162])
+def test_encrypt_packet_into(encrypt_into, is_client, payload_len):
+    quic = QUICCrypto(DCID, 1)
+    payload = bytes(range(256)) * 5
+    payload = payload[:payload_len]
+    pn = 2
+    expected = quic.encrypt_packet(is_client, pn, HEADER, payload)
+
+    # The packet sits at an offset in a larger buffer, with bytes around it that must be left alone.
+    offset = 7
+    buf = bytearray(b'\xaa' * offset + HEADER + payload + bytes(16) + b'\xbb' * 9)
+    end = quic.encrypt_packet_into(is_client, pn, buf, offset, offset + len(HEADER), payload_len)
+
+    assert end == offset + len(HEADER) + payload_len + 16
+    assert buf[offset + len(HEADER):end] == expected
+    assert buf[:offset] == b'\xaa' * offset
+    assert buf[offset:offset + len(HEADER)] == HEADER
+    assert buf[end:] == b'\xbb' * 9
@@ -0,0 +1,86 @@
+import socket
+import struct
+
+import pytest
+
+from pcapreader import LINKTYPE_ETHERNET, iter_packets
+
+def udp_frame(src, dst, sport, dport, payload):
+    """An Ethernet frame carrying an IPv4 UDP datagram (checksums left zero)."""
+    udp = struct.pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    return b'\x00' * 12 + b'\x08\x00' + ip + udp
+
+def tcp_frame(src, dst, sport, dport):
+    tcp = struct.pack('!HHIIBBHHH', sport, dport, 0, 0, 0x50, 0x02, 1024, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp), 0, 0, 64, 6, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    return b'\x00' * 12 + b'\x08\x00' + ip + tcp
+
+FRAMES = [
+    (1.5, udp_frame("10.0.0.1", "10.0.0.2", 40000, 443, b"first")),
+    (2.25, tcp_frame("10.0.0.1", "10.0.0.2", 40001, 443)),
+    (3.0, udp_frame("10.0.0.2", "10.0.0.1", 443, 40000, b"second")),
+]
+
+def write_pcap(path, frames, endian='<'):
+    with open(path, 'wb') as f:
+        f.write(struct.pack(endian + 'IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET))
+        for ts, frame in frames:
+            f.write(struct.pack(endian + 'IIII', int(ts), round(ts % 1 * 1e6), len(frame), len(frame)))
+            f.write(frame)
+
+def block(block_type, body):
+    body += b'\x00' * (-len(body) % 4)
+    return struct.pack('<II', block_type, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+
+def write_pcapng(path, frames, interface=0):
+    with open(path, 'wb') as f:
+        f.write(block(0x0a0d0d0a, struct.pack('<IHHq', 0x1a2b3c4d, 1, 0, -1)))
+        f.write(block(1, struct.pack('<HHI', LINKTYPE_ETHERNET, 0, 0)))
+        for ts, frame in frames:
+            micros = round(ts * 1e6)
+            f.write(block(6, struct.pack('<IIIII', interface, micros >> 32, micros & 0xffffffff, len(frame), len(frame)) + frame))
+
+def summary(path, udp_only=False):
+    return [(p.ts, p.src, p.dst, p.proto, p.sport, p.dport, bytes(p.payload), p.linktype)
+            for p in iter_packets(path, udp_only=udp_only)]
+
+EXPECTED = [
+    (1.5, "10.0.0.1", "10.0.0.2", 17, 40000, 443, b"first", LINKTYPE_ETHERNET),
+    # Only UDP payloads are split from their header.
+    (2.25, "10.0.0.1", "10.0.0.2", 6, 40001, 443, FRAMES[1][1][34:], LINKTYPE_ETHERNET),
+    (3.0, "10.0.0.2", "10.0.0.1", 17, 443, 40000, b"second", LINKTYPE_ETHERNET),
+]
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_pcap(tmp_path, endian):
+    path = str(tmp_path / "capture.pcap")
+    write_pcap(path, FRAMES, endian)
+    assert summary(path) == EXPECTED
+    assert summary(path, udp_only=True) == [EXPECTED[0], EXPECTED[2]]
+
+def test_pcapng(tmp_path):
+    path = str(tmp_path / "capture.pcapng")
+    write_pcapng(path, FRAMES)
+    assert summary(path, udp_only=True) == [EXPECTED[0], EXPECTED[2]]
+
+def test_truncated_pcap(tmp_path):
+    path = str(tmp_path / "capture.pcap")
+    write_pcap(path, FRAMES)
+    with open(path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 10)
+    assert summary(path, udp_only=True) == [EXPECTED[0]]
+
+def test_pcapng_unknown_interface(tmp_path):
+    path = str(tmp_path / "bad.pcapng")
+    write_pcapng(path, FRAMES[:1], interface=3)
+    with pytest.raises(ValueError, match="interface 3"):
+        summary(path)
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / "capture.txt"
+    path.write_bytes(b"not a capture file at all, just some text")
+    with pytest.raises(ValueError):
+        summary(str(path))
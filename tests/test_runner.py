@@ -0,0 +1,146 @@
+import csv
+import os
+import threading
+import time
+
+import pytest
+
+from runner import RESULTS_FIELDS, Scheduler, cell_key, completed_cells, drop_rerun_rows, recent_flows
+
+def make_cells(pairs, payload="p.bin", base_port=5000):
+    return [({'host': src}, {'host': dst}, payload, base_port + i) for i, (src, dst) in enumerate(pairs)]
+
+def row(src, dst, port, error, payload="p.bin"):
+    return {'src': src, 'dst': dst, 'payload': payload, 'packet_count': 10, 'wait': 1, 'dst_port': port,
+            'server_timeout': 30, 'packets_received': 0 if error else 10, 'error': error}
+
+def write_results(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULTS_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+class Tracker:
+    """A run() for Scheduler that records the most cells, and the most per host, that ran at once."""
+
+    def __init__(self, duration=0.02):
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.running = 0
+        self.hosts = {}
+        self.max_running = 0
+        self.max_host = 0
+
+    def __call__(self, cell):
+        src_server, dst_server, payload, dst_port = cell
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            for host in (src_server['host'], dst_server['host']):
+                self.hosts[host] = self.hosts.get(host, 0) + 1
+                self.max_host = max(self.max_host, self.hosts[host])
+        time.sleep(self.duration)
+        with self.lock:
+            self.running -= 1
+            for host in (src_server['host'], dst_server['host']):
+                self.hosts[host] -= 1
+        return {'src': src_server['host'], 'dst': dst_server['host'], 'payload': payload, 'dst_port': dst_port,
+                'packets_received': 1, 'error': False}
+
+def test_scheduler_limits():
+    pairs = [(f"in{i}", f"out{j}") for i in range(3) for j in range(4)] * 2
+    tracker = Tracker()
+    results = []
+    Scheduler(jobs=4, per_host=2).run(make_cells(pairs), tracker, results.append)
+    assert len(results) == len(pairs)
+    assert tracker.max_running == 4
+    assert tracker.max_host <= 2
+
+def test_scheduler_single_host_runs_serially():
+    tracker = Tracker()
+    results = []
+    Scheduler(jobs=8, per_host=1).run(make_cells([("in", f"out{j}") for j in range(5)]), tracker, results.append)
+    assert len(results) == 5
+    assert tracker.max_running == 1
+
+def test_scheduler_records_failed_cells():
+    def run(cell):
+        raise RuntimeError("ssh down")
+
+    results = []
+    Scheduler(jobs=2, per_host=1).run(make_cells([("a", "b"), ("c", "d")]), run, results.append)
+    assert sorted(r['src'] for r in results) == ["a", "c"]
+    assert all(r['error'] is True and r['packets_received'] == 0 for r in results)
+
+def test_scheduler_empty():
+    Scheduler(jobs=1, per_host=1).run([], Tracker(), lambda result: None)
+
+def test_scheduler_raises_on_result_failure():
+    results = []
+
+    def on_result(result):
+        results.append(result)
+        raise OSError("disk full")
+
+    scheduler = Scheduler(jobs=1, per_host=1)
+    raised = []
+
+    def run_all():
+        try:
+            scheduler.run(make_cells([("a", "b")] * 3), Tracker(0), on_result)
+        except OSError as e:
+            raised.append(e)
+
+    # Run on a thread so that a scheduler that never ends fails the test instead of hanging it.
+    thread = threading.Thread(target=run_all, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert [str(e) for e in raised] == ["disk full"]
+    # No further cells are started after the failure, and no slots are left taken.
+    assert len(results) == 1
+    assert scheduler.running == 0 and not any(scheduler.host_load.values())
+
+def test_scheduler_waits_for_not_before():
+    cells = make_cells([("a", "b"), ("c", "d")])
+    started = {}
+
+    def run(cell):
+        started[cell[0]['host']] = time.time()
+        return {'src': cell[0]['host'], 'dst': cell[1]['host'], 'payload': cell[2], 'dst_port': cell[3],
+                'packets_received': 1, 'error': False}
+
+    begin = time.time()
+    Scheduler(jobs=2, per_host=1, not_before={("a", "b", 5000): begin + 0.3}).run(cells, run, lambda result: None)
+    assert started["a"] >= begin + 0.3
+    assert started["c"] < begin + 0.3
+
+def test_completed_cells(tmp_path):
+    path = str(tmp_path / "results.csv")
+    assert completed_cells(path) == set()
+    write_results(path, [row("a", "b", 5000, False), row("b", "a", 5001, True), row("a", "c", 5002, False)])
+    assert completed_cells(path) == {cell_key("a", "b", "p.bin", 5000), cell_key("a", "c", "p.bin", "5002")}
+
+def test_drop_rerun_rows(tmp_path):
+    path = str(tmp_path / "results.csv")
+    write_results(path, [row("a", "b", 5000, False), row("b", "a", 5001, True), row("a", "c", 5002, True)])
+    drop_rerun_rows(path, {cell_key("b", "a", "p.bin", 5001)})
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [(r['src'], r['dst'], r['dst_port'], r['error']) for r in rows] == [
+        ("a", "b", "5000", "False"), ("a", "c", "5002", "True")]
+    assert not os.path.exists(path + ".tmp")
+
+def test_recent_flows(tmp_path):
+    path = str(tmp_path / "results.csv")
+    assert recent_flows(path, 180) == {}
+    write_results(path, [row("a", "b", 5000, False), row("b", "a", 5001, True)])
+    flows = recent_flows(path, 180)
+    assert set(flows) == {("a", "b", 5000), ("b", "a", 5001)}
+    assert all(clear_at == pytest.approx(os.path.getmtime(path) + 180) for clear_at in flows.values())
+    assert recent_flows(path, 0) == {}
+
+    # Flows of a file written longer than the residual window ago are clear.
+    old = time.time() - 600
+    os.utime(path, (old, old))
+    assert recent_flows(path, 180) == {}
@@ -0,0 +1,388 @@
+import argparse
+import errno
+import ipaddress
+import os
+import resource
+import selectors
+import socket
+import struct
+import sys
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'quic-packet-builder'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pcap-reader'))
+
+from crypto import VERSIONS
+from decrypt import extract_sni
+from pcapreader import LINKTYPE_ETHERNET, iter_packets
+
+# A local stand-in for the GFW's QUIC SNI-based censorship, for exercising the measurement tools offline.
+#
+# The model follows what the experiments in this repository observed:
+#   * only UDP datagrams whose source port is greater than their destination port are inspected
+#   * only the first datagram of a flow is inspected; a flow is forgotten after 60 seconds without packets,
+#     after which its next datagram counts as a first datagram again
+#   * a first datagram that is a QUIC Initial with a blocklisted SNI is let through, and then every datagram
+#     of its 3-tuple (client IP, server IP, server port), in both directions, is dropped for 180 seconds
+#
+# All of these are options. Two ways to run it:
+#   pcap    filter a capture offline, using the capture's timestamps as the clock
+#   proxy   relay live UDP traffic on loopback (or between namespaces) and drop what the censor would drop
+
+PASS = 'pass'
+TRIGGER = 'trigger'
+DROP = 'drop'
+
+PORT_RULES = {
+    'gt': lambda sport, dport: sport > dport,
+    'ge': lambda sport, dport: sport >= dport,
+    'any': lambda sport, dport: True,
+}
+
+SNI_CACHE_SIZE = 4096
+
+def load_blocklist(path):
+    """Reads one domain per line (blank lines and # comments are skipped), lower-cased."""
+    with open(path, 'r') as f:
+        return {line.strip().lower().rstrip('.') for line in f if line.strip() and not line.startswith('#')}
+
+class Censor:
+    """
+    The censor's state machine. inspect() is called for every datagram in order and returns PASS, TRIGGER
+    (let through, but its tuple is now blocked) or DROP.
+
+    :param blocklist: set of blocked domains
+    :param residual: seconds a tuple stays blocked after a trigger
+    :param flow_timeout: seconds without packets after which a flow is forgotten
+    :param port_rule: one of PORT_RULES, which datagrams are inspected at all
+    :param tuple_size: 3 to block (client, server, server port), 4 to also include the client port
+    :param suffix: whether a listed domain also blocks its subdomains
+    :param inside: networks censored traffic originates from (None: any source)
+    """
+
+    def __init__(self, blocklist, residual=180, flow_timeout=60, port_rule='gt', tuple_size=3, suffix=True, inside=None):
+        if tuple_size not in (3, 4):
+            raise ValueError("tuple_size must be 3 or 4.")
+        self.blocklist = blocklist
+        self.residual = residual
+        self.flow_timeout = flow_timeout
+        self.port_rule = PORT_RULES[port_rule]
+        self.tuple_size = tuple_size
+        self.suffix = suffix
+        self.inside = [ipaddress.ip_network(net) for net in inside] if inside else None
+        # 4-tuple -> time of its last packet, in order of last use, so expired flows are at the front.
+        self.flows = OrderedDict()
+        # blocked tuple -> time the block ends
+        self.blocked = {}
+        self._sni_cache = OrderedDict()
+        self._initial_versions = {version.to_bytes(4, 'big') for version in VERSIONS}
+        self.stats = {'packets': 0, 'inspected': 0, 'triggered': 0, 'dropped': 0}
+        self._next_expire = float('-inf')
+
+    def is_blocked(self, domain):
+        domain = domain.lower().rstrip('.')
+        if domain in self.blocklist:
+            return True
+        if self.suffix:
+            while '.' in domain:
+                domain = domain.split('.', 1)[1]
+                if domain in self.blocklist:
+                    return True
+        return False
+
+    def sni(self, payload):
+        """The SNI of a client Initial, or None. Results are cached by payload, as load tests repeat payloads."""
+        if len(payload) < 7 or not payload[0] & 0x80 or bytes(payload[1:5]) not in self._initial_versions:
+            return None
+        key = bytes(payload)
+        if key in self._sni_cache:
+            self._sni_cache.move_to_end(key)
+            return self._sni_cache[key]
+        try:
+            sni = extract_sni(key)
+        except ValueError:
+            sni = None
+        self._sni_cache[key] = sni
+        if len(self._sni_cache) > SNI_CACHE_SIZE:
+            self._sni_cache.popitem(last=False)
+        return sni
+
+    def _expire(self, now):
+        """Forget idle flows and ended blocks, to bound memory. inspect() checks timeouts itself, so this can run rarely."""
+        flows = self.flows
+        while flows:
+            flow, last = next(iter(flows.items()))
+            if now - last <= self.flow_timeout:
+                break
+            del flows[flow]
+        if len(self.blocked) > 1024:
+            self.blocked = {key: until for key, until in self.blocked.items() if until > now}
+        self._next_expire = now + 1
+
+    def inspect(self, src, sport, dst, dport, payload, now):
+        stats = self.stats
+        stats['packets'] += 1
+        if now >= self._next_expire:
+            self._expire(now)
+
+        # A reverse packet (server -> client) belongs to the same tuple with the roles swapped.
+        if self.tuple_size == 3:
+            forward, reverse = (src, dst, dport), (dst, src, sport)
+        else:
+            forward, reverse = (src, sport, dst, dport), (dst, dport, src, sport)
+        for key in (forward, reverse):
+            until = self.blocked.get(key)
+            if until is not None:
+                if until > now:
+                    stats['dropped'] += 1
+                    return DROP
+                del self.blocked[key]
+
+        flows = self.flows
+        flow = (src, sport, dst, dport)
+        last = flows.get(flow)
+        if last is None:
+            last = flows.get((dst, dport, src, sport))
+            if last is not None:
+                flow = (dst, dport, src, sport)
+        flows[flow] = now
+        flows.move_to_end(flow)
+        if last is not None and now - last <= self.flow_timeout:
+            return PASS
+
+        if not self.port_rule(sport, dport):
+            return PASS
+        if self.inside is not None and not any(ipaddress.ip_address(src) in net for net in self.inside):
+            return PASS
+        stats['inspected'] += 1
+        sni = self.sni(payload)
+        if sni is None or not self.is_blocked(sni):
+            return PASS
+        stats['triggered'] += 1
+        self.blocked[forward] = now + self.residual
+        return TRIGGER
+
+_PCAP_HEADER = struct.Struct('<IHHiIII')
+_RECORD_HEADER = struct.Struct('<IIII')
+
+class PcapOutput:
+    """
+    Writes the frames of pcapreader Packets to a classic microsecond pcap file, whatever the format of the
+    capture they came from. A pcap file has one link type, that of the first frame written.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'wb', buffering=1 << 20)
+        self.linktype = None
+
+    def _header(self, linktype):
+        self.linktype = linktype
+        self.file.write(_PCAP_HEADER.pack(0xa1b2c3d4, 2, 4, 0, 0, 262144, linktype))
+
+    def write(self, packet):
+        if self.linktype is None:
+            self._header(packet.linktype)
+        elif packet.linktype != self.linktype:
+            raise ValueError(f"Cannot write link type {packet.linktype} to a pcap file of link type {self.linktype}.")
+        seconds, micros = divmod(round((packet.ts or 0) * 1e6), 1000000)
+        self.file.write(_RECORD_HEADER.pack(seconds, micros, len(packet.frame), len(packet.frame)))
+        self.file.write(packet.frame)
+
+    def close(self):
+        if self.linktype is None:
+            self._header(LINKTYPE_ETHERNET)
+        self.file.close()
+
+def run_pcap(censor, path, output=None, triggers=None):
+    """
+    Run every UDP packet of a capture (pcap or pcapng, read with pcapreader.iter_packets()) through censor;
+    write the packets it lets through to output.
+    """
+    out = PcapOutput(output) if output is not None else None
+    log = open(triggers, 'w') if triggers is not None else None
+    if log is not None:
+        log.write("ts,src,sport,dst,dport,sni\n")
+
+    start = time.perf_counter()
+    try:
+        for packet in iter_packets(path, udp_only=True):
+            verdict = censor.inspect(packet.src, packet.sport, packet.dst, packet.dport, packet.payload, packet.ts)
+            if verdict != DROP and out is not None:
+                out.write(packet)
+            if verdict == TRIGGER and log is not None:
+                log.write(f"{packet.ts:.6f},{packet.src},{packet.sport},{packet.dst},{packet.dport},{censor.sni(packet.payload)}\n")
+    finally:
+        if out is not None:
+            out.close()
+        if log is not None:
+            log.close()
+    return time.perf_counter() - start
+
+def raise_fd_limit():
+    """Raise the soft open-file limit to the hard one, as the proxy holds a socket per port and per flow."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and (hard == resource.RLIM_INFINITY or soft < hard):
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+class Proxy:
+    """
+    Relays UDP datagrams sent to listen_ip on every port in [port_lo, port_hi] to upstream_ip on the same port,
+    and the replies back, asking censor about each one. Every client flow gets its own upstream socket, so
+    replies find their way back; the upstream side therefore sees the proxy's ports, not the client's.
+    An upstream socket is closed once its flow has been idle for the censor's flow_timeout, and if the process
+    runs out of file descriptors anyway, the least recently used ones are closed to make room.
+    Datagrams that cannot be relayed (e.g. to an upstream port nothing listens on) are counted in `lost`.
+    """
+
+    # Upstream sockets closed at once when out of file descriptors
+    EVICT = 64
+
+    def __init__(self, censor, listen_ip, upstream_ip, port_lo, port_hi):
+        self.censor = censor
+        self.upstream_ip = upstream_ip
+        raise_fd_limit()
+        self.selector = selectors.DefaultSelector()
+        self.listeners = []
+        for port in range(port_lo, port_hi + 1):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.bind((listen_ip, port))
+            self.selector.register(sock, selectors.EVENT_READ, (True, sock, port, None))
+            self.listeners.append(sock)
+        # (client ip, client port, port) -> (upstream socket, last used), least recently used first
+        self.upstream = OrderedDict()
+        self.lost = 0
+        self._next_expire = float('-inf')
+        self.buf = bytearray(65535)
+        self.view = memoryview(self.buf)
+
+    def _close_upstream(self, sock):
+        self.selector.unregister(sock)
+        sock.close()
+
+    def _open_upstream(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.connect((self.upstream_ip, port))
+        return sock
+
+    def _upstream_socket(self, listener, client, port, now):
+        key = (client[0], client[1], port)
+        entry = self.upstream.get(key)
+        if entry is not None:
+            self.upstream[key] = (entry[0], now)
+            self.upstream.move_to_end(key)
+            return entry[0]
+
+        try:
+            sock = self._open_upstream(port)
+        except OSError as e:
+            if e.errno not in (errno.EMFILE, errno.ENFILE) or not self.upstream:
+                raise
+            for _ in range(min(self.EVICT, len(self.upstream))):
+                self._close_upstream(self.upstream.popitem(last=False)[1][0])
+            sock = self._open_upstream(port)
+        self.selector.register(sock, selectors.EVENT_READ, (False, listener, port, client))
+        self.upstream[key] = (sock, now)
+        return sock
+
+    def _expire(self, now):
+        """Close the upstream sockets of flows idle for longer than the censor's flow_timeout."""
+        upstream = self.upstream
+        while upstream:
+            key, (sock, last) = next(iter(upstream.items()))
+            if now - last <= self.censor.flow_timeout:
+                break
+            del upstream[key]
+            self._close_upstream(sock)
+        self._next_expire = now + 1
+
+    def serve(self, duration=None):
+        deadline = None if duration is None else time.monotonic() + duration
+        censor = self.censor
+        view = self.view
+        while deadline is None or time.monotonic() < deadline:
+            for key, _ in self.selector.select(timeout=1):
+                from_client, listener, port, client = key.data
+                sock = key.fileobj
+                if sock.fileno() == -1:
+                    # Closed to make room earlier in this batch of events
+                    continue
+                # Drain the socket, so a burst is handled in one wakeup.
+                while True:
+                    try:
+                        n, address = sock.recvfrom_into(self.buf)
+                    except (BlockingIOError, ConnectionRefusedError):
+                        break
+                    payload = view[:n]
+                    now = time.monotonic()
+                    try:
+                        if from_client:
+                            if censor.inspect(address[0], address[1], self.upstream_ip, port, payload, now) != DROP:
+                                self._upstream_socket(listener, address, port, now).send(payload)
+                        else:
+                            flow = (client[0], client[1], port)
+                            if flow in self.upstream:
+                                self.upstream[flow] = (sock, now)
+                                self.upstream.move_to_end(flow)
+                            if censor.inspect(self.upstream_ip, port, client[0], client[1], payload, now) != DROP:
+                                listener.sendto(payload, client)
+                    except OSError:
+                        # An ICMP port unreachable for an earlier datagram surfaces here as ConnectionRefusedError
+                        self.lost += 1
+                    if sock.fileno() == -1:
+                        break
+            now = time.monotonic()
+            if now >= self._next_expire:
+                self._expire(now)
+
+    def close(self):
+        for sock in self.listeners + [sock for sock, _ in self.upstream.values()]:
+            sock.close()
+        self.selector.close()
+
+def parse_ports(text):
+    lo, _, hi = text.partition('-')
+    return int(lo), int(hi or lo)
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate the GFW's QUIC SNI-based censorship locally.")
+    parser.add_argument('blocklist', help='Blocked domains, one per line (e.g. a daily_blocklist file).')
+    parser.add_argument('--residual', type=float, default=180, help='Seconds a tuple stays blocked after a trigger (default: 180).')
+    parser.add_argument('--flow_timeout', type=float, default=60, help='Seconds without packets after which a flow is forgotten and inspected again (default: 60).')
+    parser.add_argument('--port_rule', choices=sorted(PORT_RULES), default='gt', help='Which datagrams are inspected: source port > destination port (gt, the default), >= (ge), or any.')
+    parser.add_argument('--tuple', dest='tuple_size', type=int, choices=(3, 4), default=3, help='Block the 3-tuple (client, server, server port; the default) or the full 4-tuple.')
+    parser.add_argument('--exact', action='store_true', help='Only block the listed domains themselves, not their subdomains.')
+    parser.add_argument('--inside', action='append', default=None, help='Only inspect datagrams from this network (repeatable; default: any source), e.g. to model outbound-only triggering.')
+    modes = parser.add_subparsers(dest='mode', required=True)
+    pcap = modes.add_parser('pcap', help='Filter a capture offline.')
+    pcap.add_argument('input', help='pcap or pcapng file, of any link type pcapreader reads (Ethernet, raw IP, Linux cooked capture, BSD loopback).')
+    pcap.add_argument('-o', '--output', default=None, help='Write the packets the censor lets through to this pcap file.')
+    pcap.add_argument('--triggers', default=None, help='Write the triggering packets to this CSV file.')
+    proxy = modes.add_parser('proxy', help='Relay live UDP traffic through the censor.')
+    proxy.add_argument('--listen', default='127.0.0.1', help='Address clients send to (default: 127.0.0.1).')
+    proxy.add_argument('--upstream', default='127.0.0.2', help='Address the datagrams are relayed to (default: 127.0.0.2).')
+    proxy.add_argument('--ports', type=parse_ports, default=(443, 443), help='Port or port range to relay, e.g. 1030-1130 (default: 443).')
+    proxy.add_argument('--duration', type=float, default=None, help='Stop after this many seconds (default: run until interrupted).')
+    args = parser.parse_args()
+
+    censor = Censor(load_blocklist(args.blocklist), args.residual, args.flow_timeout, args.port_rule,
+                    args.tuple_size, not args.exact, args.inside)
+    if args.mode == 'pcap':
+        elapsed = run_pcap(censor, args.input, args.output, args.triggers)
+        rate = censor.stats['packets'] / elapsed if elapsed > 0 else 0
+        print(f"{censor.stats} in {elapsed:.2f} s ({rate:,.0f} packets/s)", file=sys.stderr)
+    else:
+        proxy = Proxy(censor, args.listen, args.upstream, *args.ports)
+        print(f"Relaying {args.listen}:{args.ports[0]}-{args.ports[1]} -> {args.upstream}", file=sys.stderr)
+        try:
+            proxy.serve(args.duration)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            proxy.close()
+            print({**censor.stats, 'lost': proxy.lost}, file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+import mmap
+import socket
+import struct
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# A small, fast reader for the captures the analysis scripts work on, instead of dissecting every frame with
+# scapy. The file is memory-mapped and only the headers that are needed are decoded with struct; payloads are
+# memoryview slices of the mapping, so nothing is copied per packet.
+#
+#   iter_frames()   (ts, linktype, frame) for every frame of a pcap or pcapng file
+#   iter_packets()  a Packet for every IPv4/IPv6 frame, with addresses as strings and UDP ports
+#   read_columns()  the same fields for a whole file at once, as NumPy arrays (IPv4 addresses as integers)
+#   iter_columns()  read_columns() in batches of frames, for captures larger than memory
+#
+# Supported link types: Ethernet (with VLAN tags), raw IP, Linux cooked capture (v1 and v2) and BSD loopback.
+
+# proto is the IP protocol number; sport and dport are None unless it is UDP (17) or TCP (6). payload is the
+# UDP payload for UDP, else the IP payload. frame is the whole link-layer frame, of the given link type.
+Packet = namedtuple('Packet', ['ts', 'src', 'dst', 'proto', 'sport', 'dport', 'payload', 'frame', 'linktype'])
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+_VLAN_ETHERTYPES = (0x8100, 0x88a8)
+# IPv6 extension headers that are skipped to find the transport header.
+_IPV6_EXTENSIONS = {0, 43, 44, 60}
+_IPV6_AH = 51
+
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+
+_U16 = struct.Struct('!H')
+_PORTS = struct.Struct('!HH')
+_ADDRS4 = struct.Struct('!II')
+
+def _open(path):
+    """Memory-map path. The mapping is closed by the garbage collector once no view of it is left."""
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def _iter_pcap(view):
+    magic = struct.unpack_from('<I', view, 0)[0]
+    if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+        endian = '<'
+    else:
+        endian = '>'
+        magic = struct.unpack_from('>I', view, 0)[0]
+    divisor = 1e9 if magic == PCAP_MAGIC_NS else 1e6
+    linktype = struct.unpack_from(endian + 'I', view, 20)[0] & 0x0fffffff
+    record = struct.Struct(endian + 'III')
+    offset = 24
+    end = len(view)
+    while offset + 16 <= end:
+        seconds, fraction, caplen = record.unpack_from(view, offset)
+        start = offset + 16
+        offset = start + caplen
+        if offset > end:
+            break  # truncated last record, as left by an interrupted tcpdump
+        yield seconds + fraction / divisor, linktype, start, offset
+
+def _tsresol(options, endian):
+    """The timestamp unit in seconds given by an Interface Description Block's if_tsresol option."""
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(endian + 'HH', options, offset)
+        if code == 0:
+            break
+        if code == 9 and length == 1:
+            value = options[offset + 4]
+            return 2.0 ** -(value & 0x7f) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+def _iter_pcapng(view):
+    end = len(view)
+    offset = 0
+    endian = '<'
+    interfaces = []
+    while offset + 12 <= end:
+        block_type = struct.unpack_from('<I', view, offset)[0]
+        if block_type == PCAPNG_SHB:
+            endian = '<' if struct.unpack_from('<I', view, offset + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            interfaces = []
+        block_type, block_len = struct.unpack_from(endian + 'II', view, offset)
+        if block_len < 12 or offset + block_len > end:
+            break
+        body = offset + 8
+        if block_type == 1:  # Interface Description Block
+            linktype, _, snaplen = struct.unpack_from(endian + 'HHI', view, body)
+            interfaces.append((linktype, _tsresol(view[body + 8:offset + block_len - 4], endian), snaplen))
+        elif block_type == 6:  # Enhanced Packet Block
+            interface, ts_high, ts_low, caplen = struct.unpack_from(endian + 'IIII', view, body)
+            if interface >= len(interfaces):
+                raise ValueError(f"Malformed pcapng: packet block at offset {offset} refers to interface {interface}, "
+                                 f"but {len(interfaces)} were described.")
+            linktype, unit, _ = interfaces[interface]
+            yield ((ts_high << 32) | ts_low) * unit, linktype, body + 20, body + 20 + caplen
+        elif block_type == 3:  # Simple Packet Block: no timestamp
+            if not interfaces:
+                raise ValueError(f"Malformed pcapng: packet block at offset {offset} precedes any interface description.")
+            linktype, _, snaplen = interfaces[0]
+            orig_len = struct.unpack_from(endian + 'I', view, body)[0]
+            yield None, linktype, body + 4, body + 4 + min(orig_len, snaplen or orig_len)
+        offset += block_len
+
+def _iter_records(path):
+    """(view, iterator of (ts, linktype, start, end)) for the frames of path, as offsets into view."""
+    view = _open(path)
+    if len(view) < 24:
+        return view, iter(())
+    if struct.unpack_from('<I', view, 0)[0] == PCAPNG_SHB:
+        return view, _iter_pcapng(view)
+    magics = (PCAP_MAGIC_US, PCAP_MAGIC_NS)
+    if struct.unpack_from('<I', view, 0)[0] not in magics and struct.unpack_from('>I', view, 0)[0] not in magics:
+        raise ValueError(f"{path} is neither a pcap nor a pcapng file.")
+    return view, _iter_pcap(view)
+
+def iter_frames(path):
+    """
+    Yield (ts, linktype, frame) for every frame of a pcap (microsecond or nanosecond, either byte order) or
+    pcapng file. ts is in seconds (None for pcapng Simple Packet Blocks); frame is a memoryview.
+    """
+    view, records = _iter_records(path)
+    for ts, linktype, start, end in records:
+        yield ts, linktype, view[start:end]
+
+def ip_offset(frame, linktype):
+    """(offset of the IP header in frame, IP version), or (-1, 0) if the frame does not carry IP."""
+    n = len(frame)
+    ethertype = None
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 12
+        while offset + 2 <= n:
+            ethertype = _U16.unpack_from(frame, offset)[0]
+            offset += 2
+            if ethertype not in _VLAN_ETHERTYPES:
+                break
+            offset += 2
+        else:
+            return -1, 0
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        offset = 0
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if n < 16:
+            return -1, 0
+        offset, ethertype = 16, _U16.unpack_from(frame, 14)[0]
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if n < 20:
+            return -1, 0
+        offset, ethertype = 20, _U16.unpack_from(frame, 0)[0]
+    elif linktype == LINKTYPE_NULL:
+        offset = 4
+    else:
+        return -1, 0
+    if offset >= n or ethertype not in (None, ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+        return -1, 0
+    version = frame[offset] >> 4
+    if version not in (4, 6):
+        return -1, 0
+    return offset, version
+
+def iter_packets(path, udp_only=False):
+    """
+    Yield a Packet for every IPv4 and IPv6 frame of path (only UDP ones if udp_only). Fragments after the
+    first carry no ports.
+    """
+    names = {}
+    for ts, linktype, frame in iter_frames(path):
+        ip, version = ip_offset(frame, linktype)
+        if version == 4:
+            if ip + 20 > len(frame):
+                continue
+            proto = frame[ip + 9]
+            if udp_only and proto != 17:
+                continue
+            end = min(ip + _U16.unpack_from(frame, ip + 2)[0], len(frame))
+            src_int, dst_int = _ADDRS4.unpack_from(frame, ip + 12)
+            src = names.get(src_int)
+            if src is None:
+                src = names[src_int] = socket.inet_ntoa(frame[ip + 12:ip + 16])
+            dst = names.get(dst_int)
+            if dst is None:
+                dst = names[dst_int] = socket.inet_ntoa(frame[ip + 16:ip + 20])
+            transport = ip + (frame[ip] & 0x0f) * 4
+            first_fragment = _U16.unpack_from(frame, ip + 6)[0] & 0x1fff == 0
+        elif version == 6:
+            if ip + 40 > len(frame):
+                continue
+            proto = frame[ip + 6]
+            end = min(ip + 40 + _U16.unpack_from(frame, ip + 4)[0], len(frame))
+            transport = ip + 40
+            first_fragment = True
+            while proto in _IPV6_EXTENSIONS or proto == _IPV6_AH:
+                if transport + 8 > end:
+                    break
+                if proto == 44:
+                    first_fragment = _U16.unpack_from(frame, transport + 2)[0] & 0xfff8 == 0
+                    length = 8
+                elif proto == _IPV6_AH:
+                    length = (frame[transport + 1] + 2) * 4
+                else:
+                    length = (frame[transport + 1] + 1) * 8
+                proto = frame[transport]
+                transport += length
+            if udp_only and proto != 17:
+                continue
+            key = bytes(frame[ip + 8:ip + 40])
+            src = names.get(key[:16])
+            if src is None:
+                src = names[key[:16]] = socket.inet_ntop(socket.AF_INET6, key[:16])
+            dst = names.get(key[16:])
+            if dst is None:
+                dst = names[key[16:]] = socket.inet_ntop(socket.AF_INET6, key[16:])
+        else:
+            continue
+
+        sport = dport = None
+        payload = frame[transport:end]
+        if proto in (6, 17) and first_fragment and transport + 4 <= end:
+            sport, dport = _PORTS.unpack_from(frame, transport)
+            if proto == 17:
+                payload = frame[transport + 8:end]
+        elif udp_only:
+            continue
+        yield Packet(ts, src, dst, proto, sport, dport, payload, frame, linktype)
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("read_columns() needs NumPy (pip install numpy).")
+
+def read_columns(path):
+    """
+    Read the headers of every frame of path into NumPy arrays, one entry per frame:
+
+        ts              float64 seconds (NaN if unknown)
+        version         IP version, 0 for frames without IP
+        src, dst        uint32 IPv4 addresses (0 for other frames; see ip_str())
+        proto           IP protocol (IPv6: the first next header, extension headers are not followed)
+        sport, dport    UDP/TCP ports (0 where there are none)
+        payload_offset  int64 offset of the UDP payload (else the IP payload) in the file
+        payload_len     int64 length of that payload in the capture
+
+    Only the walk over the record headers is a Python loop; the protocol headers of all frames are then
+    decoded at once with array operations. For captures too large for one set of arrays, see iter_columns().
+    """
+    for columns in iter_columns(path, None):
+        return columns
+
+def iter_columns(path, batch_size=1 << 20):
+    """
+    Yield the columns of read_columns() for batches of up to batch_size frames (None: all frames in one
+    batch), so a capture of any size is processed in bounded memory. At least one batch is yielded.
+    """
+    _require_numpy()
+    view, records = _iter_records(path)
+    data = np.frombuffer(view, dtype=np.uint8) if len(view) else np.zeros(1, dtype=np.uint8)
+    ts, offsets, ends, linktypes = [], [], [], []
+    batches = 0
+    for t, linktype, start, end in records:
+        ts.append(float('nan') if t is None else t)
+        linktypes.append(linktype)
+        offsets.append(start)
+        ends.append(end)
+        if len(ts) == batch_size:
+            yield _decode_columns(data, ts, offsets, ends, linktypes)
+            batches += 1
+            ts, offsets, ends, linktypes = [], [], [], []
+    if ts or not batches:
+        yield _decode_columns(data, ts, offsets, ends, linktypes)
+
+def _decode_columns(data, ts, offsets, ends, linktypes):
+    """Decode the headers of the frames at data[offsets[i]:ends[i]] into the read_columns() arrays."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    lengths = ends - offsets
+    linktypes = np.asarray(linktypes, dtype=np.int64)
+    last = len(data) - 1
+
+    def byte(index, valid):
+        return np.where(valid, data[np.clip(index, 0, last)], 0).astype(np.int64)
+
+    def u16(index, valid):
+        return (byte(index, valid) << 8) | byte(index + 1, valid)
+
+    def u32(index, valid):
+        return ((u16(index, valid) << 16) | u16(index + 2, valid)).astype(np.uint32)
+
+    # Link layer: one optional VLAN tag is handled here; deeper stacks are rare enough to leave as non-IP.
+    link = np.full(offsets.shape, -1, dtype=np.int64)
+    for linktype, length in ((LINKTYPE_RAW, 0), (LINKTYPE_IPV4, 0), (LINKTYPE_IPV6, 0), (LINKTYPE_NULL, 4),
+                             (LINKTYPE_LINUX_SLL, 16), (LINKTYPE_LINUX_SLL2, 20)):
+        link[linktypes == linktype] = length
+    ethernet = linktypes == LINKTYPE_ETHERNET
+    ethertype = u16(offsets + 12, ethernet & (lengths >= 14))
+    vlan = np.isin(ethertype, _VLAN_ETHERTYPES)
+    ethertype = np.where(vlan, u16(offsets + 16, vlan & (lengths >= 18)), ethertype)
+    link[ethernet] = np.where(vlan, 18, 14)[ethernet]
+    sll = linktypes == LINKTYPE_LINUX_SLL
+    sll2 = linktypes == LINKTYPE_LINUX_SLL2
+    ethertype = np.where(sll, u16(offsets + 14, sll & (lengths >= 16)), ethertype)
+    ethertype = np.where(sll2, u16(offsets, sll2 & (lengths >= 20)), ethertype)
+    framed = ethernet | sll | sll2
+    link[framed & ~np.isin(ethertype, (ETHERTYPE_IPV4, ETHERTYPE_IPV6))] = -1
+
+    ip = offsets + link
+    has_ip = (link >= 0) & (ip < ends)
+    version = byte(ip, has_ip) >> 4
+    v4 = has_ip & (version == 4) & (ip + 20 <= ends)
+    v6 = has_ip & (version == 6) & (ip + 40 <= ends)
+    version = np.where(v4, 4, np.where(v6, 6, 0))
+
+    proto = np.where(v4, byte(ip + 9, v4), byte(ip + 6, v6))
+    ip_end = np.minimum(np.where(v4, ip + u16(ip + 2, v4), ip + 40 + u16(ip + 4, v6)), ends)
+    transport = np.where(v4, ip + (byte(ip, v4) & 0x0f) * 4, ip + 40)
+    first_fragment = ~v4 | ((u16(ip + 6, v4) & 0x1fff) == 0)
+    has_ports = (v4 | v6) & np.isin(proto, (6, 17)) & first_fragment & (transport + 4 <= ip_end)
+    udp = has_ports & (proto == 17)
+    payload_offset = np.where(udp, transport + 8, transport)
+    return {
+        'ts': np.asarray(ts, dtype=np.float64),
+        'version': version.astype(np.uint8),
+        'src': u32(ip + 12, v4),
+        'dst': u32(ip + 16, v4),
+        'proto': proto.astype(np.uint8),
+        'sport': u16(transport, has_ports).astype(np.uint16),
+        'dport': u16(transport + 2, has_ports).astype(np.uint16),
+        'payload_offset': np.where(version > 0, payload_offset, offsets),
+        'payload_len': np.where(version > 0, np.maximum(ip_end - payload_offset, 0), 0),
+    }
+
+def ip_str(address):
+    """An IPv4 address from read_columns() as a dotted string."""
+    return socket.inet_ntoa(int(address).to_bytes(4, 'big'))
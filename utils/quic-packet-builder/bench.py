@@ -0,0 +1,161 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from build import build_packet
+from crypto import QUICCrypto
+from datagram import DatagramBuilder, PacketSpec
+from varint import encode_varint
+
+# Micro-benchmarks for the paths stress-corpus generation leans on. Each case is timed for about --min_time
+# seconds and reported as operations per second, then run again under tracemalloc to report the bytes it
+# allocates per operation: the transient peak above the starting point, and what is still held afterwards
+# (which should stay at zero). Results can be saved as a baseline JSON and later runs compared against it.
+
+PAYLOAD_SIZES = (0, 64, 1200, 1472)
+CID_LENGTHS = (0, 8, 20, 255)
+ALLOC_ITERATIONS = 200
+
+def _payload(size):
+    """A PADDING-like plaintext of size bytes with a PING in front, so it is not all zeros."""
+    return b'\x01' + bytes(size - 1) if size else b''
+
+def _cases():
+    """Yield (name, function) for every benchmark case. Each function runs one operation."""
+    rng = random.Random(0)
+
+    for value in (37, 15293, 494878333, 151288809941952652):
+        yield f"encode_varint/value={value}", lambda value=value: encode_varint(value)
+
+    for cid_len in CID_LENGTHS:
+        dcid = rng.randbytes(cid_len)
+
+        def derive(dcid=dcid):
+            QUICCrypto.cache_clear()
+            QUICCrypto(dcid, 1)
+        yield f"QUICCrypto.__init__/cid={cid_len}", derive
+        yield f"QUICCrypto.__init__/cid={cid_len}/cached", lambda dcid=dcid: QUICCrypto(dcid, 1)
+
+    crypto = QUICCrypto(bytes.fromhex('8394c8f03e515708'), 1)
+    keys = crypto.initial_keys(True)
+    yield "_build_nonce", lambda: crypto._build_nonce(keys.iv, 2)
+
+    sample = bytes(range(16))
+    yield "header_protect", lambda: crypto.header_protect(sample, 0xc3, b'\x00\x00\x00\x02')
+
+    aad = bytes.fromhex('c300000001088394c8f03e5157080000449e00000002')
+    for size in PAYLOAD_SIZES:
+        payload = _payload(size)
+        yield f"_aead_encrypt/payload={size}", lambda payload=payload: crypto._aead_encrypt(keys, 2, aad, payload)
+
+    # 4-byte packet numbers, so even an empty payload leaves a full header protection sample (the AEAD tag).
+    for size in PAYLOAD_SIZES:
+        for cid_len in CID_LENGTHS:
+            spec = {
+                'pkt_num_len_bits': '11',
+                'dcid_len': cid_len, 'dcid': rng.randbytes(cid_len).hex(),
+                'scid_len': cid_len, 'scid': rng.randbytes(cid_len).hex(),
+                'payload': _payload(size).hex(),
+            }
+            yield f"build_packet/payload={size}/cid={cid_len}", lambda spec=spec: build_packet(spec)
+
+    builder = DatagramBuilder()
+    packets = [PacketSpec({'dcid': rng.randbytes(8).hex(), 'payload': _payload(64).hex()})]
+    for size in PAYLOAD_SIZES[2:]:
+        yield f"DatagramBuilder.build/size={size}", lambda size=size: builder.build(packets, size)
+
+def _time(func, min_time):
+    """Operations per second of func, calling it in growing batches until min_time has passed."""
+    func()  # warm up caches and lazily built contexts
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return number / elapsed
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+
+def _allocations(func):
+    """(peak, retained) bytes allocated per operation of func, measured with tracemalloc."""
+    func()
+    tracemalloc.start()
+    try:
+        peak = 0
+        start, _ = tracemalloc.get_traced_memory()
+        for _ in range(ALLOC_ITERATIONS):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            func()
+            _, op_peak = tracemalloc.get_traced_memory()
+            peak = max(peak, op_peak - before)
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, max(end - start, 0) / ALLOC_ITERATIONS
+
+def run(pattern=None, min_time=0.2):
+    """Run the benchmark cases whose name contains pattern. Returns {name: {ops_per_sec, peak_bytes, retained_bytes}}."""
+    results = {}
+    for name, func in _cases():
+        if pattern and pattern not in name:
+            continue
+        ops = _time(func, min_time)
+        peak, retained = _allocations(func)
+        results[name] = {'ops_per_sec': round(ops, 1), 'peak_bytes': peak, 'retained_bytes': round(retained, 1)}
+        print(f"{name:45} {ops:14,.0f} ops/s {peak:8} B peak {retained:8.1f} B retained", file=sys.stderr)
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline. Returns the list of regressions: cases whose throughput dropped by more
+    than threshold (a fraction) or whose peak allocation grew by more than threshold.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        speed = result['ops_per_sec'] / base['ops_per_sec']
+        status = ''
+        if speed < 1 - threshold:
+            status = 'SLOWER'
+            regressions.append(name)
+        elif base['peak_bytes'] and result['peak_bytes'] > base['peak_bytes'] * (1 + threshold):
+            status = 'MORE MEMORY'
+            regressions.append(name)
+        print(f"{name:45} {speed:6.2f}x  {base['peak_bytes']:8} -> {result['peak_bytes']:8} B peak  {status}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the QUIC packet builder hot path.')
+    parser.add_argument('-k', dest='pattern', default=None, help='Only run cases whose name contains this string, e.g. build_packet.')
+    parser.add_argument('--min_time', type=float, default=0.2, help='Seconds to time each case for (default: 0.2).')
+    parser.add_argument('--save', default=None, help='Save the results to this JSON file as a new baseline.')
+    parser.add_argument('--compare', default=None, help='Compare the results against this baseline JSON file and exit with status 1 on regressions.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Fraction of slowdown (or peak memory growth) counted as a regression (default: 0.2).')
+    args = parser.parse_args()
+
+    results = run(args.pattern, args.min_time)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results}, f, indent=2)
+            f.write('\n')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions.")
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,23 @@
 import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import random
 import secrets
+import sys
+import tempfile
 
-from crypto import QUICCrypto
-
-def encode_varint(value):
-    """Encode a value as a QUIC variable-length integer."""
-    # For simplicity, only handle up to 4-byte encodings in this example.
-    # Extend as needed for larger values.
-    if value <= 63:
-        # Fits in 6 bits
-        return bytes([(value & 0x3f)])  # 00xxxxxx
-    elif value <= 16383:
-        # Fits in 14 bits
-        # 01xxxxxx xxxxxxxx
-        return bytes([
-            0x40 | ((value >> 8) & 0x3f),
-            value & 0xff
-        ])
-    elif value <= 1073741823:
-        # Fits in 30 bits
-        # 10xxxxxx xxxxxxxx xxxxxxxx xxxxxxxx
-        return bytes([
-            0x80 | ((value >> 24) & 0x3f),
-            (value >> 16) & 0xff,
-            (value >> 8) & 0xff,
-            value & 0xff
-        ])
-    else:
-        # For completeness, handle larger values:
-        # 11xxxxxx [8-byte total]
-        # However, this is not expected for small test values.
-        # Raise an error or implement as needed.
-        raise ValueError("Value too large for this example's varint encoder.")
+from crypto import QUICCrypto, initial_version
+from output import OUTPUT_ARGS, FramesWriter, add_output_arguments, open_writer_from_args, read_packets
+from varint import encode_varint
 
-def main():
+# Number of specs built by one worker task in parallel batch mode. Shard i is seeded from (seed, i), so a given
+# seed reproduces the same corpus whatever the number of workers.
+SHARD_SIZE = 10000
+
+def get_parser():
     parser = argparse.ArgumentParser(description='Construct a QUIC-like long header packet.')
     parser.add_argument('--header_form', type=int, default=1, help='1-bit header form (default: 1)')
     parser.add_argument('--fixed_bit', type=int, default=1, help='1-bit fixed bit (default: 1)')
@@ -55,7 +39,27 @@ def main():
     parser.add_argument('-a', action='store_true', help='Print additional data instead of the full packet.')
     parser.add_argument('-s', action='store_true', help='Print sample data instead of the full packet.')
 
-    args = parser.parse_args()
+    parser.add_argument('--batch', default=None, help='Build one packet per line of this JSONL file (- for stdin). Each line is an object with the same fields as the flags above, e.g. {"dcid_len": 0, "payload": "0600..."}.')
+    parser.add_argument('--versions', default=None, help='With --batch, build every spec once per version in this comma-separated hex list (e.g. 00000001,6b3343cf,ff00001d,1a2a3a4a), sharing one DCID and SCID and using each version\'s Initial packet type and keys.')
+    parser.add_argument('--repeat', type=int, default=1, help='With --batch, build each spec this many times (default: 1).')
+    parser.add_argument('--seed', default=None, help='With --batch, derive random DCIDs, SCIDs and tokens from this seed so the corpus is reproducible (default: random).')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='With --batch, build with this many worker processes (0: one per core; default: 1).')
+    add_output_arguments(parser)
+    return parser
+
+# Options of batch mode itself, not packet fields.
+BATCH_ARGS = ('batch', 'versions', 'repeat', 'seed', 'jobs')
+
+# Fields accepted by build_packet() and their CLI defaults.
+SPEC_DEFAULTS = {k: v for k, v in vars(get_parser().parse_args([])).items() if k not in BATCH_ARGS and k not in OUTPUT_ARGS}
+
+def encode_header(spec):
+    """
+    Encode the long header of a resolved spec (see resolve_spec()) up to, not including, the Length field,
+    with the first byte unprotected. Returns (header prefix, packet number bytes, version, DCID).
+    The Length field and the packet number follow the prefix in that order.
+    """
+    args = argparse.Namespace(**spec)
 
     # Parse and validate bit fields:
     # header_form: 1 bit (0 or 1)
@@ -97,58 +101,59 @@ def main():
     version_val = int(version_str, 16)
     version_bytes = version_val.to_bytes(4, 'big')
 
-    # Handle Destination Connection ID:
-    if args.dcid is None:
-        dcid_bytes = secrets.token_bytes(args.dcid_len)
-    else:
-        dcid_bytes = bytes.fromhex(args.dcid)
-
-    # Handle Source Connection ID:
-    if args.scid is None:
-        scid_bytes = secrets.token_bytes(args.scid_len)
-    else:
-        scid_bytes = bytes.fromhex(args.scid)
-
-    # Handle token:
-    # If token_len > 0 and token not provided, generate random
+    # Connection IDs and the token were drawn by resolve_spec() if not given.
+    dcid_bytes = bytes.fromhex(args.dcid)
+    scid_bytes = bytes.fromhex(args.scid)
     if args.token_len > 0:
         token_length = args.token_len
-        if args.token is None:
-            token_bytes = secrets.token_bytes(token_length)
-        else:
-            token_bytes = bytes.fromhex(args.token)
+        token_bytes = bytes.fromhex(args.token)
     else:
         token_length = 0
         token_bytes = b''
 
-    token_length_encoded = encode_varint(token_length)
-
-    # Handle Length (the length of the remaining payload, which typically includes packet number and payload):
-    # The remaining payload includes Packet Number + Application Data (payload_bytes).
-    # By QUIC specification for long headers (e.g. Initial), Length covers the entire remainder of the packet after
-    # DCID, SCID, token length, token. It includes packet number and payload. 
-    #
-    # We'll handle the packet number after we determine its length from pnl.
     # PNL bits + 1 = length in bytes. QUIC initial headers usually have a PN length at least 2, but we’ll trust input.
     pn_len_map = {0:1, 1:2, 2:3, 3:4}
     pn_len = pn_len_map[pnl]
 
-    # Handle payload:
-    if args.payload:
-        payload_bytes = bytes.fromhex(args.payload)
-    else:
-        payload_bytes = b''
-
     # If packet_number not provided, use zero-bytes:
     if args.packet_number is None:
         packet_number_bytes = b'\x00' * pn_len
     else:
         # Parse given packet number
         packet_number_bytes = bytes.fromhex(args.packet_number)
+
+    prefix = b''.join((
+        bytes((header_byte,)), version_bytes,
+        bytes((args.dcid_len,)), dcid_bytes, bytes((args.scid_len,)), scid_bytes,
+        encode_varint(token_length), token_bytes,
+    ))
+    return prefix, packet_number_bytes, version_val, dcid_bytes
+
+def build_packet(spec, rng=None):
+    """
+    Build one packet from a spec, a dict using the same field names as the CLI flags
+    (e.g. {'dcid_len': 0, 'scid_len': 0, 'payload': '0600...'}). Missing fields take the CLI defaults.
+    Returns the protected packet, or the additional data / sample if 'a' / 's' is set.
+
+    Random DCIDs, SCIDs and tokens come from rng (a random.Random) if given, else from the secrets module.
+    """
+    args = argparse.Namespace(**resolve_spec(spec, rng))
+    prefix, packet_number_bytes, version_val, dcid_bytes = encode_header(vars(args))
+    header_byte = prefix[0]
     packet_number_int = int.from_bytes(packet_number_bytes, 'big')
 
+    # Handle payload:
+    if args.payload:
+        payload_bytes = bytes.fromhex(args.payload)
+    else:
+        payload_bytes = b''
+
     crypto = QUICCrypto(dcid_bytes, version_val)
 
+    # Handle Length (the length of the remaining payload, which typically includes packet number and payload):
+    # By QUIC specification for long headers (e.g. Initial), Length covers the entire remainder of the packet after
+    # DCID, SCID, token length, token. It includes packet number and payload.
+    #
     # Now, if length is None, default to len(payload_bytes):
     # Actually in QUIC, length is the length of "packet_number + payload", not just payload.
     # We'll interpret length as the size of packet_number_bytes + payload_bytes.
@@ -159,15 +164,7 @@ def main():
 
     length_encoded = encode_varint(length_value)
 
-    packet = bytearray()
-    packet.append(header_byte)
-    packet.extend(version_bytes)
-    packet.append(args.dcid_len)
-    packet.extend(dcid_bytes)
-    packet.append(args.scid_len)
-    packet.extend(scid_bytes)
-    packet.extend(token_length_encoded)
-    packet.extend(token_bytes)
+    packet = bytearray(prefix)
     packet.extend(length_encoded)
     packet.extend(packet_number_bytes)
 
@@ -177,8 +174,7 @@ def main():
         aad = bytes(packet)
 
     if args.a:
-        print(aad.hex())
-        return
+        return aad
 
     cipher_payload = crypto.encrypt_packet(True, packet_number_int, aad, payload_bytes)
     if args.sample is not None:
@@ -197,11 +193,150 @@ def main():
     packet.extend(cipher_payload)
 
     if args.s:
-        print(sample.hex())
+        return sample
+
+    return bytes(packet)
+
+def iter_specs(lines):
+    """Yield packet specs from JSONL lines, skipping blank lines and # comments."""
+    for line_num, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid packet spec on line {line_num}: {e}") from e
+
+def resolve_spec(spec, rng=None):
+    """
+    Return a copy of spec with the CLI defaults filled in and its random DCID, SCID and token drawn, in that
+    order, from rng (a random.Random) if given, else from the secrets module. Raises ValueError on unknown fields.
+    """
+    unknown = set(spec) - set(SPEC_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown packet spec fields: {', '.join(sorted(unknown))}")
+    spec = {**SPEC_DEFAULTS, **spec}
+    random_bytes = secrets.token_bytes if rng is None else rng.randbytes
+    if spec['dcid'] is None:
+        spec['dcid'] = random_bytes(spec['dcid_len']).hex()
+    if spec['scid'] is None:
+        spec['scid'] = random_bytes(spec['scid_len']).hex()
+    if spec['token_len'] > 0 and spec['token'] is None:
+        spec['token'] = random_bytes(spec['token_len']).hex()
+    return spec
+
+def parse_versions(text):
+    """Parse a comma-separated list of hex versions, e.g. "1,6b3343cf"."""
+    return [int(v, 16) for v in text.split(',') if v.strip()]
+
+def version_matrix(spec, versions, rng=None):
+    """
+    Yield (version, packet) for the same packet under each version: one DCID, SCID and payload, with the
+    version's Initial packet type and Initial keys (see crypto.VERSIONS). Key derivation for each
+    (DCID, version) pair goes through QUICCrypto's shared cache.
+    """
+    spec = resolve_spec(spec, rng)
+    for version in versions:
+        packet_type = format(initial_version(version).initial_type, '02b')
+        yield version, build_packet({**spec, 'version': f"{version:08x}", 'packet_type': packet_type})
+
+def _build_packets(spec, rng, repeat, versions):
+    """The packets batch mode builds for one spec."""
+    for _ in range(repeat):
+        if versions:
+            for _, packet in version_matrix(spec, versions, rng):
+                yield packet
+        else:
+            yield build_packet(spec, rng)
+
+def _shard_rng(seed, shard):
+    """The random.Random for one shard. Seeding with a string is stable across runs and platforms."""
+    return random.Random(f"{seed}/{shard}")
+
+def _build_shard(task):
+    """Worker: build one shard of specs into a frames file in tmpdir. Returns (path, packet count)."""
+    shard, specs, seed, repeat, versions, tmpdir = task
+    rng = None if seed is None else _shard_rng(seed, shard)
+    path = os.path.join(tmpdir, f"shard-{shard:08d}.bin")
+    with FramesWriter(path) as writer:
+        for spec in specs:
+            for packet in _build_packets(spec, rng, repeat, versions):
+                writer.write(packet)
+    return path, writer.count
+
+def run_batch(spec_file, writer, jobs=1, seed=None, repeat=1, versions=None):
+    """
+    Build every spec in spec_file and write the packets with writer (see output.py). Returns the packet count.
+
+    Specs are cut into shards of SHARD_SIZE lines. With a seed, shard i draws its random fields from its own
+    generator seeded with (seed, i), so the corpus is the same for any number of jobs. With jobs > 1 (or 0 for
+    one per core), shards are built by a process pool into temporary frames files next to the output and merged
+    into writer in shard order as they complete, with at most 2 * jobs shards in flight. With versions, each
+    spec is built once per version (see version_matrix()).
+    """
+    spec_in = sys.stdin if spec_file == '-' else open(spec_file, 'r')
+    specs = iter_specs(spec_in)
+    shards = iter(lambda: list(itertools.islice(specs, SHARD_SIZE)), [])
+    if jobs < 0:
+        raise ValueError(f"jobs must be 0 (one per core) or more, not {jobs}.")
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    count = 0
+    try:
+        if jobs == 1:
+            for shard, shard_specs in enumerate(shards):
+                rng = None if seed is None else _shard_rng(seed, shard)
+                for spec in shard_specs:
+                    for packet in _build_packets(spec, rng, repeat, versions):
+                        writer.write(packet)
+                        count += 1
+            return count
+
+        tmp_parent = os.path.dirname(os.path.abspath(writer.path)) if writer.path else None
+        with tempfile.TemporaryDirectory(prefix='build-shards-', dir=tmp_parent) as tmpdir, \
+                multiprocessing.Pool(jobs) as pool:
+            tasks = ((shard, shard_specs, seed, repeat, versions, tmpdir) for shard, shard_specs in enumerate(shards))
+            # Pool.imap would read every shard up front; keep at most 2 * jobs in flight instead, so specs
+            # are read and shard files written only as fast as they are merged.
+            pending = collections.deque()
+
+            def merge_oldest():
+                nonlocal count
+                path, shard_count = pending.popleft().get()
+                with open(path, 'rb') as f:
+                    for packet in read_packets(f):
+                        writer.write(packet)
+                os.remove(path)
+                count += shard_count
+
+            for task in tasks:
+                pending.append(pool.apply_async(_build_shard, (task,)))
+                if len(pending) >= 2 * jobs:
+                    merge_oldest()
+            while pending:
+                merge_oldest()
+    finally:
+        if spec_in is not sys.stdin:
+            spec_in.close()
+    return count
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 (one per core) or more")
+
+    if args.batch is not None:
+        with open_writer_from_args(args) as writer:
+            versions = parse_versions(args.versions) if args.versions else None
+            count = run_batch(args.batch, writer, args.jobs, args.seed, args.repeat, versions)
+        print(f"Built {count} packets.", file=sys.stderr)
         return
 
-    # Print out the packet in hex:
-    print(packet.hex())
+    spec = {k: v for k, v in vars(args).items() if k in SPEC_DEFAULTS}
+    # Print out the packet (or the additional data / sample with -a / -s) in hex:
+    print(build_packet(spec).hex())
 
 if __name__ == '__main__':
     main()
@@ -1,29 +1,128 @@
-from cryptography.hazmat.primitives import hashes, hmac
-from cryptography.hazmat.primitives.kdf.hkdf import HKDF, HKDFExpand
+import hmac
+import threading
+from collections import OrderedDict
+
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import (
     Cipher, algorithms, modes
 )
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
 
+# AESGCM.encrypt_into() (cryptography 45+) encrypts into a caller's buffer without building a GCM context.
+_HAVE_ENCRYPT_INTO = hasattr(AESGCM, 'encrypt_into')
+
+class _KeySet:
+    """
+    Initial keys for one side, plus the long-lived AEAD and header protection contexts built from them.
+
+    Key sets are shared through QUICCrypto's cache, so the header protection encryptor, an OpenSSL context
+    with state of its own, is only used with hp_lock held. AESGCM is safe to share between threads.
+    """
+    __slots__ = ('key', 'iv', 'hp_key', 'aead', 'hp_ecb', 'hp_lock')
+
+    def __init__(self, key: bytes, iv: bytes, hp_key: bytes):
+        self.key = key
+        self.iv = iv
+        self.hp_key = hp_key
+        self.aead = AESGCM(key)
+        # ECB has no chaining state, so one encryptor can be fed block-aligned samples forever.
+        self.hp_ecb = Cipher(algorithms.AES(hp_key), modes.ECB(), backend=default_backend()).encryptor()
+        self.hp_lock = threading.Lock()
+
+def _hkdf_label(label: bytes, context: bytes, length: int) -> bytes:
+    """
+    The HkdfLabel structure of TLS 1.3 (RFC 8446 Section 7.1), used as the HKDF-Expand info:
+
+    struct {
+        uint16 length = Length;
+        opaque label<7..255> = "tls13 " + Label;
+        opaque context<0..255> = Context;
+    } HkdfLabel;
+    """
+    full_label = b"tls13 " + label
+    return length.to_bytes(2, "big") + bytes([len(full_label)]) + full_label + bytes([len(context)]) + context
+
+class InitialVersion:
+    """
+    How one QUIC version protects its Initial packets: the salt, the key derivation labels and the
+    long header packet type of an Initial.
+
+    The HkdfLabel structures of every label are built once here, each with the 0x01 counter byte of
+    HKDF-Expand appended, since all Initial secrets and keys fit in a single SHA-256 block of output.
+    """
+
+    def __init__(self, name: str, salt: str, label_prefix: bytes = b"quic ", initial_type: int = 0):
+        self.name = name
+        self.salt = bytes.fromhex(salt)
+        self.initial_type = initial_type
+        self.key_label = label_prefix + b"key"
+        self.iv_label = label_prefix + b"iv"
+        self.hp_label = label_prefix + b"hp"
+        self.client_info = _hkdf_label(b"client in", b"", 32) + b"\x01"
+        self.server_info = _hkdf_label(b"server in", b"", 32) + b"\x01"
+        self.key_info = _hkdf_label(self.key_label, b"", 16) + b"\x01"
+        self.iv_info = _hkdf_label(self.iv_label, b"", 12) + b"\x01"
+        self.hp_info = _hkdf_label(self.hp_label, b"", 16) + b"\x01"
+
+    def __repr__(self):
+        return f"InitialVersion({self.name!r})"
+
+_DRAFT_29 = InitialVersion("draft-29", "afbfec289993d24c9e9786f19c6111e04390a899")
+
+# Versions whose Initial protection we know, by wire version number.
+VERSIONS = {
+    0x00000001: InitialVersion("v1", "38762cf7f55934b34d179ae6a4c80cadccbb7f0a"),  # RFC 9001 Section 5.2
+    0x6b3343cf: InitialVersion("v2", "0dede3def700a6db819381be6e269dcbf9bd2ed9", b"quicv2 ", 1),  # RFC 9369 Section 3.3
+    # Drafts 29 to 32 share one salt (draft-ietf-quic-tls-29 Section 5.2).
+    0xff00001d: _DRAFT_29,
+    0xff00001e: _DRAFT_29,
+    0xff00001f: _DRAFT_29,
+    0xff000020: _DRAFT_29,
+}
+
+def is_grease(version: int) -> bool:
+    """True for the reserved 0x?a?a?a?a versions used to exercise version negotiation (RFC 9000 Section 15)."""
+    return version & 0x0f0f0f0f == 0x0a0a0a0a
+
+def initial_version(version: int, fallback: int = 1) -> InitialVersion:
+    """
+    The Initial protection of a version. GREASE and other unknown versions have none of their own, so they get
+    that of fallback, which is how a client probing with such a version protects its Initials (and how exp4
+    was made). Pass fallback=None to raise ValueError instead.
+    """
+    params = VERSIONS.get(version)
+    if params is None:
+        if fallback is None:
+            raise ValueError(f"No initial salt defined for QUIC version {version:#010x}")
+        params = VERSIONS[fallback]
+    return params
+
 class QUICCrypto:
-    # Initial salt for QUIC version 1 (RFC9001 Section 5.2)
-    INITIAL_SALTS = {
-        1: bytes.fromhex("38762cf7f55934b34d179ae6a4c80cadccbb7f0a"),
-    }
+    # Initial salts by version, kept for callers that only need the salt. See VERSIONS for the full registry.
+    INITIAL_SALTS = {version: params.salt for version, params in VERSIONS.items()}
+
+    # Derived Initial key sets, shared by all instances and bounded in LRU order:
+    # (dcid, InitialVersion, is_client) -> _KeySet. Versions sharing a salt and labels share entries.
+    # The cache and its counters are only touched with _cache_lock held, so instances can be made in threads.
+    KEY_CACHE_SIZE = 4096
+    _key_cache = OrderedDict()
+    _cache_lock = threading.Lock()
+    _cache_hits = 0
+    _cache_misses = 0
     
-    def __init__(self, dcid: bytes, version: int):
+    def __init__(self, dcid: bytes, version: int, fallback: int = 1):
         """
         Initialize the QUIC crypto state. Derives initial keys from DCID and version.
         
         :param dcid: Destination Connection ID (bytes)
         :param version: QUIC Version (int)
+        :param fallback: version whose keys GREASE and unknown versions use (None: raise ValueError for them)
         """
-        if version not in self.INITIAL_SALTS:
-            raise ValueError(f"No initial salt defined for QUIC version {version}")
-        
+        self.params = initial_version(version, fallback)
         self.version = version
-        self.dcid = dcid
-        self.salt = self.INITIAL_SALTS[version]
+        self.dcid = bytes(dcid)
+        self.salt = self.params.salt
         
         # The AEAD for initial keys is AES-128-GCM, and QUIC uses 16-byte keys, 12-byte IVs
         # The header protection uses AES-ECB with a 16-byte key
@@ -32,86 +131,122 @@ class QUICCrypto:
         self.hp_key_length = 16
         self.hash_cls = hashes.SHA256
         
-        # Derive secrets
-        initial_secret = self._hkdf_extract(self.salt, dcid)
-        client_initial_secret = self._hkdf_expand_label(initial_secret, b"client in", b"", self.hash_cls().digest_size)
-        server_initial_secret = self._hkdf_expand_label(initial_secret, b"server in", b"", self.hash_cls().digest_size)
-        
-        # Derive client keys
-        self.client_key = self._hkdf_expand_label(client_initial_secret, b"quic key", b"", self.aead_key_length)
-        self.client_iv = self._hkdf_expand_label(client_initial_secret, b"quic iv", b"", self.iv_length)
-        self.client_hp_key = self._hkdf_expand_label(client_initial_secret, b"quic hp", b"", self.hp_key_length)
-        
-        # Derive server keys
-        self.server_key = self._hkdf_expand_label(server_initial_secret, b"quic key", b"", self.aead_key_length)
-        self.server_iv = self._hkdf_expand_label(server_initial_secret, b"quic iv", b"", self.iv_length)
-        self.server_hp_key = self._hkdf_expand_label(server_initial_secret, b"quic hp", b"", self.hp_key_length)
-        
-    def _hkdf_extract(self, salt: bytes, ikm: bytes) -> bytes:
-        """HKDF-Extract using SHA-256."""
-        # HKDF-Extract is essentially HMAC with salt
-        hk = hmac.HMAC(salt, self.hash_cls(), backend=default_backend())
-        hk.update(ikm)
-        return hk.finalize()
+        # Client keys are always needed; server keys are only derived on first use.
+        self._initial_secret = None
+        self._mask_buf = None
+        self._client = self._initial_keys(True)
+        self.client_key = self._client.key
+        self.client_iv = self._client.iv
+        self.client_hp_key = self._client.hp_key
 
-    def _hkdf_expand_label(self, secret: bytes, label: bytes, context: bytes, length: int) -> bytes:
+    def initial_keys(self, is_client: bool = True):
         """
-        HKDF-Expand-Label as defined by TLS 1.3 and QUIC.
-        
-        HKDF-Expand-Label(Secret, Label, Context, Length) =
-            HKDF-Expand(Secret, HkdfLabel, Length)
-            
-        Where HkdfLabel = length(Label) + Label + length(Context) + Context
+        The Initial key set of one side: key, iv and hp_key, plus the AESGCM context (aead) and the header
+        protection encryptor (hp_ecb) built from them, for callers that encrypt without going through this class.
         """
-        full_label = b"tls13 " + label
-        
-        # The "HkdfLabel" structure in TLS 1.3 for QUIC:
-        # struct {
-        #   uint16 length = Length;
-        #   opaque label<0..255> = "quic " + Label;
-        #   opaque context<0..255> = Context;
-        # } HkdfLabel;
-        #
-        # length is a 2-byte integer
-        # Then a single-byte length for label and context each, followed by label and context bytes
-        hkdf_label = (length.to_bytes(2, "big") +
-                      bytes([len(full_label)]) + full_label +
-                      bytes([len(context)]) + context)
-        
-        hkdf = HKDFExpand(
-            algorithm=self.hash_cls(),
-            length=length,
-            info=hkdf_label,
-            backend=default_backend()
+        return self._client if is_client else self._initial_keys(False)
+
+    def nonce(self, is_client: bool, pn: int) -> bytes:
+        """The AEAD nonce of packet number pn for one side."""
+        return self._build_nonce(self.initial_keys(is_client).iv, pn)
+
+    @property
+    def server_key(self) -> bytes:
+        return self._initial_keys(False).key
+
+    @property
+    def server_iv(self) -> bytes:
+        return self._initial_keys(False).iv
+
+    @property
+    def server_hp_key(self) -> bytes:
+        return self._initial_keys(False).hp_key
+
+    def _initial_keys(self, is_client: bool) -> _KeySet:
+        """
+        Return the key set for one side, from the shared cache if this DCID and
+        version were seen before, otherwise derived with HKDF and cached.
+        """
+        cache = QUICCrypto._key_cache
+        cache_key = (self.dcid, self.params, is_client)
+        with QUICCrypto._cache_lock:
+            keys = cache.get(cache_key)
+            if keys is not None:
+                QUICCrypto._cache_hits += 1
+                cache.move_to_end(cache_key)
+                return keys
+            QUICCrypto._cache_misses += 1
+
+        # Derived without the lock; if another thread derived the same keys meanwhile, its set is kept.
+        params = self.params
+        if self._initial_secret is None:
+            self._initial_secret = self._hkdf_extract(self.salt, self.dcid)
+        # HKDF-Expand-Label with the version's precomputed labels; each output is one HMAC block.
+        secret = hmac.digest(self._initial_secret, params.client_info if is_client else params.server_info, "sha256")
+        keys = _KeySet(
+            hmac.digest(secret, params.key_info, "sha256")[:self.aead_key_length],
+            hmac.digest(secret, params.iv_info, "sha256")[:self.iv_length],
+            hmac.digest(secret, params.hp_info, "sha256")[:self.hp_key_length],
         )
-        return hkdf.derive(secret)
-    
-    def _aead_encrypt(self, key: bytes, iv: bytes, pn: int, aad: bytes, plaintext: bytes) -> bytes:
+        with QUICCrypto._cache_lock:
+            keys = cache.setdefault(cache_key, keys)
+            if len(cache) > QUICCrypto.KEY_CACHE_SIZE:
+                cache.popitem(last=False)
+        return keys
+
+    @classmethod
+    def cache_info(cls) -> dict:
+        """Hit/miss counters and occupancy of the shared Initial key cache."""
+        with cls._cache_lock:
+            return {
+                'hits': cls._cache_hits,
+                'misses': cls._cache_misses,
+                'size': len(cls._key_cache),
+                'maxsize': cls.KEY_CACHE_SIZE,
+            }
+
+    @classmethod
+    def cache_clear(cls):
+        """Drop all cached key sets and reset the counters."""
+        with cls._cache_lock:
+            cls._key_cache.clear()
+            cls._cache_hits = 0
+            cls._cache_misses = 0
+
+    def _hkdf_extract(self, salt: bytes, ikm: bytes) -> bytes:
+        """HKDF-Extract using SHA-256."""
+        # HKDF-Extract is essentially HMAC with salt
+        return hmac.digest(salt, ikm, "sha256")
+
+    def _aead_encrypt(self, keys: _KeySet, pn: int, aad: bytes, plaintext: bytes) -> bytes:
         """
         AEAD Encrypt using AES-128-GCM.
         
-        :param key: The AEAD key
-        :param iv: The AEAD IV
+        :param keys: The key set holding the AEAD context and IV
         :param pn: Packet number (for nonce construction)
         :param aad: Additional authenticated data
         :param plaintext: The data to encrypt
         :return: ciphertext including authentication tag
         """
-        nonce = self._build_nonce(iv, pn)
-        encryptor = Cipher(algorithms.AES(key), modes.GCM(nonce), backend=default_backend()).encryptor()
-        encryptor.authenticate_additional_data(aad)
-        ciphertext = encryptor.update(plaintext) + encryptor.finalize()
-        return ciphertext + encryptor.tag
+        return keys.aead.encrypt(self._build_nonce(keys.iv, pn), plaintext, aad)
     
     def _build_nonce(self, iv: bytes, pn: int) -> bytes:
         """
         QUIC constructs the nonce by XORing the packet number with the IV.
         The IV length is 12 bytes, and the PN is encoded in a variable-length manner.
         """
-        pn_bytes = pn.to_bytes(4, "big")
-        # IV length is 12, PN length might be shorter. Right-align PN in the IV.
-        padded_pn = (b"\x00" * (len(iv) - len(pn_bytes))) + pn_bytes
-        return bytes(a ^ b for a, b in zip(iv, padded_pn))
+        if pn >= 1 << 32:
+            raise OverflowError("Packet number must fit in 4 bytes.")
+        # Right-aligning the PN in the IV is the same as XORing the integers.
+        return (int.from_bytes(iv, "big") ^ pn).to_bytes(len(iv), "big")
+    
+    def _header_masks(self, samples: bytes) -> bytes:
+        """Encrypt one or more concatenated 16-byte samples with the client header protection key."""
+        if len(samples) % 16:
+            raise ValueError("The length of the provided data is not a multiple of the block length.")
+        keys = self._client
+        with keys.hp_lock:
+            return keys.hp_ecb.update(samples)
     
     def header_protect(self, sample: bytes, first_byte: bytes, pn_bytes: bytes) -> (bytes, bytes):
         """
@@ -120,15 +255,13 @@ class QUICCrypto:
         The header protection key is used to create a mask by encrypting a sample of ciphertext.
         The first protected byte (one byte from the flags) and the PN bytes are XORed with parts of this mask.
         
-        :param hp_key: the header protection key
         :param sample: 16-byte sample from the ciphertext after the header
         :param first_byte: the first header byte to protect/unprotect
         :param pn_bytes: the packet number bytes to protect/unprotect
         :return: (modified_first_byte, modified_pn_bytes)
         """
         # QUIC header protection uses AES-ECB for generating a mask.
-        cipher = Cipher(algorithms.AES(self.client_hp_key), modes.ECB(), backend=default_backend()).encryptor()
-        mask = cipher.update(sample) + cipher.finalize()
+        mask = self._header_masks(sample)
         
         # Mask the first byte (only the lower 5 bits are protected)
         first_byte_masked = bytes([(first_byte ^ (mask[0] & 0x0f))])
@@ -138,6 +271,27 @@ class QUICCrypto:
         
         return first_byte_masked, masked_pn
     
+    def header_protect_many(self, samples: list, first_bytes: list, pn_bytes_list: list) -> list:
+        """
+        Apply header protection to many packets at once.
+        
+        All masks come from a single AES-ECB pass over the concatenated samples.
+        
+        :param samples: 16-byte samples, one per packet
+        :param first_bytes: the first header byte of each packet
+        :param pn_bytes_list: the packet number bytes of each packet
+        :return: list of (modified_first_byte, modified_pn_bytes), as returned by header_protect
+        """
+        if any(len(sample) != 16 for sample in samples):
+            raise ValueError("header_protect_many needs exactly 16 bytes of sample per packet.")
+        masks = self._header_masks(b"".join(samples))
+        results = []
+        for i, (first_byte, pn_bytes) in enumerate(zip(first_bytes, pn_bytes_list)):
+            mask = masks[16 * i:16 * i + 16]
+            masked_pn = bytes(p ^ m for p, m in zip(pn_bytes, mask[1:1+len(pn_bytes)]))
+            results.append((bytes([first_byte ^ (mask[0] & 0x0f)]), masked_pn))
+        return results
+    
     def encrypt_packet(self, is_client: bool, pn: int, recdata: bytes, payload: bytes):
         """
         :param is_client: True if sender is client, else server
@@ -146,9 +300,98 @@ class QUICCrypto:
         :param payload: The plaintext payload
         :return: encrypted packet (header + ciphertext)
         """
-        key = self.client_key if is_client else self.server_key
-        iv = self.client_iv if is_client else self.server_iv
+        keys = self._client if is_client else self._initial_keys(False)
         
-        ciphertext_with_tag = self._aead_encrypt(key, iv, pn, recdata, payload)
+        ciphertext_with_tag = self._aead_encrypt(keys, pn, recdata, payload)
         
-        return ciphertext_with_tag
\ No newline at end of file
+        return ciphertext_with_tag
+    
+    def encrypt_packets(self, pn_list: list, aad_list: list, payload_list: list, is_client: bool = True) -> list:
+        """
+        Encrypt many packets with the same long-lived AEAD context.
+        
+        :param pn_list: packet number of each packet
+        :param aad_list: the QUIC header bytes (unprotected) of each packet
+        :param payload_list: the plaintext payload of each packet
+        :param is_client: True if sender is client, else server
+        :return: list of ciphertexts including authentication tags
+        """
+        keys = self._client if is_client else self._initial_keys(False)
+        aead = keys.aead
+        iv = int.from_bytes(keys.iv, "big")
+        results = []
+        for pn, aad, payload in zip(pn_list, aad_list, payload_list):
+            if pn >= 1 << 32:
+                raise OverflowError("Packet number must fit in 4 bytes.")
+            results.append(aead.encrypt((iv ^ pn).to_bytes(12, "big"), payload, aad))
+        return results
+    
+    def encrypt_packet_into(self, is_client: bool, pn: int, buf: bytearray, header_offset: int,
+                            payload_offset: int, payload_len: int) -> int:
+        """
+        Encrypt a packet assembled in buf, in place.
+
+        buf[header_offset:payload_offset] is the unprotected header (the AAD) and the plaintext follows it.
+        The ciphertext overwrites the plaintext and the tag is written right after it, so buf needs 16
+        bytes of room past the payload.
+
+        :return: the offset just past the tag
+        """
+        keys = self._client if is_client else self._initial_keys(False)
+        view = memoryview(buf)
+        end = payload_offset + payload_len
+        nonce = self._build_nonce(keys.iv, pn)
+        if _HAVE_ENCRYPT_INTO:
+            # OpenSSL encrypts in place when input and output start at the same address.
+            keys.aead.encrypt_into(nonce, view[payload_offset:end], view[header_offset:payload_offset],
+                                   view[payload_offset:end + 16])
+            return end + 16
+        # Older cryptography releases have no one-shot encrypt_into; stream through a GCM context instead.
+        encryptor = Cipher(algorithms.AES(keys.key), modes.GCM(nonce), backend=default_backend()).encryptor()
+        encryptor.authenticate_additional_data(view[header_offset:payload_offset])
+        encryptor.update_into(view[payload_offset:end], view[payload_offset:end + 16])
+        encryptor.finalize()
+        view[end:end + 16] = encryptor.tag
+        return end + 16
+
+    def header_protect_into(self, buf: bytearray, header_offset: int, pn_offset: int, pn_len: int):
+        """
+        Apply header protection in place to a long header packet encrypted in buf.
+
+        The sample is read 4 bytes after the start of the packet number, as in header_protect().
+        """
+        view = memoryview(buf)
+        sample_offset = pn_offset + 4
+        if sample_offset + 16 > len(buf):
+            raise ValueError("Packet too short for a header protection sample.")
+        keys = self._client
+        with keys.hp_lock:
+            # The mask buffer is per instance, and the lock also keeps two threads sharing one from racing on it.
+            mask = self._mask_buf
+            if mask is None:
+                mask = self._mask_buf = bytearray(32)
+            keys.hp_ecb.update_into(view[sample_offset:sample_offset + 16], mask)
+            buf[header_offset] ^= mask[0] & 0x0f
+            for i in range(pn_len):
+                buf[pn_offset + i] ^= mask[1 + i]
+
+    def header_mask(self, sample: bytes) -> bytes:
+        """
+        Return the 5-byte header protection mask for a 16-byte ciphertext sample.
+        
+        Removing header protection is the same XOR as applying it, but the packet number
+        length is only known once the first byte has been unmasked, so callers apply the mask themselves.
+        """
+        return self._header_masks(sample)[:5]
+    
+    def decrypt_packet(self, is_client: bool, pn: int, recdata: bytes, ciphertext: bytes) -> bytes:
+        """
+        :param is_client: True if sender is client, else server
+        :param pn: packet number (after removing header protection)
+        :param recdata: The QUIC header bytes (unprotected)
+        :param ciphertext: The encrypted payload including the authentication tag
+        :return: plaintext payload
+        :raises cryptography.exceptions.InvalidTag: if the packet does not authenticate
+        """
+        keys = self._client if is_client else self._initial_keys(False)
+        return keys.aead.decrypt(self._build_nonce(keys.iv, pn), ciphertext, recdata)
@@ -0,0 +1,205 @@
+import argparse
+import json
+import random
+import struct
+import sys
+
+from build import encode_header, iter_specs, resolve_spec
+from crypto import QUICCrypto
+from output import MAX_PACKET_SIZE, add_output_arguments, open_writer_from_args
+from varint import varint_length
+
+# Coalesced datagrams. Real clients put several long header packets into one UDP datagram and pad it to at least
+# 1200 bytes (RFC 9000, Sections 12.2 and 14.1). DatagramBuilder assembles such a datagram in one preallocated
+# bytearray: each header is copied from a precompiled prefix, the plaintext is copied after it, encrypted in
+# place and header protection is applied in place, so no per-packet bytes objects are made.
+#
+# Padding strategies for the datagram, after all packets are placed:
+#   frame     PADDING frames at the end of the last packet's plaintext (what browsers do)
+#   packet    an extra Initial carrying only PADDING frames, with the header fields of the last packet
+#   trailing  zero bytes after the last packet, outside any packet
+#   none      no padding
+
+PADDING = ('frame', 'packet', 'trailing', 'none')
+DEFAULT_SIZE = 1200
+AEAD_TAG_LENGTH = 16
+
+_ZEROS = memoryview(bytes(MAX_PACKET_SIZE))
+_VARINT_PREFIX = {1: 0x00, 2: 0x40, 4: 0x80, 8: 0xc0}
+_LENGTH_FORMATS = {1: struct.Struct('!B'), 2: struct.Struct('!H'), 4: struct.Struct('!I'), 8: struct.Struct('!Q')}
+
+class PacketSpec:
+    """
+    A build.py packet spec resolved once for repeated in-place assembly: the header up to the Length field,
+    the packet number and the plaintext payload.
+
+    Random DCIDs, SCIDs and tokens are drawn once here (from rng if given). Fields that build.py uses to
+    craft invalid packets (length, additional_data, sample, -a, -s) are not supported.
+    """
+
+    def __init__(self, spec: dict, rng=None):
+        # Drawn as build_packet() does, so a seeded rng gives the same fields in both.
+        spec = resolve_spec(spec, rng)
+        for field in ('length', 'additional_data', 'sample'):
+            if spec[field] is not None:
+                raise ValueError(f"Coalesced packets compute {field} themselves.")
+        if spec['a'] or spec['s']:
+            raise ValueError("Coalesced packets are always built in full.")
+
+        self.prefix, self.pn_bytes, version, dcid = encode_header(spec)
+        self.packet_number = int.from_bytes(self.pn_bytes, 'big')
+        self.payload = bytes.fromhex(spec['payload'] or '')
+        self.spec = spec
+        self.crypto = QUICCrypto(dcid, version)
+        self._padding_packet = None
+
+    def min_payload(self):
+        """Plaintext length below which the packet is too short for a header protection sample."""
+        return max(4 - len(self.pn_bytes), 0)
+
+    def size(self, payload_len):
+        """Size on the wire with a plaintext of payload_len bytes."""
+        length = len(self.pn_bytes) + payload_len + AEAD_TAG_LENGTH
+        return len(self.prefix) + varint_length(length) + length
+
+    def fit(self, room, min_pad=0):
+        """
+        The (pad, Length width) that make this packet exactly room bytes, or None if it does not fit.
+
+        The smallest Length width that holds the value is used; a value just below a width boundary is then
+        encoded non-minimally, which receivers must accept.
+        """
+        base = len(self.pn_bytes) + len(self.payload) + min_pad + AEAD_TAG_LENGTH
+        for width in (1, 2, 4, 8):
+            length = room - len(self.prefix) - width
+            if length < base:
+                return None
+            if length < 1 << (8 * width - 2):
+                return length - base + min_pad, width
+        return None
+
+    def padding_packet(self):
+        """An Initial holding only PADDING, with this packet's header fields and the next packet number."""
+        if self._padding_packet is None:
+            pn_len = len(self.pn_bytes)
+            pn = (self.packet_number + 1) % (1 << (8 * pn_len))
+            self._padding_packet = PacketSpec({**self.spec, 'payload': '', 'packet_number': pn.to_bytes(pn_len, 'big').hex()})
+        return self._padding_packet
+
+class DatagramBuilder:
+    """
+    Assembles coalesced datagrams in one reusable buffer.
+
+    :param max_size: the largest datagram to build
+    """
+
+    def __init__(self, max_size: int = MAX_PACKET_SIZE):
+        # Room for the largest datagram, plus a spare tag's worth for in-place encryption.
+        self._buf = bytearray(max_size + AEAD_TAG_LENGTH)
+        self._view = memoryview(self._buf)
+        self.max_size = max_size
+
+    def _place(self, packet: PacketSpec, offset: int, pad: int = 0, length_width=None) -> int:
+        """Write packet at offset with pad bytes of PADDING after its payload, encrypt and protect it in place."""
+        buf = self._buf
+        view = self._view
+        payload_len = len(packet.payload) + pad
+        length = len(packet.pn_bytes) + payload_len + AEAD_TAG_LENGTH
+        width = length_width or varint_length(length)
+        if offset + len(packet.prefix) + width + length > self.max_size:
+            raise ValueError(f"Coalesced packets do not fit in {self.max_size} bytes.")
+
+        length_offset = offset + len(packet.prefix)
+        view[offset:length_offset] = packet.prefix
+        _LENGTH_FORMATS[width].pack_into(buf, length_offset, length | (_VARINT_PREFIX[width] << (8 * width - 8)))
+        pn_offset = length_offset + width
+        payload_offset = pn_offset + len(packet.pn_bytes)
+        view[pn_offset:payload_offset] = packet.pn_bytes
+        payload_end = payload_offset + len(packet.payload)
+        view[payload_offset:payload_end] = packet.payload
+        view[payload_end:payload_end + pad] = _ZEROS[:pad]
+
+        crypto = packet.crypto
+        end = crypto.encrypt_packet_into(True, packet.packet_number, buf, offset, payload_offset, payload_len)
+        crypto.header_protect_into(buf, offset, pn_offset, len(packet.pn_bytes))
+        return end
+
+    def build(self, packets, size: int = DEFAULT_SIZE, padding: str = 'frame') -> memoryview:
+        """
+        Coalesce packets into one datagram padded to size bytes.
+
+        :param packets: PacketSpec objects (or build.py spec dicts) in datagram order
+        :param size: the datagram size to pad to; a datagram that is already larger is left as it is
+        :param padding: one of PADDING
+        :return: a view of the datagram, valid until the next call to build()
+        """
+        if padding not in PADDING:
+            raise ValueError(f"Unknown padding strategy {padding!r}; choose from {', '.join(PADDING)}.")
+        if size > self.max_size:
+            raise ValueError(f"Datagram size {size} is larger than the builder's {self.max_size} bytes.")
+        packets = [p if isinstance(p, PacketSpec) else PacketSpec(p) for p in packets]
+        if not packets:
+            raise ValueError("A datagram needs at least one packet.")
+
+        # Every packet carries at least enough plaintext for a header protection sample.
+        pads = [max(p.min_payload() - len(p.payload), 0) for p in packets]
+        last = packets[-1]
+        length_width = None
+        if padding == 'frame':
+            others = sum(p.size(len(p.payload) + pad) for p, pad in zip(packets[:-1], pads))
+            fit = last.fit(size - others, pads[-1])
+            if fit is not None:
+                pads[-1], length_width = fit
+
+        offset = 0
+        for i, (packet, pad) in enumerate(zip(packets, pads)):
+            offset = self._place(packet, offset, pad, length_width if i == len(packets) - 1 else None)
+
+        if offset < size and padding == 'packet':
+            filler = last.padding_packet()
+            fit = filler.fit(size - offset, filler.min_payload())
+            if fit is not None:
+                offset = self._place(filler, offset, *fit)
+        if offset < size and padding in ('packet', 'trailing'):
+            # Also covers a gap too small for a padding packet.
+            self._view[offset:size] = _ZEROS[:size - offset]
+            offset = size
+        return self._view[:offset]
+
+def iter_datagrams(lines, size=DEFAULT_SIZE, padding='frame'):
+    """
+    Yield (packet specs, size, padding) from JSONL lines. Each line is a list of build.py packet specs, or an
+    object {"packets": [...], "size": 1200, "padding": "frame"} overriding the defaults.
+    """
+    for datagram in iter_specs(lines):
+        if isinstance(datagram, list):
+            yield datagram, size, padding
+        else:
+            yield datagram['packets'], datagram.get('size', size), datagram.get('padding', padding)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build coalesced, padded QUIC datagrams.')
+    parser.add_argument('datagrams', help='JSONL file (- for stdin), one datagram per line: a list of build.py packet specs, or {"packets": [...], "size": 1200, "padding": "frame"}.')
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE, help=f'Pad datagrams to this many bytes (default: {DEFAULT_SIZE}).')
+    parser.add_argument('--padding', choices=PADDING, default='frame', help='Padding strategy (default: frame).')
+    parser.add_argument('--repeat', type=int, default=1, help='Build each datagram this many times (default: 1). Random fields are drawn once per line.')
+    parser.add_argument('--seed', default=None, help='Derive random DCIDs, SCIDs and tokens from this seed (default: random).')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    rng = None if args.seed is None else random.Random(args.seed)
+    builder = DatagramBuilder()
+    datagrams_in = sys.stdin if args.datagrams == '-' else open(args.datagrams, 'r')
+    try:
+        with open_writer_from_args(args) as writer:
+            for specs, size, padding in iter_datagrams(datagrams_in, args.size, args.padding):
+                packets = [PacketSpec(spec, rng) for spec in specs]
+                for _ in range(args.repeat):
+                    writer.write(builder.build(packets, size, padding))
+    finally:
+        if datagrams_in is not sys.stdin:
+            datagrams_in.close()
+    print(f"Built {writer.count} datagrams.", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+import argparse
+import sys
+from collections import namedtuple
+
+from cryptography.exceptions import InvalidTag
+
+from crypto import QUICCrypto, initial_version
+from output import read_packets
+from varint import decode_batch, decode_varint
+
+# The inverse of build.py: take a client Initial as it appears on the wire, remove header protection,
+# decrypt it with the keys derived from its DCID and parse the ClientHello carried in its CRYPTO frames.
+#
+# Everything is parsed from memoryview slices of the datagram (and of the decrypted payload), so the only
+# copies made per packet are the small unprotected header used as AAD and the plaintext returned by the AEAD.
+
+# Fields of a long header Initial. dcid, scid and token are memoryview slices of the datagram.
+InitialHeader = namedtuple('InitialHeader', [
+    'first_byte', 'version', 'dcid', 'scid', 'token', 'length', 'pn_offset',
+])
+
+# A decrypted Initial: the unprotected header, its packet number and the plaintext frames.
+InitialPacket = namedtuple('InitialPacket', ['header', 'packet_number', 'payload'])
+
+# The parts of a ClientHello we analyse. transport_params maps parameter id -> memoryview of its value.
+ClientHello = namedtuple('ClientHello', ['sni', 'alpn', 'transport_params', 'extensions'])
+
+EXT_SERVER_NAME = 0x0000
+EXT_ALPN = 0x0010
+EXT_QUIC_TRANSPORT_PARAMETERS = 0x0039
+EXT_QUIC_TRANSPORT_PARAMETERS_DRAFT = 0xffa5
+
+def parse_initial_header(view):
+    """Parse the still-protected long header of a client Initial."""
+    if len(view) < 7:
+        raise ValueError("Datagram too short for a long header.")
+    first_byte = view[0]
+    if not first_byte & 0x80:
+        raise ValueError("Not a long header packet.")
+    version = int.from_bytes(view[1:5], 'big')
+    if (first_byte >> 4) & 0x03 != initial_version(version).initial_type:
+        raise ValueError("Not an Initial packet.")
+
+    offset = 5
+    dcid_len = view[offset]
+    dcid = view[offset + 1:offset + 1 + dcid_len]
+    offset += 1 + dcid_len
+    if offset >= len(view):
+        raise ValueError("Truncated long header.")
+    scid_len = view[offset]
+    scid = view[offset + 1:offset + 1 + scid_len]
+    offset += 1 + scid_len
+
+    token_len, offset = decode_varint(view, offset)
+    token = view[offset:offset + token_len]
+    offset += token_len
+    length, offset = decode_varint(view, offset)
+    if offset + length > len(view):
+        raise ValueError("Length field exceeds the datagram.")
+    return InitialHeader(first_byte, version, dcid, scid, token, length, offset)
+
+def parse_initial_headers(buf, starts):
+    """
+    Batch version of parse_initial_header() over many packets stored in one buffer (e.g. a frames file read
+    whole). Every field is pulled out of all packets at once with NumPy array operations.
+
+    :param buf: bytes-like holding the packets
+    :param starts: array-like with the offset of each packet in buf
+    :return: dict of int64 arrays: first_byte, version, dcid_len, dcid_offset, scid_len, scid_offset,
+        token_len, token_offset, length, pn_offset (offsets are into buf)
+    :raises ValueError: if a header runs past the end of buf
+    """
+    import numpy as np
+    data = np.frombuffer(buf, dtype=np.uint8)
+    starts = np.asarray(starts, dtype=np.int64)
+    if starts.size and int(starts.max()) + 7 > len(data):
+        raise ValueError("Datagram too short for a long header.")
+    version = np.zeros(starts.shape, dtype=np.int64)
+    for i in range(1, 5):
+        version = (version << 8) | data[starts + i]
+    dcid_len = data[starts + 5].astype(np.int64)
+    scid_len_off = starts + 6 + dcid_len
+    if starts.size and int(scid_len_off.max()) >= len(data):
+        raise ValueError("Truncated long header.")
+    scid_len = data[scid_len_off].astype(np.int64)
+    token_len_off = scid_len_off + 1 + scid_len
+    token_len, token_len_size = decode_batch(data, token_len_off)
+    token_len = token_len.astype(np.int64)
+    length_off = token_len_off + token_len_size + token_len
+    length, length_size = decode_batch(data, length_off)
+    return {
+        'first_byte': data[starts].astype(np.int64),
+        'version': version,
+        'dcid_len': dcid_len,
+        'dcid_offset': starts + 6,
+        'scid_len': scid_len,
+        'scid_offset': scid_len_off + 1,
+        'token_len': token_len,
+        'token_offset': token_len_off + token_len_size,
+        'length': length.astype(np.int64),
+        'pn_offset': length_off + length_size,
+    }
+
+def decrypt_initial(datagram):
+    """
+    Remove header protection from a client Initial and decrypt its payload.
+
+    :param datagram: the UDP payload (bytes, bytearray or memoryview)
+    :return: InitialPacket
+    :raises ValueError: if the packet is malformed or does not authenticate
+    """
+    view = memoryview(datagram)
+    header = parse_initial_header(view)
+    crypto = QUICCrypto(header.dcid, header.version)
+
+    # The sample is taken as if the packet number were 4 bytes long.
+    sample_offset = header.pn_offset + 4
+    if sample_offset + 16 > len(view):
+        raise ValueError("Packet too short for a header protection sample.")
+    mask = crypto.header_mask(view[sample_offset:sample_offset + 16])
+
+    first_byte = header.first_byte ^ (mask[0] & 0x0f)
+    pn_len = (first_byte & 0x03) + 1
+    pn_end = header.pn_offset + pn_len
+    aad = bytearray(view[:pn_end])
+    aad[0] = first_byte
+    packet_number = 0
+    for i in range(pn_len):
+        aad[header.pn_offset + i] ^= mask[1 + i]
+        packet_number = (packet_number << 8) | aad[header.pn_offset + i]
+
+    ciphertext = view[pn_end:header.pn_offset + header.length]
+    try:
+        payload = crypto.decrypt_packet(True, packet_number, aad, ciphertext)
+    except InvalidTag:
+        raise ValueError("Initial packet failed to authenticate.") from None
+    return InitialPacket(header._replace(first_byte=first_byte), packet_number, payload)
+
+def crypto_stream(payload):
+    """
+    Walk the frames of a decrypted Initial and return the CRYPTO stream starting at offset 0.
+
+    A single CRYPTO frame is returned as a memoryview slice of the payload; only out-of-order or
+    split ClientHellos are copied into a reassembly buffer.
+    """
+    view = memoryview(payload)
+    chunks = []
+    offset = 0
+    while offset < len(view):
+        frame_type = view[offset]
+        if frame_type == 0x00 or frame_type == 0x01:  # PADDING, PING
+            offset += 1
+        elif frame_type == 0x02 or frame_type == 0x03:  # ACK
+            offset += 1
+            _, offset = decode_varint(view, offset)  # largest acknowledged
+            _, offset = decode_varint(view, offset)  # ack delay
+            range_count, offset = decode_varint(view, offset)
+            _, offset = decode_varint(view, offset)  # first ack range
+            for _ in range(2 * range_count):
+                _, offset = decode_varint(view, offset)
+            if frame_type == 0x03:
+                for _ in range(3):  # ECN counts
+                    _, offset = decode_varint(view, offset)
+        elif frame_type == 0x06:  # CRYPTO
+            data_offset, offset = decode_varint(view, offset + 1)
+            data_len, offset = decode_varint(view, offset)
+            if offset + data_len > len(view):
+                raise ValueError("CRYPTO frame exceeds the packet.")
+            chunks.append((data_offset, view[offset:offset + data_len]))
+            offset += data_len
+        elif frame_type == 0x1c:  # CONNECTION_CLOSE
+            break
+        else:
+            raise ValueError(f"Unexpected frame type 0x{frame_type:02x} in Initial packet.")
+
+    if len(chunks) == 1 and chunks[0][0] == 0:
+        return chunks[0][1]
+
+    stream = bytearray()
+    for data_offset, data in sorted(chunks, key=lambda c: c[0]):
+        if data_offset > len(stream):
+            break  # gap: the rest of the ClientHello is in another packet
+        stream[data_offset:data_offset + len(data)] = data
+    return memoryview(stream)
+
+def parse_client_hello(buf):
+    """
+    Parse a TLS ClientHello handshake message.
+
+    :param buf: the CRYPTO stream, starting with the handshake header
+    :return: ClientHello. extensions maps extension type -> memoryview of its body.
+    """
+    view = memoryview(buf)
+    if len(view) < 4 or view[0] != 0x01:
+        raise ValueError("Not a ClientHello.")
+    end = min(len(view), 4 + int.from_bytes(view[1:4], 'big'))
+
+    # legacy_version (2) + random (32)
+    offset = 4 + 2 + 32
+    if offset >= end:
+        raise ValueError("Truncated ClientHello.")
+    offset += 1 + view[offset]  # legacy_session_id
+    offset += 2 + int.from_bytes(view[offset:offset + 2], 'big')  # cipher_suites
+    if offset >= end:
+        raise ValueError("Truncated ClientHello.")
+    offset += 1 + view[offset]  # legacy_compression_methods
+    ext_end = min(end, offset + 2 + int.from_bytes(view[offset:offset + 2], 'big'))
+    offset += 2
+
+    extensions = {}
+    while offset + 4 <= ext_end:
+        ext_type = int.from_bytes(view[offset:offset + 2], 'big')
+        ext_len = int.from_bytes(view[offset + 2:offset + 4], 'big')
+        offset += 4
+        extensions[ext_type] = view[offset:offset + ext_len]
+        offset += ext_len
+
+    sni = None
+    if EXT_SERVER_NAME in extensions:
+        ext = extensions[EXT_SERVER_NAME]
+        # server_name_list length (2), name_type (1), host_name length (2)
+        if len(ext) >= 5 and ext[2] == 0:
+            name_len = int.from_bytes(ext[3:5], 'big')
+            sni = bytes(ext[5:5 + name_len]).decode('ascii', errors='replace')
+
+    alpn = []
+    if EXT_ALPN in extensions:
+        ext = extensions[EXT_ALPN]
+        offset = 2
+        while offset < len(ext):
+            proto_len = ext[offset]
+            alpn.append(bytes(ext[offset + 1:offset + 1 + proto_len]).decode('ascii', errors='replace'))
+            offset += 1 + proto_len
+
+    transport_params = {}
+    tp = extensions.get(EXT_QUIC_TRANSPORT_PARAMETERS, extensions.get(EXT_QUIC_TRANSPORT_PARAMETERS_DRAFT))
+    if tp is not None:
+        offset = 0
+        while offset < len(tp):
+            param_id, offset = decode_varint(tp, offset)
+            param_len, offset = decode_varint(tp, offset)
+            transport_params[param_id] = tp[offset:offset + param_len]
+            offset += param_len
+
+    return ClientHello(sni, alpn, transport_params, extensions)
+
+def extract_sni(datagram):
+    """Return the SNI of a client Initial, or None if it has no server_name extension."""
+    packet = decrypt_initial(datagram)
+    return parse_client_hello(crypto_stream(packet.payload)).sni
+
+def main():
+    parser = argparse.ArgumentParser(description='Decrypt QUIC client Initial packets and print their SNI and ALPN.')
+    parser.add_argument('files', nargs='*', default=['-'], help='Files holding one raw packet each (e.g. payloads/*.bin). With no file, or -, read hex packets from stdin, one per line.')
+    parser.add_argument('--batch', action='store_true', help='Files are length-prefixed packet streams written by build.py --batch.')
+    parser.add_argument('-v', action='store_true', help='Also print the transport parameters.')
+    args = parser.parse_args()
+
+    def packets():
+        for path in args.files:
+            if path == '-':
+                for line in sys.stdin:
+                    if line.strip():
+                        yield '-', bytes.fromhex(line.strip())
+            elif args.batch:
+                with open(path, 'rb') as f:
+                    for packet in read_packets(f):
+                        yield path, packet
+            else:
+                with open(path, 'rb') as f:
+                    yield path, f.read()
+
+    for name, packet in packets():
+        try:
+            initial = decrypt_initial(packet)
+            hello = parse_client_hello(crypto_stream(initial.payload))
+        except ValueError as e:
+            print(f"{name},error,{e}")
+            continue
+        print(f"{name},{hello.sni},{'/'.join(hello.alpn)}")
+        if args.v:
+            for param_id, value in sorted(hello.transport_params.items()):
+                print(f"  0x{param_id:x}: {value.hex()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import itertools
+import json
+import sys
+
+from build import SPEC_DEFAULTS, build_packet
+from output import add_output_arguments, open_writer_from_args
+
+# Trigger-condition sweeps. Starting from a base packet spec, each axis below varies one property of the packet,
+# the way the what-triggers-blocking payloads were made by hand (exp3 truncates exp1, exp4 changes its version,
+# exp9 uses a 255-byte DCID, ...). Variants are generated lazily and streamed into a corpus file, so a sweep of
+# tens of thousands of packets never holds more than one of them in memory.
+#
+# Axes applied to the spec before building:
+#   dcid_len, scid_len, token_len   connection ID / token lengths. The base value is repeated (or zeros are
+#                                   used) to fill the new length, so variants stay reproducible.
+#   reserved_bits                   the two reserved bits of the first byte, e.g. "01"
+#   length                          an explicit value for the Length field (a lie unless it matches)
+#   length_delta                    added to the correct Length value
+#   additional_data, sample         AAD / header protection sample overrides, as for build.py
+# Axes applied to the built packet:
+#   version                         rewrites the version field on the wire, keeping the version 1 encryption
+#                                   (this is how exp4 was made)
+#   truncate                        drops this many bytes from the end of the packet (exp3)
+
+SPEC_AXES = ('dcid_len', 'scid_len', 'token_len', 'reserved_bits', 'length', 'length_delta', 'additional_data', 'sample')
+PACKET_AXES = ('version', 'truncate')
+AXES = SPEC_AXES + PACKET_AXES
+
+def _resize(hex_value, length):
+    """Repeat the bytes of hex_value (or zeros if there are none) to exactly length bytes, as hex."""
+    base = bytes.fromhex(hex_value) if hex_value else b''
+    if not base:
+        return bytes(length).hex()
+    return (base * (length // len(base) + 1))[:length].hex()
+
+def _correct_length(spec):
+    """The Length field build.py computes for spec: packet number + payload + AEAD tag."""
+    pn_len = int(spec['pkt_num_len_bits'], 2) + 1
+    if spec['packet_number'] is not None:
+        pn_len = len(bytes.fromhex(spec['packet_number']))
+    return pn_len + len(bytes.fromhex(spec['payload'] or '')) + 16
+
+def apply_mutation(base, mutation):
+    """
+    Build the packet for one mutation of base.
+
+    :param base: packet spec (see build.build_packet)
+    :param mutation: dict mapping axis name -> value
+    :return: the mutated packet (bytes)
+    """
+    unknown = set(mutation) - set(AXES)
+    if unknown:
+        raise ValueError(f"Unknown mutation axes: {', '.join(sorted(unknown))}")
+    spec = {**SPEC_DEFAULTS, **base}
+    for field, id_field in (('dcid_len', 'dcid'), ('scid_len', 'scid'), ('token_len', 'token')):
+        if field in mutation:
+            spec[field] = mutation[field]
+            spec[id_field] = _resize(spec[id_field], mutation[field])
+    for field in ('reserved_bits', 'length', 'additional_data', 'sample'):
+        if field in mutation:
+            spec[field] = mutation[field]
+    if 'length_delta' in mutation:
+        spec['length'] = _correct_length(spec) + mutation['length_delta']
+
+    packet = build_packet(spec)
+    if 'version' in mutation or 'truncate' in mutation:
+        packet = bytearray(packet)
+        if 'version' in mutation:
+            packet[1:5] = int(mutation['version'], 16).to_bytes(4, 'big')
+        if mutation.get('truncate'):
+            del packet[-mutation['truncate']:]
+        packet = bytes(packet)
+    return packet
+
+def _axis_values(values):
+    """Axis values are a list, or {"range": [start, stop(, step)]} for integer axes."""
+    if isinstance(values, dict):
+        return range(*values['range'])
+    return values
+
+def mutations(axes, combine=False):
+    """
+    Lazily enumerate mutations.
+
+    :param axes: dict mapping axis name -> list of values (or a {"range": [...]} object)
+    :param combine: if False, vary one axis at a time; if True, yield the cartesian product of all axes
+    :return: generator of dicts mapping axis name -> value
+    """
+    unknown = set(axes) - set(AXES)
+    if unknown:
+        raise ValueError(f"Unknown mutation axes: {', '.join(sorted(unknown))}")
+    names = list(axes)
+    if combine:
+        for values in itertools.product(*(_axis_values(axes[name]) for name in names)):
+            yield dict(zip(names, values))
+    else:
+        for name in names:
+            for value in _axis_values(axes[name]):
+                yield {name: value}
+
+def run_sweep(base, axes, writer, manifest, combine=False):
+    """
+    Stream every mutation of base into writer (see output.py) and describe each one in manifest (JSONL).
+
+    Variants that cannot be built (e.g. a Length too large for a varint) are recorded in the manifest with
+    their error and skipped in the corpus. Returns (packets written, variants skipped).
+    """
+    index = written = skipped = 0
+    for mutation in mutations(axes, combine):
+        record = {'index': index, 'mutation': mutation}
+        try:
+            packet = apply_mutation(base, mutation)
+        except (ValueError, OverflowError) as e:
+            record['error'] = str(e)
+            skipped += 1
+        else:
+            offset = writer.write(packet)
+            if offset is not None:
+                record['offset'] = offset
+            record['length'] = len(packet)
+            written += 1
+        manifest.write(json.dumps(record) + '\n')
+        index += 1
+    return written, skipped
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream structured variants of a base QUIC packet into a corpus file.')
+    parser.add_argument('sweep', help='JSON file: {"base": {packet spec}, "axes": {axis: [values] or {"range": [start, stop, step]}}, "combine": false}')
+    add_output_arguments(parser)
+    parser.add_argument('-m', '--manifest', default=None, help='Manifest file, one JSON line per variant (default: <output>.manifest.jsonl).')
+    args = parser.parse_args()
+
+    with open(args.sweep, 'r') as f:
+        sweep = json.load(f)
+    if args.output is None:
+        parser.error("the corpus needs an output file (-o)")
+    manifest_path = args.manifest or args.output + '.manifest.jsonl'
+    with open_writer_from_args(args) as writer, open(manifest_path, 'w') as manifest:
+        written, skipped = run_sweep(sweep['base'], sweep['axes'], writer, manifest, sweep.get('combine', False))
+    print(f"Wrote {written} packets to {args.output} ({skipped} variants skipped, see {manifest_path}).", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
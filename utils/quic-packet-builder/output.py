@@ -0,0 +1,285 @@
+import array
+import ipaddress
+import mmap
+import struct
+import sys
+import time
+
+# Output formats shared by build.py --batch, template.py and mutate.py. Every writer assembles each record in one
+# preallocated buffer and hands it to a single buffered file object, instead of printing hex per packet.
+#
+#   frames   each packet preceded by its length as a 2-byte big-endian integer (the default)
+#   pcap     a classic pcap file; each packet wrapped in synthetic Ethernet/IPv4/UDP headers with valid checksums
+#   probes   a probe set: all packets back to back, followed by an offset index, for senders to mmap
+#   hex      one hex packet per line, e.g. for zmap --probe-args=hex:...
+
+FORMATS = ('frames', 'pcap', 'probes', 'hex')
+WRITE_BUFFER_SIZE = 1 << 20
+MAX_PACKET_SIZE = 0xffff
+
+def write_packet(out, packet):
+    """Write one packet to a binary stream, prefixed with its 2-byte big-endian length."""
+    if len(packet) > MAX_PACKET_SIZE:
+        raise ValueError(f"Packet of {len(packet)} bytes does not fit in a UDP datagram.")
+    out.write(struct.pack('!H', len(packet)))
+    out.write(packet)
+
+def read_packets(f):
+    """Yield the packets of a length-prefixed binary stream written by write_packet()."""
+    while True:
+        prefix = f.read(2)
+        if len(prefix) < 2:
+            return
+        (length,) = struct.unpack('!H', prefix)
+        yield f.read(length)
+
+def _fold(total):
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return total
+
+def internet_checksum(data, initial=0):
+    """RFC 1071 ones' complement checksum of data (bytes-like), starting from a partial sum of network-order words."""
+    data = memoryview(data)
+    words = array.array('H')
+    words.frombytes(data[:len(data) & ~1])
+    # Summing native-order words and swapping the folded result is the same as summing network-order words.
+    total = _fold(sum(words))
+    if sys.byteorder == 'little':
+        total = ((total & 0xff) << 8) | (total >> 8)
+    if len(data) & 1:
+        total += data[-1] << 8
+    return ~_fold(total + initial) & 0xffff
+
+class _FileOutput:
+    """Owns the output file: a buffered file for a path, or stdout's binary buffer for None."""
+
+    def __init__(self, path):
+        if path is None:
+            self.file = sys.stdout.buffer
+        else:
+            self.file = open(path, 'wb', buffering=WRITE_BUFFER_SIZE)
+        self.path = path
+        self.position = 0
+        self.count = 0
+
+    def _write(self, data):
+        self.file.write(data)
+        self.position += len(data)
+
+    def close(self):
+        if self.file is sys.stdout.buffer:
+            self.file.flush()
+        else:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FramesWriter(_FileOutput):
+    """Length-prefixed packets, the format read by read_packets()."""
+
+    def __init__(self, path=None):
+        super().__init__(path)
+        self._buf = bytearray(2 + MAX_PACKET_SIZE)
+        self._view = memoryview(self._buf)
+
+    def write(self, packet):
+        """Write one packet and return the file offset of its first byte."""
+        n = len(packet)
+        if n > MAX_PACKET_SIZE:
+            raise ValueError(f"Packet of {n} bytes does not fit in a UDP datagram.")
+        struct.pack_into('!H', self._buf, 0, n)
+        self._buf[2:2 + n] = packet
+        offset = self.position + 2
+        self._write(self._view[:2 + n])
+        self.count += 1
+        return offset
+
+class HexWriter(_FileOutput):
+    """One hex packet per line."""
+
+    def write(self, packet):
+        """Write one packet; returns None, as hex lines have no useful byte offset."""
+        self._write(packet.hex().encode('ascii') + b'\n')
+        self.count += 1
+        return None
+
+class PcapWriter(_FileOutput):
+    """
+    A classic (microsecond) pcap file with one Ethernet/IPv4/UDP frame per packet.
+
+    :param src_ip, dst_ip: IPv4 addresses for the synthetic IP header
+    :param sport, dport: UDP ports. sport is increased by sport_step after every packet (wrapping within 1024-65535),
+        so each packet can be given a fresh 4-tuple, as the experiments do.
+    :param start_time: timestamp of the first packet (default: now)
+    :param interval: seconds between consecutive packets
+    :param ttl: IP TTL
+    """
+    _PCAP_HEADER = struct.Struct('<IHHiIII')
+    _RECORD_HEADER = struct.Struct('<IIII')
+    _ETH_LEN = 14
+    _IP_LEN = 20
+    _UDP_LEN = 8
+    _HEADERS_LEN = 16 + 14 + 20 + 8
+
+    def __init__(self, path=None, src_ip='10.0.0.1', dst_ip='10.0.0.2', sport=50000, dport=443, sport_step=0,
+                 start_time=None, interval=0.001, ttl=64,
+                 src_mac='02:00:00:00:00:01', dst_mac='02:00:00:00:00:02'):
+        super().__init__(path)
+        self.src_ip = ipaddress.IPv4Address(src_ip).packed
+        self.dst_ip = ipaddress.IPv4Address(dst_ip).packed
+        self.sport = sport
+        self.dport = dport
+        self.sport_step = sport_step
+        # Timestamps are kept in whole microseconds so long runs do not drift.
+        self._time_us = int(round((time.time() if start_time is None else start_time) * 1e6))
+        self._interval_us = int(round(interval * 1e6))
+        self._ip_id = 0
+
+        self._buf = bytearray(self._HEADERS_LEN + MAX_PACKET_SIZE)
+        self._view = memoryview(self._buf)
+        eth = 16
+        self._buf[eth:eth + 6] = bytes.fromhex(dst_mac.replace(':', ''))
+        self._buf[eth + 6:eth + 12] = bytes.fromhex(src_mac.replace(':', ''))
+        self._buf[eth + 12:eth + 14] = b'\x08\x00'
+        ip = eth + self._ETH_LEN
+        # version/IHL, DSCP, total length, id, flags/fragment (DF), TTL, protocol UDP, checksum, addresses
+        struct.pack_into('!BBHHHBBH4s4s', self._buf, ip, 0x45, 0, 0, 0, 0x4000, ttl, 17, 0, self.src_ip, self.dst_ip)
+        # Partial checksum of the UDP pseudo-header addresses and protocol, which never change.
+        self._pseudo_sum = sum(struct.unpack('!HHHH', self.src_ip + self.dst_ip)) + 17
+
+        self._write(self._PCAP_HEADER.pack(0xa1b2c3d4, 2, 4, 0, 0, MAX_PACKET_SIZE + 42, 1))
+
+    def write(self, packet):
+        """Write one packet and return the file offset of its UDP payload."""
+        n = len(packet)
+        if n > MAX_PACKET_SIZE - self._IP_LEN - self._UDP_LEN:
+            raise ValueError(f"Packet of {n} bytes does not fit in an IPv4 UDP datagram.")
+        buf = self._buf
+        frame_len = self._ETH_LEN + self._IP_LEN + self._UDP_LEN + n
+        seconds, micros = divmod(self._time_us, 1000000)
+        self._RECORD_HEADER.pack_into(buf, 0, seconds, micros, frame_len, frame_len)
+
+        ip = 16 + self._ETH_LEN
+        struct.pack_into('!HH', buf, ip + 2, self._IP_LEN + self._UDP_LEN + n, self._ip_id)
+        struct.pack_into('!H', buf, ip + 10, 0)
+        struct.pack_into('!H', buf, ip + 10, internet_checksum(self._view[ip:ip + self._IP_LEN]))
+
+        udp = ip + self._IP_LEN
+        udp_len = self._UDP_LEN + n
+        struct.pack_into('!HHHH', buf, udp, self.sport, self.dport, udp_len, 0)
+        buf[udp + self._UDP_LEN:udp + udp_len] = packet
+        checksum = internet_checksum(self._view[udp:udp + udp_len], self._pseudo_sum + udp_len)
+        struct.pack_into('!H', buf, udp + 6, checksum or 0xffff)
+
+        offset = self.position + udp + self._UDP_LEN
+        self._write(self._view[:16 + frame_len])
+        self.count += 1
+        self._time_us += self._interval_us
+        self._ip_id = (self._ip_id + 1) & 0xffff
+        if self.sport_step:
+            self.sport = 1024 + (self.sport - 1024 + self.sport_step) % (65536 - 1024)
+        return offset
+
+# Probe set layout (all integers little-endian, so the index can be used as a u64 array in place):
+#   header   b'QPRB', u16 format version (1), u16 reserved
+#   data     the packets back to back
+#   index    count + 1 u64 file offsets; packet i spans index[i]:index[i + 1]
+#   footer   u64 offset of the index, u32 count, b'QPRB'
+PROBES_MAGIC = b'QPRB'
+PROBES_VERSION = 1
+_PROBES_HEADER = struct.Struct('<4sHH')
+_PROBES_FOOTER = struct.Struct('<QI4s')
+
+class ProbesWriter(_FileOutput):
+    """A probe set file, see the layout above. The offset index is kept in memory and written on close."""
+
+    def __init__(self, path):
+        if path is None:
+            raise ValueError("The probes format needs an output file.")
+        super().__init__(path)
+        self._offsets = array.array('Q')
+        self._write(_PROBES_HEADER.pack(PROBES_MAGIC, PROBES_VERSION, 0))
+
+    def write(self, packet):
+        """Write one packet and return the file offset of its first byte."""
+        offset = self.position
+        self._offsets.append(offset)
+        self._write(packet)
+        self.count += 1
+        return offset
+
+    def close(self):
+        index_offset = self.position
+        self._offsets.append(index_offset)
+        if sys.byteorder != 'little':
+            self._offsets.byteswap()
+        self._write(self._offsets.tobytes())
+        self._write(_PROBES_FOOTER.pack(index_offset, self.count, PROBES_MAGIC))
+        super().close()
+
+class ProbeSet:
+    """A memory-mapped probe set file. len() is the packet count and probe_set[i] a memoryview of packet i."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, version, _ = _PROBES_HEADER.unpack_from(view, 0)
+        index_offset, count, footer_magic = _PROBES_FOOTER.unpack_from(view, len(view) - _PROBES_FOOTER.size)
+        if magic != PROBES_MAGIC or footer_magic != PROBES_MAGIC or version != PROBES_VERSION:
+            raise ValueError(f"{path} is not a version {PROBES_VERSION} probe set.")
+        self._view = view
+        self._index = view[index_offset:index_offset + 8 * (count + 1)].cast('Q')
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._view[self._index[i]:self._index[i + 1]]
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def close(self):
+        self._index.release()
+        self._view.release()
+        self._mmap.close()
+
+def add_output_arguments(parser):
+    """Add the -o/--output, --format and pcap header options shared by the batch tools."""
+    parser.add_argument('-o', '--output', default=None, help='Write the packets to this file instead of stdout.')
+    parser.add_argument('--format', choices=FORMATS, default='frames', help='Output format: length-prefixed frames (default), pcap, a memory-mappable probe set, or hex lines.')
+    parser.add_argument('--src_ip', default='10.0.0.1', help='pcap format: source IPv4 address (default: 10.0.0.1)')
+    parser.add_argument('--dst_ip', default='10.0.0.2', help='pcap format: destination IPv4 address (default: 10.0.0.2)')
+    parser.add_argument('--sport', type=int, default=50000, help='pcap format: UDP source port (default: 50000)')
+    parser.add_argument('--sport_step', type=int, default=0, help='pcap format: increase the source port by this much after every packet (default: 0)')
+    parser.add_argument('--dport', type=int, default=443, help='pcap format: UDP destination port (default: 443)')
+
+# argparse destinations added by add_output_arguments().
+OUTPUT_ARGS = ('output', 'format', 'src_ip', 'dst_ip', 'sport', 'sport_step', 'dport')
+
+def open_writer(fmt='frames', path=None, **pcap_options):
+    """Open a writer for one of FORMATS. pcap_options are passed to PcapWriter."""
+    if fmt == 'frames':
+        return FramesWriter(path)
+    if fmt == 'hex':
+        return HexWriter(path)
+    if fmt == 'pcap':
+        return PcapWriter(path, **pcap_options)
+    if fmt == 'probes':
+        return ProbesWriter(path)
+    raise ValueError(f"Unknown output format {fmt}, expected one of {', '.join(FORMATS)}.")
+
+def open_writer_from_args(args):
+    """Open the writer selected by the options of add_output_arguments()."""
+    return open_writer(args.format, args.output, src_ip=args.src_ip, dst_ip=args.dst_ip,
+                       sport=args.sport, dport=args.dport, sport_step=args.sport_step)
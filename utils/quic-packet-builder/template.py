@@ -0,0 +1,233 @@
+import argparse
+import json
+import struct
+import sys
+
+from build import encode_header, resolve_spec
+from crypto import QUICCrypto
+from decrypt import EXT_SERVER_NAME
+from output import add_output_arguments, open_writer_from_args
+from varint import decode_varint, encode_varint
+
+# Mass SNI payload generation. A reference Initial payload (the frames passed to build.py --payload) is parsed
+# once to find the server_name extension, every length field that covers it and the PADDING frames after the
+# CRYPTO frame. Each domain is then patched into one preallocated plaintext buffer and encrypted, with the header
+# built once per plaintext length. When the reference payload is padded, the padding shrinks or grows with the
+# domain so all packets keep the reference size (and the same header).
+
+CHUNK_SIZE = 1024
+_ZEROS = bytes(1 << 16)
+
+# struct formats for the field widths we patch, and the QUIC varint length prefix for each width.
+_FORMATS = {1: '!B', 2: '!H', 4: '!I', 8: '!Q'}
+_VARINT_PREFIX = {1: 0x00, 2: 0x40, 4: 0x80, 8: 0xc0}
+
+class ClientHelloTemplate:
+    """
+    A reference ClientHello with the offsets needed to swap its SNI in place.
+
+    :param payload: plaintext Initial payload holding a CRYPTO frame with a ClientHello that has a server_name extension
+    """
+
+    def __init__(self, payload: bytes):
+        payload = bytes(payload)
+        view = memoryview(payload)
+
+        # Find the CRYPTO frame, skipping any PADDING / PING frames before it.
+        offset = 0
+        while offset < len(view) and view[offset] in (0x00, 0x01):
+            offset += 1
+        if offset >= len(view) or view[offset] != 0x06:
+            raise ValueError("Reference payload has no CRYPTO frame.")
+        crypto_offset, offset = decode_varint(view, offset + 1)
+        if crypto_offset != 0:
+            raise ValueError("Reference CRYPTO frame does not start at offset 0.")
+        crypto_len_off = offset
+        crypto_len, data_start = decode_varint(view, offset)
+        crypto_end = data_start + crypto_len
+        if crypto_end > len(view) or view[data_start] != 0x01:
+            raise ValueError("Reference CRYPTO frame does not hold a complete ClientHello.")
+
+        # (offset, width, reference value, is_varint) of every length field covering the host name.
+        fields = [
+            (crypto_len_off, data_start - crypto_len_off, crypto_len, True),
+            # The 3-byte handshake length is patched as a 4-byte word together with the handshake type.
+            (data_start, 4, int.from_bytes(view[data_start:data_start + 4], 'big'), False),
+        ]
+
+        offset = data_start + 4 + 2 + 32
+        offset += 1 + view[offset]  # legacy_session_id
+        offset += 2 + int.from_bytes(view[offset:offset + 2], 'big')  # cipher_suites
+        offset += 1 + view[offset]  # legacy_compression_methods
+        fields.append((offset, 2, int.from_bytes(view[offset:offset + 2], 'big'), False))
+        ext_end = offset + 2 + fields[-1][2]
+        offset += 2
+
+        name_start = None
+        while offset + 4 <= ext_end:
+            ext_type = int.from_bytes(view[offset:offset + 2], 'big')
+            ext_len = int.from_bytes(view[offset + 2:offset + 4], 'big')
+            if ext_type == EXT_SERVER_NAME:
+                # extension length, server_name_list length, host_name length
+                for field_off in (offset + 2, offset + 4, offset + 7):
+                    fields.append((field_off, 2, int.from_bytes(view[field_off:field_off + 2], 'big'), False))
+                name_start = offset + 9
+                break
+            offset += 4 + ext_len
+        if name_start is None:
+            raise ValueError("Reference ClientHello has no server_name extension.")
+
+        self.reference_sni = bytes(view[name_start:name_start + fields[-1][2]])
+        name_end = name_start + len(self.reference_sni)
+
+        # Zero bytes right after the CRYPTO frame are PADDING frames that can absorb SNI length changes.
+        pad_end = crypto_end
+        while pad_end < len(payload) and payload[pad_end] == 0:
+            pad_end += 1
+
+        # Precompile each field into (pack_into, offset, reference word) so render() only adds
+        # the SNI length delta. Varints keep their reference width; the prefix bits ride along in the word.
+        self._fields = []
+        self._max_delta = 1 << 16
+        self._min_delta = -len(self.reference_sni)
+        for offset, width, value, is_varint in fields:
+            if is_varint:
+                word = value | (_VARINT_PREFIX[width] << (8 * width - 8))
+                limit = (1 << (8 * width - 2)) - 1 - value
+            elif offset == data_start:
+                word = value
+                limit = (1 << 24) - 1 - (value & 0xffffff)
+            else:
+                word = value
+                limit = (1 << (8 * width)) - 1 - value
+            self._fields.append((struct.Struct(_FORMATS[width]).pack_into, offset, word))
+            self._max_delta = min(self._max_delta, limit)
+
+        self.payload = payload
+        self._name_start = name_start
+        self._tail = payload[name_end:crypto_end]
+        self._pad_len = pad_end - crypto_end
+        self._trailer = payload[pad_end:]
+        self._buf = bytearray(len(payload) + 256)
+        self._buf[:name_start] = view[:name_start]
+        self._view = memoryview(self._buf)
+
+    def render(self, name: bytes) -> memoryview:
+        """
+        Patch name in as the SNI and return a view of the plaintext payload.
+
+        The view is only valid until the next call to render().
+        """
+        delta = len(name) - len(self.reference_sni)
+        if delta > self._max_delta or delta < self._min_delta:
+            raise ValueError(f"SNI of {len(name)} bytes does not fit the reference ClientHello's length fields.")
+        pad = max(self._pad_len - delta, 0)
+        end = self._name_start + len(name)
+        tail_end = end + len(self._tail)
+        pad_end = tail_end + pad
+        total = pad_end + len(self._trailer)
+        if total > len(self._buf):
+            # Views handed out earlier still pin the old buffer, so grow into a new one.
+            buf = bytearray(2 * total)
+            buf[:self._name_start] = self._buf[:self._name_start]
+            self._buf = buf
+            self._view = memoryview(buf)
+
+        buf = self._buf
+        for pack_into, offset, word in self._fields:
+            pack_into(buf, offset, word + delta)
+        buf[self._name_start:end] = name
+        buf[end:tail_end] = self._tail
+        buf[tail_end:pad_end] = _ZEROS[:pad]
+        buf[pad_end:total] = self._trailer
+        return self._view[:total]
+
+class InitialTemplate:
+    """
+    Encrypted client Initials for many SNIs from one reference packet spec.
+
+    :param spec: a build.py packet spec (see build.build_packet) whose payload is the reference ClientHello.
+        The DCID and SCID are fixed on construction so every packet shares one set of keys and one header.
+    """
+
+    def __init__(self, spec: dict):
+        spec = resolve_spec(spec)
+        if spec['length'] is not None or spec['additional_data'] is not None or spec['sample'] is not None:
+            raise ValueError("Templates compute length, additional data and sample themselves.")
+        self.hello = ClientHelloTemplate(bytes.fromhex(spec['payload']))
+        self.spec = spec
+
+        self._prefix, self._pn_bytes, version, dcid = encode_header(spec)
+        self._crypto = QUICCrypto(dcid, version)
+        self._aead = self._crypto.initial_keys(True).aead
+        self._nonce = self._crypto.nonce(True, int.from_bytes(self._pn_bytes, 'big'))
+        self._headers = {}
+
+    def _header(self, payload_len: int) -> bytes:
+        """The unprotected header (the AAD) for a plaintext of payload_len bytes."""
+        header = self._headers.get(payload_len)
+        if header is None:
+            length = len(self._pn_bytes) + payload_len + self._crypto.aead_key_length
+            header = self._prefix + encode_varint(length) + self._pn_bytes
+            self._headers[payload_len] = header
+        return header
+
+    def packets(self, domains):
+        """Yield one protected Initial (bytes) per domain, in order. domains is an iterable of str or bytes."""
+        pn_len = len(self._pn_bytes)
+        sample_offset = 4 - pn_len
+        chunk = []
+        for domain in domains:
+            chunk.append(domain.encode('ascii') if isinstance(domain, str) else domain)
+            if len(chunk) == CHUNK_SIZE:
+                yield from self._encrypt_chunk(chunk, sample_offset)
+                chunk = []
+        if chunk:
+            yield from self._encrypt_chunk(chunk, sample_offset)
+
+    def _encrypt_chunk(self, names, sample_offset):
+        headers = []
+        ciphertexts = []
+        for name in names:
+            plaintext = self.hello.render(name)
+            header = self._header(len(plaintext))
+            headers.append(header)
+            ciphertexts.append(self._aead.encrypt(self._nonce, plaintext, header))
+
+        samples = [ct[sample_offset:sample_offset + 16] for ct in ciphertexts]
+        pn_len = len(self._pn_bytes)
+        protected = self._crypto.header_protect_many(samples, [h[0] for h in headers], [h[-pn_len:] for h in headers])
+        for header, ct, (first_byte, pn_bytes) in zip(headers, ciphertexts, protected):
+            yield b''.join((first_byte, header[1:-pn_len], pn_bytes, ct))
+
+def read_domains(f):
+    """Yield the domains of a blocklist file, one per line, skipping blank lines and # comments."""
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+def main():
+    parser = argparse.ArgumentParser(description='Build one encrypted QUIC Initial per domain from a reference ClientHello.')
+    parser.add_argument('--payload', required=True, help='Reference Initial payload in hex, as for build.py --payload. Its ClientHello must have a server_name extension.')
+    parser.add_argument('--spec', default='{}', help='Other packet fields as a JSON object with build.py field names, e.g. \'{"dcid_len": 0, "scid_len": 0}\'.')
+    parser.add_argument('--domains', default='-', help='File with one domain per line, e.g. a daily blocklist (default: stdin).')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    spec = json.loads(args.spec)
+    spec['payload'] = args.payload
+    template = InitialTemplate(spec)
+
+    domains_in = sys.stdin if args.domains == '-' else open(args.domains, 'r')
+    try:
+        with open_writer_from_args(args) as writer:
+            for packet in template.packets(read_domains(domains_in)):
+                writer.write(packet)
+    finally:
+        if domains_in is not sys.stdin:
+            domains_in.close()
+    print(f"Built {writer.count} packets.", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
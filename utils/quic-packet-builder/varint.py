@@ -0,0 +1,169 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# QUIC variable-length integers (RFC 9000, Section 16). The two most significant bits of the first byte give the
+# encoding length (1, 2, 4 or 8 bytes); the remaining 6, 14, 30 or 62 bits hold the value in network byte order.
+#
+# encode_varint() can also produce non-minimal encodings (e.g. 37 as 8 bytes), which are legal on the wire and
+# useful for fuzzing parsers. The *_batch functions work on NumPy arrays, so a field can be pulled out of every
+# packet of a capture at once; NumPy is only needed for those.
+
+MAX_VARINT = (1 << 62) - 1
+
+# Encoding length -> the prefix of the first byte.
+_PREFIX = {1: 0x00, 2: 0x40, 4: 0x80, 8: 0xc0}
+
+def varint_length(value):
+    """Length of the minimal encoding of value."""
+    if value < 0 or value > MAX_VARINT:
+        raise ValueError(f"Varint value out of range: {value}")
+    if value <= 63:
+        return 1
+    if value <= 16383:
+        return 2
+    if value <= 1073741823:
+        return 4
+    return 8
+
+def encode_varint(value, length=None):
+    """
+    Encode a value as a QUIC variable-length integer.
+
+    :param value: 0 <= value < 2^62
+    :param length: encoding length (1, 2, 4 or 8). Defaults to the minimal one; a longer one gives a
+        non-minimal encoding.
+    """
+    if length is None:
+        if 0 <= value <= 63:
+            return bytes((value,))
+        if 0 <= value <= 16383:
+            return (value | 0x4000).to_bytes(2, 'big')
+        if 0 <= value <= 1073741823:
+            return (value | 0x80000000).to_bytes(4, 'big')
+        length = varint_length(value)
+    elif length not in _PREFIX:
+        raise ValueError(f"Varint length must be 1, 2, 4 or 8, not {length}.")
+    elif length < varint_length(value):
+        raise ValueError(f"Value {value} does not fit a {length}-byte varint.")
+    return (value | (_PREFIX[length] << (8 * length - 8))).to_bytes(length, 'big')
+
+def decode_varint(buf, offset=0):
+    """Decode a QUIC variable-length integer at buf[offset]. Returns (value, offset after it)."""
+    if offset >= len(buf):
+        raise ValueError("Truncated varint.")
+    first = buf[offset]
+    length = 1 << (first >> 6)
+    if offset + length > len(buf):
+        raise ValueError("Truncated varint.")
+    value = first & 0x3f
+    for i in range(offset + 1, offset + length):
+        value = (value << 8) | buf[i]
+    return value, offset + length
+
+def iter_varints(buf, offset=0, end=None):
+    """Yield the consecutive varints in buf[offset:end], e.g. ACK ranges or transport parameter ids and lengths."""
+    end = len(buf) if end is None else end
+    view = memoryview(buf)[:end]
+    while offset < end:
+        value, offset = decode_varint(view, offset)
+        yield value
+
+class VarintReader:
+    """
+    Incremental varint parser for data that arrives in pieces (a socket, a file read in chunks).
+
+    feed() appends bytes; iterating yields every varint that is complete so far and keeps any partial one
+    for the next feed().
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._offset = 0
+
+    def feed(self, data):
+        if self._offset:
+            del self._buf[:self._offset]
+            self._offset = 0
+        self._buf += data
+
+    def __iter__(self):
+        buf = self._buf
+        while self._offset < len(buf):
+            length = 1 << (buf[self._offset] >> 6)
+            if self._offset + length > len(buf):
+                return
+            value, self._offset = decode_varint(buf, self._offset)
+            yield value
+
+    def pending(self):
+        """Number of buffered bytes of an incomplete varint."""
+        return len(self._buf) - self._offset
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("The batch varint functions need NumPy (pip install numpy).")
+
+def encode_batch(values, length=None):
+    """
+    Encode an array of values back to back.
+
+    :param values: array-like of integers below 2^62
+    :param length: a fixed encoding length for every value (non-minimal where needed), or None for minimal
+    :return: (bytes, offsets) where offsets is an int64 array with the start of each encoding
+    """
+    _require_numpy()
+    values = np.asarray(values, dtype=np.uint64)
+    if values.size and int(values.max()) > MAX_VARINT:
+        raise ValueError("Varint value out of range.")
+    if length is None:
+        lengths = np.where(values <= 63, 1, np.where(values <= 16383, 2, np.where(values <= 1073741823, 4, 8)))
+    else:
+        if length not in _PREFIX:
+            raise ValueError(f"Varint length must be 1, 2, 4 or 8, not {length}.")
+        if values.size and int(values.max()) >= 1 << (8 * length - 2):
+            raise ValueError(f"Values do not fit a {length}-byte varint.")
+        lengths = np.full(values.shape, length)
+    lengths = lengths.astype(np.int64)
+
+    # One row of up to 8 big-endian bytes per value; only the first `length` columns are kept.
+    cols = np.arange(8)
+    shifts = 8 * (lengths[:, None] - 1 - cols)
+    keep = shifts >= 0
+    rows = (values[:, None] >> np.where(keep, shifts, 0).astype(np.uint64)) & np.uint64(0xff)
+    prefix = np.select([lengths == 2, lengths == 4, lengths == 8], [0x40, 0x80, 0xc0], 0)
+    rows[:, 0] |= prefix.astype(np.uint64)
+
+    offsets = np.zeros(values.shape, dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    return rows[keep].astype(np.uint8).tobytes(), offsets
+
+def decode_batch(buf, offsets):
+    """
+    Decode one varint at each of offsets in buf.
+
+    :param buf: bytes-like or uint8 array, e.g. a whole capture
+    :param offsets: array-like of positions in buf
+    :return: (values, lengths) as uint64 and int64 arrays
+    :raises ValueError: if a varint runs past the end of buf
+    """
+    _require_numpy()
+    data = np.frombuffer(buf, dtype=np.uint8) if not isinstance(buf, np.ndarray) else buf
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if offsets.size == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    if int(offsets.min()) < 0 or int(offsets.max()) >= len(data):
+        raise ValueError("Truncated varint.")
+    lengths = np.left_shift(1, data[offsets] >> 6).astype(np.int64)
+    if int((offsets + lengths).max()) > len(data):
+        raise ValueError("Truncated varint.")
+
+    cols = np.arange(8)
+    keep = cols < lengths[:, None]
+    idx = np.where(keep, offsets[:, None] + cols, 0)
+    rows = np.where(keep, data[idx], 0).astype(np.uint64)
+    rows[:, 0] &= np.uint64(0x3f)
+    shifts = np.where(keep, 8 * (lengths[:, None] - 1 - cols), 0).astype(np.uint64)
+    values = np.bitwise_or.reduce(rows << shifts, axis=1)
+    return values, lengths